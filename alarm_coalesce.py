@@ -0,0 +1,114 @@
+"""
+Склейка повторов тревог: DSM повторяет одно и то же нарушение, пока оно длится
+(head_pose, closed_eyes), — повторы одного устройства и типа сворачиваются в одно событие
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class AlarmCoalescer:
+    """Открытые события по ключу (device, type).
+
+    Тревога, пришедшая не позже window секунд после предыдущей с тем же ключом, не создает
+    новую запись: у открытого события растут count и last_seen. Событие закрывается и
+    удаляется из памяти, когда повторов нет дольше window (TTL от последнего повтора).
+    Открытых событий не больше max_open — при переполнении закрывается самое давнее.
+    Тревоги без типа (битый JSON) не склеиваются. window <= 0 отключает склейку.
+    """
+
+    def __init__(self, window=5.0, max_open=10000):
+        self.window = window
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        # key -> [event, время приема последнего повтора, есть неотправленные изменения];
+        # порядок — по последней активности, самые давние в начале
+        self._open = OrderedDict()
+        # Закрытые при переполнении события с неотправленными изменениями
+        self._closed_dirty = []
+        self.opened = 0
+        self.merged = 0
+        self.closed = 0
+        self.evicted = 0
+
+    def add(self, alarms):
+        """Принимает пачку тревог; возвращает те, что открыли новые события.
+
+        Каждой тревоге проставляются count=1 и last_seen=ts; повторы только
+        обновляют открытое событие и в результат не попадают.
+        """
+        fresh = []
+        with self._lock:
+            for alarm in alarms:
+                alarm.setdefault('count', 1)
+                alarm.setdefault('last_seen', alarm['ts'])
+                if self.window <= 0 or alarm['type'] is None:
+                    fresh.append(alarm)
+                    continue
+                key = (alarm['device'], alarm['type'])
+                received_at = alarm['received_at']
+                entry = self._open.get(key)
+                if entry is not None and received_at - entry[1] <= self.window:
+                    event = entry[0]
+                    event['count'] += 1
+                    event['last_seen'] = max(event['last_seen'], alarm['ts'])
+                    entry[1] = received_at
+                    entry[2] = True
+                    self._open.move_to_end(key)
+                    self.merged += 1
+                    continue
+                if entry is not None:
+                    self._close(key, entry)
+                self._open[key] = [alarm, received_at, False]
+                self.opened += 1
+                fresh.append(alarm)
+                while len(self._open) > self.max_open:
+                    oldest_key, oldest = next(iter(self._open.items()))
+                    self._close(oldest_key, oldest)
+                    self.evicted += 1
+        return fresh
+
+    def _close(self, key, entry):
+        del self._open[key]
+        self.closed += 1
+        if entry[2]:
+            self._closed_dirty.append(dict(entry[0]))
+
+    def collect(self, now=None):
+        """Снимки событий, изменившихся с прошлого вызова; закрывает простаивающие дольше window"""
+        now = time.time() if now is None else now
+        with self._lock:
+            changed, self._closed_dirty = self._closed_dirty, []
+            for key, entry in list(self._open.items()):
+                # id присваивает хранилище сразу после add(); без него событие еще не записано
+                if entry[2] and 'id' in entry[0]:
+                    changed.append(dict(entry[0]))
+                    entry[2] = False
+                if now - entry[1] > self.window and not entry[2]:
+                    del self._open[key]
+                    self.closed += 1
+        return changed
+
+    def start(self, on_changed, interval=1.0):
+        """Поток, который раз в interval передает изменившиеся события в on_changed(events)"""
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    changed = self.collect()
+                    if changed:
+                        on_changed(changed)
+                except Exception as e:
+                    print(f"[COALESCE] Update failed: {e}")
+        threading.Thread(target=loop, daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open': len(self._open),
+                'opened': self.opened,
+                'merged': self.merged,
+                'closed': self.closed,
+                'evicted': self.evicted,
+            }
@@ -0,0 +1,123 @@
+"""
+Лента последних тревог для push-доставки в браузер (SSE):
+каждая запись получает номер, подписчик читает только записи новее своего курсора
+"""
+
+import asyncio
+import json
+import threading
+from collections import deque
+
+from loop_waiters import LoopWaiters
+
+
+class AlarmFeed:
+    """Кольцевой журнал структурированных тревог с ожиданием новых записей.
+
+    Записи двух видов: 'new' — новая тревога, 'update' — новые count/last_seen
+    склеенного события. Глобального флага "есть новое" нет: у каждого подписчика свой
+    курсор (номер последней полученной записи), поэтому вкладки не мешают друг другу.
+    Каждая запись сериализуется в JSON один раз при добавлении.
+    """
+
+    def __init__(self, maxlen=200):
+        self._cond = threading.Condition()
+        self._items = deque(maxlen=maxlen)
+        self._seq = 0
+        self._waiters = LoopWaiters()
+
+    def add(self, alarms):
+        """Добавляет пачку новых тревог и будит подписчиков"""
+        self._publish('new', alarms)
+
+    def update(self, events):
+        """Публикует изменившиеся count/last_seen уже отправленных тревог"""
+        self._publish('update', events)
+
+    def _publish(self, kind, alarms):
+        if not alarms:
+            return
+        encoded = [(alarm['id'], json.dumps(alarm, ensure_ascii=False)) for alarm in alarms]
+        with self._cond:
+            for alarm_id, data in encoded:
+                self._seq += 1
+                self._items.append((self._seq, kind, alarm_id, data))
+            self._cond.notify_all()
+            waiters = self._waiters.detach()
+        LoopWaiters.wake(waiters)
+
+    def head(self):
+        with self._cond:
+            return self._seq
+
+    def cursor_after(self, alarm_id):
+        """Курсор, начиная с которого лента содержит все новые тревоги с id больше alarm_id"""
+        with self._cond:
+            for seq, kind, item_id, _ in self._items:
+                if kind == 'new' and item_id > alarm_id:
+                    return seq - 1
+            return self._seq
+
+    def since(self, cursor):
+        """Записи новее cursor: (new_cursor, [json новых], [json обновлений], reset).
+
+        reset=True, если курсор из будущего (сервер перезапущен и нумерация началась заново) —
+        подписчик должен очистить окно и принять ленту с начала.
+        """
+        with self._cond:
+            return self._since_locked(cursor)
+
+    def _since_locked(self, cursor):
+        reset = cursor > self._seq
+        if reset:
+            cursor = 0
+        # Записи старше буфера уже вытеснены — отдаем то, что осталось
+        new, updates = [], []
+        for seq, kind, _, data in self._items:
+            if seq > cursor:
+                (new if kind == 'new' else updates).append(data)
+        return self._seq, new, updates, reset
+
+    def wait(self, cursor, timeout=None):
+        """Блокирующее ожидание записей новее cursor; None по таймауту"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq != cursor, timeout):
+                return None
+            return self._since_locked(cursor)
+
+    async def wait_async(self, cursor, timeout=None):
+        """Асинхронный вариант wait() для SSE обработчика"""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self._seq != cursor:
+                return self._since_locked(cursor)
+            fut = self._waiters.future(loop)
+        if not await LoopWaiters.wait(fut, timeout):
+            return None
+        with self._cond:
+            if self._seq != cursor:
+                return self._since_locked(cursor)
+            return None
+
+
+async def sse_events(feed, cursor, keepalive=15.0):
+    """Поток Server-Sent Events, id — курсор: event "alarms" с JSON-списком новых тревог
+    и event "updates" с новыми count/last_seen уже отправленных.
+
+    Браузер при переподключении присылает Last-Event-ID и продолжает с того же места.
+    """
+    # Подсказка браузеру, через сколько переподключаться после обрыва
+    yield "retry: 2000\n\n"
+    while True:
+        result = await feed.wait_async(cursor, keepalive)
+        if result is None:
+            yield ": keepalive\n\n"
+            continue
+        cursor, new, updates, reset = result
+        if reset:
+            yield f"id: {cursor}\nevent: reset\ndata: {{}}\n\n"
+        # Записи уже сериализованы при добавлении — только склеиваем
+        if new:
+            yield f"id: {cursor}\nevent: alarms\ndata: [{','.join(new)}]\n\n"
+        if updates:
+            yield f"id: {cursor}\nevent: updates\ndata: [{','.join(updates)}]\n\n"
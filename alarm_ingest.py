@@ -0,0 +1,172 @@
+"""
+Прием UDP тревог DSM: вычитывание сокета пачками, разбор JSON в отдельном потоке,
+ограниченный по частоте лог и счетчики принятых/разобранных/битых/потерянных датаграмм
+"""
+
+import json
+import queue
+import socket
+import threading
+import time
+
+# Максимальный размер UDP датаграммы — сообщения не обрезаются
+MAX_DATAGRAM = 65535
+
+
+class RateLimitedLog:
+    """Печатает не больше max_per_interval строк за interval секунд, остальное суммирует"""
+
+    def __init__(self, prefix, max_per_interval=5, interval=1.0):
+        self.prefix = prefix
+        self.max_per_interval = max_per_interval
+        self.interval = interval
+        self._window_start = time.monotonic()
+        self._printed = 0
+        self._suppressed = 0
+
+    def log(self, message):
+        if self.max_per_interval <= 0:
+            return
+        now = time.monotonic()
+        if now - self._window_start >= self.interval:
+            if self._suppressed:
+                print(f"{self.prefix} ... {self._suppressed} more messages suppressed")
+            self._window_start = now
+            self._printed = 0
+            self._suppressed = 0
+        if self._printed < self.max_per_interval:
+            self._printed += 1
+            print(f"{self.prefix} {message}")
+        else:
+            self._suppressed += 1
+
+
+class AlarmIngestor:
+    """UDP приемник тревог: поток приема и поток разбора, связанные ограниченной очередью.
+
+    Поток приема только вычитывает сокет (до batch_max датаграмм за проход);
+    разбор JSON и передача записей в sinks выполняются в отдельном потоке.
+    Если разбор не успевает и очередь переполнена, пачка отбрасывается и учитывается в dropped.
+    Каждый sink получает список записей:
+    {'raw': str, 'data': dict | None, 'addr': (host, port), 'received_at': float}.
+    """
+
+    def __init__(self, host="0.0.0.0", port=8008, sinks=None, rcvbuf=4 * 1024 * 1024,
+                 batch_max=256, queue_batches=1024, log_per_second=5):
+        self.host = host
+        self.port = port
+        self.sinks = list(sinks or [])
+        self.rcvbuf = rcvbuf
+        self.batch_max = batch_max
+        self._queue = queue.Queue(maxsize=queue_batches)
+        self._log = RateLimitedLog("[UDP]", max_per_interval=log_per_second)
+        self._lock = threading.Lock()
+        self._sock = None
+        self.received = 0
+        self.parsed = 0
+        self.malformed = 0
+        self.dropped = 0
+        self.batches = 0
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def bind(self):
+        """Создает сокет; OSError, если порт занят"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        except OSError as e:
+            print(f"[UDP] Could not enlarge receive buffer: {e}")
+        try:
+            sock.bind((self.host, self.port))
+        except OSError:
+            sock.close()
+            raise
+        sock.settimeout(1.0)
+        self._sock = sock
+        self.port = sock.getsockname()[1]
+        return sock
+
+    def start(self):
+        """Запускает потоки приема и разбора; False, если порт занят"""
+        try:
+            self.bind()
+        except OSError as e:
+            print(f"[UDP] Port {self.port} already in use, skipping UDP listener: {e}")
+            return False
+        print(f"[UDP] Listening for DSM alarms on {self.host}:{self.port}")
+        threading.Thread(target=self._receive_loop, daemon=True).start()
+        threading.Thread(target=self._parse_loop, daemon=True).start()
+        return True
+
+    def _receive_loop(self):
+        sock = self._sock
+        dontwait = getattr(socket, 'MSG_DONTWAIT', 0)
+        while True:
+            try:
+                data, addr = sock.recvfrom(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except Exception as e:
+                print(f"[UDP] Error: {e}")
+                time.sleep(1)
+                continue
+            received_at = time.time()
+            batch = [(data, addr, received_at)]
+            # Дочитываем все, что уже лежит в буфере сокета, без блокировки
+            while dontwait and len(batch) < self.batch_max:
+                try:
+                    data, addr = sock.recvfrom(MAX_DATAGRAM, dontwait)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError:
+                    break
+                batch.append((data, addr, received_at))
+            with self._lock:
+                self.received += len(batch)
+                self.batches += 1
+            try:
+                self._queue.put_nowait(batch)
+            except queue.Full:
+                with self._lock:
+                    self.dropped += len(batch)
+
+    def _parse_loop(self):
+        while True:
+            batch = self._queue.get()
+            records = []
+            malformed = 0
+            for data, addr, received_at in batch:
+                try:
+                    raw = data.decode("utf-8")
+                except UnicodeDecodeError:
+                    raw = data.decode("utf-8", errors="replace")
+                try:
+                    parsed = json.loads(raw)
+                except ValueError:
+                    parsed = None
+                if not isinstance(parsed, dict):
+                    parsed = None
+                    malformed += 1
+                records.append({'raw': raw, 'data': parsed, 'addr': addr, 'received_at': received_at})
+                self._log.log(f"RAW from {addr}: {raw}")
+            with self._lock:
+                self.parsed += len(records) - malformed
+                self.malformed += malformed
+            for sink in self.sinks:
+                try:
+                    sink(records)
+                except Exception as e:
+                    print(f"[UDP] Sink failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'received': self.received,
+                'parsed': self.parsed,
+                'malformed': self.malformed,
+                'dropped': self.dropped,
+                'batches': self.batches,
+                'queued_batches': self._queue.qsize(),
+            }
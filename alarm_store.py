@@ -0,0 +1,337 @@
+"""
+Постоянное хранилище тревог DSM: SQLite в режиме WAL под RESULTS_DIR,
+пакетная запись из приемника UDP и индексы по времени, устройству и типу нарушения
+"""
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alarms (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    device TEXT,
+    type TEXT,
+    confidence REAL,
+    received_at REAL NOT NULL,
+    source TEXT,
+    raw TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 1,
+    last_seen REAL
+);
+CREATE INDEX IF NOT EXISTS idx_alarms_ts ON alarms (ts);
+CREATE INDEX IF NOT EXISTS idx_alarms_device_ts ON alarms (device, ts);
+CREATE INDEX IF NOT EXISTS idx_alarms_type_ts ON alarms (type, ts);
+CREATE INDEX IF NOT EXISTS idx_alarms_device_type_ts ON alarms (device, type, ts);
+"""
+
+# Имена полей, под которыми ядро может прислать время, устройство, тип и уверенность
+TS_KEYS = ('timestamp', 'ts', 'time')
+DEVICE_KEYS = ('device_id', 'device', 'cab', 'camera_id')
+TYPE_KEYS = ('type', 'violation', 'alarm', 'event')
+CONFIDENCE_KEYS = ('confidence', 'score', 'conf')
+
+
+def _first(data, keys):
+    for key in keys:
+        value = data.get(key)
+        if value is not None and value != '':
+            return value
+    return None
+
+
+def parse_ts(value, default=None):
+    """Время тревоги: epoch (с или мс) либо ISO-строка; иначе время приема"""
+    if value is None:
+        return default
+    if not isinstance(value, (int, float)):
+        # Число строкой ("1700000000000") проходит ту же проверку на миллисекунды, что и число
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            try:
+                return datetime.fromisoformat(str(value)).timestamp()
+            except ValueError:
+                return default
+    return value / 1000.0 if value > 1e11 else float(value)
+
+
+# Поля структурированной тревоги в порядке столбцов таблицы;
+# count и last_seen — число склеенных повторов и время последнего (alarm_coalesce.py)
+ALARM_FIELDS = ('id', 'ts', 'device', 'type', 'confidence', 'received_at', 'source', 'raw', 'count', 'last_seen')
+
+# Столбцы, добавленные после первой версии схемы: (имя, определение)
+MIGRATIONS = (
+    ('count', 'INTEGER NOT NULL DEFAULT 1'),
+    ('last_seen', 'REAL'),
+)
+
+
+def parse_alarm(record):
+    """Запись приемника -> структурированная тревога {ts, device, type, confidence, received_at, source, raw, count, last_seen}"""
+    data = record.get('data') or {}
+    received_at = record.get('received_at') or time.time()
+    confidence = _first(data, CONFIDENCE_KEYS)
+    try:
+        confidence = float(confidence) if confidence is not None else None
+    except (TypeError, ValueError):
+        confidence = None
+    device = _first(data, DEVICE_KEYS)
+    alarm_type = _first(data, TYPE_KEYS)
+    addr = record.get('addr')
+    ts = parse_ts(_first(data, TS_KEYS), received_at)
+    return {
+        'ts': ts,
+        'device': str(device) if device is not None else None,
+        'type': str(alarm_type) if alarm_type is not None else None,
+        'confidence': confidence,
+        'received_at': received_at,
+        'source': f"{addr[0]}:{addr[1]}" if addr else None,
+        'raw': record['raw'],
+        'count': 1,
+        'last_seen': ts,
+    }
+
+
+def parse_cursor(value):
+    """Курсор страницы "ts:id" -> (ts, id); None, если курсор пустой или битый"""
+    if not value:
+        return None
+    try:
+        ts, alarm_id = str(value).rsplit(':', 1)
+        return float(ts), int(alarm_id)
+    except ValueError:
+        return None
+
+
+def make_cursor(alarm):
+    return f"{alarm['ts']!r}:{alarm['id']}"
+
+
+class AlarmStore:
+    """Хранилище тревог: новые записи только добавляются, у склеенных событий обновляются count и last_seen.
+
+    add(alarms) сразу присваивает тревогам id (они же ключи страниц истории) и только
+    кладет пачку в очередь; update(events) ставит в ту же очередь новые count/last_seen.
+    Отдельный поток пишет накопленное одной транзакцией не реже чем раз в flush_interval.
+    Чтение идет через отдельные соединения (WAL не блокирует читателей записью).
+    """
+
+    def __init__(self, path, batch_max=1000, flush_interval=0.5, queue_batches=1024):
+        self.path = path
+        self.batch_max = batch_max
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_batches)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writer = None
+        self.written = 0
+        self.updated = 0
+        self.dropped = 0
+        self.write_errors = 0
+        self.last_flush_s = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(alarms)")}
+        for name, definition in MIGRATIONS:
+            if name not in columns:
+                conn.execute(f"ALTER TABLE alarms ADD COLUMN {name} {definition}")
+        conn.commit()
+        # Писатель один, поэтому id выдаются здесь, до записи, и не ждут транзакции
+        self.last_written_id = conn.execute("SELECT MAX(id) FROM alarms").fetchone()[0] or 0
+        self._next_id = self.last_written_id + 1
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # В WAL NORMAL не теряет целостность при сбое, лишь последние транзакции
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def start(self):
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+        return self
+
+    def add(self, alarms):
+        """Присваивает тревогам (parse_alarm) id и ставит их в очередь записи.
+
+        Возвращает те же тревоги; не блокирует поток разбора,
+        при переполнении очереди пачка не сохраняется, но все равно возвращается.
+        """
+        if not alarms:
+            return alarms
+        with self._lock:
+            for alarm in alarms:
+                alarm['id'] = self._next_id
+                self._next_id += 1
+        self._put('insert', alarms)
+        return alarms
+
+    def update(self, events):
+        """Ставит в очередь новые count/last_seen уже добавленных тревог"""
+        if events:
+            self._put('update', [(e['count'], e['last_seen'], e['id']) for e in events])
+
+    def _put(self, kind, items):
+        if self._writer is None:
+            self.start()
+        try:
+            self._queue.put_nowait((kind, items))
+        except queue.Full:
+            with self._lock:
+                self.dropped += len(items)
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            ops = [self._queue.get()]
+            size = len(ops[0][1])
+            # Добираем все, что накопилось, в одну транзакцию
+            deadline = time.monotonic() + self.flush_interval
+            while size < self.batch_max:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    op = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                ops.append(op)
+                size += len(op[1])
+            # Вставки раньше обновлений: обновление всегда ставится в очередь после вставки своей тревоги
+            rows = [tuple(a[f] for f in ALARM_FIELDS) for kind, items in ops if kind == 'insert' for a in items]
+            # Для каждой тревоги достаточно последнего обновления
+            updates = list({u[2]: u for kind, items in ops if kind == 'update' for u in items}.values())
+            started = time.perf_counter()
+            try:
+                with conn:
+                    conn.executemany(
+                        f"INSERT INTO alarms ({', '.join(ALARM_FIELDS)}) "
+                        f"VALUES ({', '.join('?' * len(ALARM_FIELDS))})",
+                        rows,
+                    )
+                    conn.executemany("UPDATE alarms SET count = ?, last_seen = ? WHERE id = ?", updates)
+            except sqlite3.Error as e:
+                print(f"[ALARM_STORE] Write failed, {len(rows)} alarms and {len(updates)} updates lost: {e}")
+                with self._lock:
+                    self.write_errors += 1
+                    self.dropped += len(rows)
+                continue
+            with self._lock:
+                self.written += len(rows)
+                self.updated += len(updates)
+                if rows:
+                    self.last_written_id = max(self.last_written_id, rows[-1][0])
+                self.last_flush_s = time.perf_counter() - started
+
+    def flush(self, timeout=5.0):
+        """Ждет, пока очередь записи опустеет (для тестов и бенчмарков)"""
+        deadline = time.monotonic() + timeout
+        while self._queue.qsize() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Последняя пачка могла быть взята из очереди, но еще не записана
+        time.sleep(self.flush_interval + 0.05)
+
+    def query(self, device=None, alarm_type=None, since=None, until=None, limit=100, before=None):
+        """Тревоги по фильтрам, новые первыми; since/until — epoch секунды.
+
+        before=(ts, id) — keyset-курсор: следующая страница начинается сразу после этой тревоги,
+        поэтому листание истории не зависит от OFFSET и не сдвигается от новых записей.
+        """
+        where, params = [], []
+        if device is not None:
+            where.append("device = ?")
+            params.append(str(device))
+        if alarm_type is not None:
+            where.append("type = ?")
+            params.append(alarm_type)
+        if since is not None:
+            where.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("ts < ?")
+            params.append(until)
+        if before is not None:
+            # Сравнение пар использует индекс по ts как границу диапазона
+            where.append("(ts, id) < (?, ?)")
+            params.extend(before)
+        sql = f"SELECT {', '.join(ALARM_FIELDS)} FROM alarms"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY ts DESC, id DESC LIMIT ?"
+        params.append(int(limit))
+        return [dict(row) for row in self._reader().execute(sql, params)]
+
+    def count(self, device=None, alarm_type=None, since=None, until=None):
+        where, params = [], []
+        for clause, value in (("device = ?", device), ("type = ?", alarm_type),
+                              ("ts >= ?", since), ("ts < ?", until)):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        sql = "SELECT COUNT(*) FROM alarms"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return self._reader().execute(sql, params).fetchone()[0]
+
+    def recent(self, limit):
+        """Последние limit тревог в порядке поступления — для ленты после перезапуска"""
+        rows = self._reader().execute(
+            f"SELECT {', '.join(ALARM_FIELDS)} FROM alarms ORDER BY id DESC LIMIT ?", (int(limit),)
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'written': self.written,
+                'updated': self.updated,
+                'last_written_id': self.last_written_id,
+                'dropped': self.dropped,
+                'write_errors': self.write_errors,
+                'queued_batches': self._queue.qsize(),
+                'last_flush_s': self.last_flush_s,
+            }
+
+
+def main():
+    """Выборка из хранилища: python alarm_store.py --device 12 --type closed_eyes --since 2025-01-10T20:00"""
+    import argparse
+    parser = argparse.ArgumentParser(description="Поиск тревог в хранилище")
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', 'alarms.db'))
+    parser.add_argument('--device')
+    parser.add_argument('--type', dest='alarm_type')
+    parser.add_argument('--since', help="ISO время или epoch")
+    parser.add_argument('--until', help="ISO время или epoch")
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    store = AlarmStore(args.db)
+    since = parse_ts(args.since, None)
+    until = parse_ts(args.until, None)
+    started = time.perf_counter()
+    rows = store.query(args.device, args.alarm_type, since, until, args.limit)
+    total = store.count(args.device, args.alarm_type, since, until)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    for row in rows:
+        print(json.dumps(row, ensure_ascii=False))
+    print(f"{len(rows)} of {total} alarms in {elapsed_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
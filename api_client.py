@@ -0,0 +1,254 @@
+"""
+Общий HTTP клиент к API рокчипа: пул keep-alive соединений, таймауты по эндпоинтам,
+ограниченные повторы с экспоненциальной задержкой и метрики задержки по эндпоинтам
+"""
+
+import copy
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# (connect, read) в секундах. Подключение по VPN либо устанавливается за пару секунд, либо не
+# установится вовсе; на чтение даем больше — рокчип может сохранять конфиг на флеш
+DEFAULT_TIMEOUT = (3.0, 10.0)
+ENDPOINT_TIMEOUTS = {
+    ('GET', '/config'): (3.0, 8.0),
+    ('PATCH', '/config'): (3.0, 8.0),
+    ('PUT', '/config'): (3.0, 15.0),
+    ('POST', '/head_calibrate'): (3.0, 10.0),
+}
+
+# Повтор запроса, который мог дойти до сервера, безопасен только для идемпотентных методов.
+# PATCH к ним не относится: повтор примененного JSON Patch применит его еще раз, а с If-Match
+# получит ложный 412
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'})
+RETRY_STATUSES = frozenset({502, 503, 504})
+
+
+class ApiClient:
+    """Один requests.Session на все вызовы API: соединения переиспользуются между кликами.
+
+    Ошибки requests (ConnectionError, Timeout) пробрасываются вызывающему коду как раньше,
+    но только после исчерпания повторов. Неидемпотентные запросы (POST, PATCH) повторяются лишь
+    при таймауте подключения — когда запрос точно не ушел на сервер.
+    """
+
+    def __init__(self, base_url, retries=2, backoff=0.3, max_backoff=2.0, pool_size=8, hosts=4, registry=None):
+        self.base_url = base_url.rstrip('/')
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeouts = dict(ENDPOINT_TIMEOUTS)
+        self.session = requests.Session()
+        self.pool_size = pool_size
+        self.hosts = 0
+        self.ensure_hosts(hosts)
+        self._lock = threading.Lock()
+        self._stats = {}
+        # Доступен ли основной API (base_url) по последнему запросу; None — еще не обращались
+        self.online = None
+        self.checked_at = None
+        self.metrics = registry or metrics.MetricsRegistry()
+        self._latency = self.metrics.histogram(
+            'api_request_duration_seconds', 'API request latency including retries',
+            ('method', 'endpoint'), buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+        )
+        self._requests = self.metrics.counter(
+            'api_requests_total', 'API requests by final outcome', ('method', 'endpoint', 'status'),
+        )
+        self._retries = self.metrics.counter(
+            'api_retries_total', 'API request retries', ('method', 'endpoint'),
+        )
+
+    def ensure_hosts(self, hosts):
+        """Держит открытыми пулы не меньше чем для hosts хостов (по одному пулу на хост).
+
+        При отправке на парк устройств пулов должно быть не меньше числа устройств,
+        иначе они вытесняют друг друга и соединения устанавливаются заново.
+        """
+        if hosts <= self.hosts:
+            return
+        adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=self.pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.hosts = hosts
+
+    def set_base_url(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.online = None
+
+    def offline(self, recheck_after):
+        """True, если основной API не ответил меньше recheck_after секунд назад:
+        до этого времени к нему можно не обращаться"""
+        return self.online is False and time.monotonic() - self.checked_at < recheck_after
+
+    def _delay(self, attempt):
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def request(self, method, path, timeout=None, retries=None, **kwargs):
+        """Запрос к API; path — путь относительно base_url или полный URL другого рокчипа"""
+        method = method.upper()
+        url = path if '://' in path else self.base_url + path
+        endpoint = urlsplit(url).path or '/'
+        if timeout is None:
+            timeout = self.timeouts.get((method, endpoint), DEFAULT_TIMEOUT)
+        primary = url.startswith(self.base_url + '/')
+        if retries is None:
+            # Основной API не ответил в прошлый раз: одна попытка без повторов, а не ~10 с на каждый клик
+            retries = 0 if primary and self.online is False else self.retries
+        idempotent = method in IDEMPOTENT_METHODS
+        started = time.perf_counter()
+        attempt = 0
+        status = 'error'
+        try:
+            while True:
+                error = None
+                try:
+                    response = self.session.request(method, url, timeout=timeout, **kwargs)
+                except requests.exceptions.ConnectTimeout as e:
+                    error, retryable = e, True
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    error, retryable = e, idempotent
+                else:
+                    if response.status_code not in RETRY_STATUSES or not idempotent or attempt >= retries:
+                        status = str(response.status_code)
+                        return response
+                    response.close()
+                    retryable = True
+                if not retryable or attempt >= retries:
+                    raise error
+                print(f"[API] {method} {endpoint} failed, retry {attempt + 1}/{retries}")
+                self._retries.inc(method=method, endpoint=endpoint)
+                time.sleep(self._delay(attempt))
+                attempt += 1
+        finally:
+            elapsed = time.perf_counter() - started
+            if primary:
+                self.online = status != 'error'
+                self.checked_at = time.monotonic()
+            self._latency.observe(elapsed, method=method, endpoint=endpoint)
+            self._requests.inc(method=method, endpoint=endpoint, status=status)
+            with self._lock:
+                entry = self._stats.setdefault(f"{method} {endpoint}", {
+                    'count': 0, 'errors': 0, 'retries': 0, 'total_s': 0.0, 'max_s': 0.0, 'last_s': None,
+                })
+                entry['count'] += 1
+                entry['retries'] += attempt
+                if status == 'error' or status.startswith('5'):
+                    entry['errors'] += 1
+                entry['total_s'] += elapsed
+                entry['max_s'] = max(entry['max_s'], elapsed)
+                entry['last_s'] = elapsed
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request('PATCH', path, **kwargs)
+
+    def stats(self):
+        """Сводка по эндпоинтам: число запросов, ошибок, повторов, средняя и максимальная задержка"""
+        with self._lock:
+            return {
+                name: {
+                    'count': e['count'],
+                    'errors': e['errors'],
+                    'retries': e['retries'],
+                    'avg_ms': round(e['total_s'] / e['count'] * 1000, 1) if e['count'] else None,
+                    'max_ms': round(e['max_s'] * 1000, 1),
+                    'last_ms': round(e['last_s'] * 1000, 1) if e['last_s'] is not None else None,
+                }
+                for name, e in self._stats.items()
+            }
+
+
+class CachedResource:
+    """Read-through кэш одного JSON ресурса API (например, GET /config).
+
+    Пока значение моложе ttl, сеть не трогается. Устаревшее значение перепроверяется условным
+    запросом (If-None-Match / If-Modified-Since): если сервер отвечает 304, тело не передается.
+    Сервер без ETag просто отдает 200 — тогда кэш работает только по ttl.
+    Одновременные промахи из разных обработчиков Gradio выполняют один запрос.
+    После успешной записи вызывающий код делает invalidate().
+    """
+
+    def __init__(self, client, path, ttl=2.0):
+        self.client = client
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._etag = None
+        self._last_modified = None
+        self._fetched_at = 0.0
+        self.hits = 0
+        self.revalidated = 0
+        self.fetched = 0
+
+    def get(self, max_age=None):
+        """Значение ресурса (копия); max_age=0 — обязательно перепроверить у сервера.
+
+        Ошибки сети и HTTP (кроме 304) пробрасываются как requests исключения / HTTPError.
+        """
+        return self.get_versioned(max_age)[0]
+
+    def get_versioned(self, max_age=None):
+        """(значение, ETag) — ETag нужен для условной записи (If-Match); None, если сервер его не отдает"""
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            if self._value is not None and time.monotonic() - self._fetched_at < max_age:
+                self.hits += 1
+                return copy.deepcopy(self._value), self._etag
+            headers = {}
+            if self._value is not None:
+                if self._etag:
+                    headers['If-None-Match'] = self._etag
+                if self._last_modified:
+                    headers['If-Modified-Since'] = self._last_modified
+            response = self.client.get(self.path, headers=headers)
+            if response.status_code == 304 and self._value is not None:
+                self.revalidated += 1
+            else:
+                response.raise_for_status()
+                self._value = response.json()
+                self._etag = response.headers.get('ETag')
+                self._last_modified = response.headers.get('Last-Modified')
+                self.fetched += 1
+            self._fetched_at = time.monotonic()
+            return copy.deepcopy(self._value), self._etag
+
+    def invalidate(self):
+        """Следующий get() перепроверит значение у сервера"""
+        with self._lock:
+            self._fetched_at = 0.0
+
+    def clear(self):
+        """Забывает значение полностью (например, при смене адреса API)"""
+        with self._lock:
+            self._value = None
+            self._etag = None
+            self._last_modified = None
+            self._fetched_at = 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'revalidated': self.revalidated,
+                'fetched': self.fetched,
+                'etag': self._etag,
+                'age_s': time.monotonic() - self._fetched_at if self._fetched_at else None,
+            }
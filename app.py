@@ -1,18 +1,27 @@
-import gradio as gr
+import time
+# Отсчет этапов запуска (startup_mark); тяжелые модули — gradio, cv2, numpy — импортируются
+# там, где нужны, чтобы импорт app.py и запуск не ждали их без необходимости
+STARTUP_T0 = time.perf_counter()
 import yaml
 import os
-import copy
 import threading
-import time
-import cv2
-import numpy as np
+import asyncio
 import json
 from datetime import datetime
 import requests
-import socket
-from collections import deque
-import websocket  # pip install websocket-client
-import subprocess
+from alarm_ingest import AlarmIngestor
+from alarm_store import AlarmStore, make_cursor, parse_alarm, parse_cursor, parse_ts
+from alarm_coalesce import AlarmCoalescer
+from api_client import ApiClient, CachedResource
+from config_writer import ConfigWriteBehind
+from config_offline import ConfigOutbox, ConfigSnapshot, config_digest, config_mismatch
+from config_schema import (
+    FATIGUE_FIELDS, VIOLATION_TYPES, ConfigForm, build_fatigue_form,
+    build_violation_block, build_violation_grid, violations_form,
+)
+import fleet_push
+import metrics
+from alarm_feed import AlarmFeed, sse_events
 
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.yaml')
 WEB_CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'web_config.yaml')
@@ -20,6 +29,26 @@ RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
 os.makedirs(RESULTS_DIR, exist_ok=True)
 
 ALARM_MAX = 200
+# Размер страницы окна тревог (и live, и истории)
+ALARM_PAGE_SIZE = 50
+ALARM_DB_PATH = os.path.join(RESULTS_DIR, 'alarms.db')
+
+# Последний успешно загруженный из API конфиг: по нему интерфейс строится сразу при запуске
+# и работает без связи с API; правки, сделанные офлайн, ждут отправки в очереди (outbox)
+CONFIG_SNAPSHOT_PATH = os.path.join(os.path.dirname(__file__), 'config_snapshot.json')
+CONFIG_OUTBOX_PATH = os.path.join(os.path.dirname(__file__), 'config_outbox.json')
+
+# Длительность этапов запуска: [(этап, секунд)] — в логе [STARTUP] и в /metrics
+startup_timings = []
+_startup_last = STARTUP_T0
+
+def startup_mark(stage):
+    """Засекает окончание этапа запуска"""
+    global _startup_last
+    now = time.perf_counter()
+    startup_timings.append((stage, now - _startup_last))
+    print(f"[STARTUP] {stage}: {now - _startup_last:.2f}s (total {now - STARTUP_T0:.2f}s)")
+    _startup_last = now
 
 # Явные адреса для видеопотоков и сигналов
 DEFAULT_URL1 = "rtsp://192.168.0.172:8554/stream"
@@ -61,11 +90,8 @@ def save_web_config(config):
         print(f"[ERROR] Failed to save web config: {e}")
         return False
 
-# Глобальная очередь тревог
-# Глобальный лог сырых UDP сообщений
-raw_udp_log = deque(maxlen=ALARM_MAX)
-# Флаг для отслеживания новых тревог
-new_alarm_received = False
+# Лента последних сырых UDP сообщений; браузер получает новые записи через SSE /alarms/stream
+alarm_feed = AlarmFeed(maxlen=ALARM_MAX)
 
 # --- WebSocket listener ---
 WS_URL = os.environ.get("ALARM_WS_URL", "ws://localhost:8008") 
@@ -73,19 +99,99 @@ WS_URL = os.environ.get("ALARM_WS_URL", "ws://localhost:8008")
 # API конфигурация
 web_config = load_web_config()
 API_BASE_URL = f"http://{web_config['api_host']}:{web_config['api_port']}"  # Базовый URL для API
+# Все вызовы API идут через один пул keep-alive соединений (api_client.py)
+api = ApiClient(API_BASE_URL, hosts=max(4, len(web_config.get('fleet') or []) + 1))
+# Конфиг читается через кэш: в пределах ttl без сети, дальше — условный GET (304 без тела)
+config_cache = CachedResource(api, "/config", ttl=float(web_config.get('config_cache_ttl', 2.0)))
+config_snapshot = ConfigSnapshot(CONFIG_SNAPSHOT_PATH)
+config_outbox = ConfigOutbox(CONFIG_OUTBOX_PATH)
+# После неудачного запроса к API он столько секунд считается недоступным: сохранения сразу
+# уходят в очередь офлайн-правок, чтения — в снимок, без ожидания таймаутов подключения
+OFFLINE_RECHECK_INTERVAL = float(web_config.get('offline_recheck_interval', 10.0))
+
+def api_offline():
+    return api.offline(OFFLINE_RECHECK_INTERVAL)
+api.metrics.register_collector(lambda: [(
+    'startup_stage_seconds', 'gauge', 'Duration of app startup stages',
+    [({'stage': stage}, seconds) for stage, seconds in startup_timings],
+)])
 
-def load_config_from_api():
-    """Загружает конфигурацию через API"""
+def load_config_from_api(max_age=None, probe=False):
+    """Загружает конфигурацию через API (через config_cache).
+
+    max_age=0 — перепроверить у сервера; нужно перед сравнением или полной перезаписью конфига.
+    Если API недавно не ответил, возвращает {} без запроса; probe=True — все равно проверить
+    """
+    if api_offline() and not probe:
+        return {}
     try:
-        response = requests.get(f"{API_BASE_URL}/config", timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(f"[ERROR] Failed to load config from API: {response.status_code}")
-            return {}
+        config = config_cache.get(max_age)
+    except requests.exceptions.HTTPError as e:
+        print(f"[ERROR] Failed to load config from API: {e.response.status_code}")
+        return {}
     except Exception as e:
         print(f"[ERROR] Failed to connect to API: {e}")
         return {}
+    config_snapshot.save(config)
+    return config
+
+# Секции конфига по отдельности (GET /config/{section}) — когда нужна одна секция, а не весь конфиг.
+# None — эндпоинт еще не проверен; False — API ответил 404, и секции берутся из полного конфига
+section_caches = {}
+section_get_supported = None
+
+def load_config_section_versioned(section, max_age=None):
+    """(секция, ETag) через GET /config/{section}; если API не знает этого эндпоинта (404) —
+    секция из полного конфига и ETag None. (None, None), если конфиг недоступен
+    """
+    global section_get_supported
+    if api_offline():
+        return None, None
+    if section_get_supported is False:
+        return _section_from_config(section, max_age)
+    cache = section_caches.get(section)
+    if cache is None:
+        cache = section_caches[section] = CachedResource(api, f"/config/{section}", ttl=config_cache.ttl)
+    try:
+        value, etag = cache.get_versioned(max_age)
+    except requests.exceptions.HTTPError as e:
+        if e.response.status_code != 404:
+            print(f"[ERROR] Failed to load config section {section}: {e.response.status_code}")
+            return None, None
+        print("[API] GET /config/{section} not supported (404), using full config")
+        section_get_supported = False
+        section_caches.clear()
+        return _section_from_config(section, max_age)
+    except Exception as e:
+        print(f"[ERROR] Failed to connect to API: {e}")
+        return None, None
+    section_get_supported = True
+    return (value if isinstance(value, dict) else {}), etag
+
+def _section_from_config(section, max_age):
+    """Секция из полного конфига (без ETag) для API без GET /config/{section}"""
+    config = load_config_from_api(max_age)
+    if not config:
+        return None, None
+    value = config.get(section)
+    return (value if isinstance(value, dict) else {}), None
+
+def load_config_section(section, max_age=None):
+    """Одна секция конфига; {} если конфиг недоступен"""
+    return load_config_section_versioned(section, max_age)[0] or {}
+
+def invalidate_config():
+    """После записи в конфиг: следующее чтение конфига и его секций перепроверит их у сервера"""
+    config_cache.invalidate()
+    for cache in list(section_caches.values()):
+        cache.invalidate()
+
+def prefetch_config():
+    """Фоновая загрузка живого конфига при запуске: прогревает кэш и обновляет снимок"""
+    started = time.perf_counter()
+    config = load_config_from_api(max_age=0)
+    state = "loaded" if config else "unavailable"
+    print(f"[STARTUP] Live config {state} in {time.perf_counter() - started:.2f}s")
 
 def update_config_param(section, key, value):
     """Обновляет параметр конфигурации через API"""
@@ -95,100 +201,447 @@ def update_config_param(section, key, value):
             "key": key,
             "value": value
         }
-        response = requests.patch(f"{API_BASE_URL}/config", json=update_data, timeout=10)
+        response = api.patch("/config", json=update_data)
         if response.status_code == 200:
+            invalidate_config()
             return True, f"Параметр {section}.{key} обновлен"
         else:
             return False, f"Ошибка API: {response.status_code} - {response.text}"
     except Exception as e:
         return False, f"Ошибка подключения к API: {str(e)}"
 
+# Пакетное обновление: PATCH /config с телом application/json-patch+json (см. README_API.md).
+# Поддержка определяется один раз за сессию пробным пустым JSON Patch (probe_json_patch): 422/404
+# в ответ на настоящий пакет означают, что API отклонил его целиком, и поводом слать поля
+# по одному не считаются — иначе часть полей применилась бы, а часть нет.
+# None — поддержка еще не проверена, True/False — результат проверки
+JSON_PATCH_UNSUPPORTED_STATUSES = (405, 415)
+batch_patch_supported = None
+
+def probe_json_patch(path):
+    """Поддерживает ли API JSON Patch по path: True/False, None — не удалось проверить.
+
+    Пустой список операций ничего не меняет: сервис с поддержкой отвечает 200, старый API
+    не принимает список в теле и отвечает 4xx. Поэтому ответ на пробу, в отличие от ответа
+    на настоящий пакет, нельзя спутать с отклонением изменений.
+    """
+    try:
+        response = api.patch(path, json=[], headers={"Content-Type": "application/json-patch+json"})
+    except Exception as e:
+        print(f"[API] JSON Patch probe for {path} failed: {e}")
+        return None
+    if response.status_code == 200:
+        return True
+    if 400 <= response.status_code < 500:
+        print(f"[API] JSON Patch not supported for {path} ({response.status_code})")
+        return False
+    return None
+
+def _json_pointer(section, key):
+    """Путь JSON Pointer (RFC 6901) до параметра section.key"""
+    escape = lambda part: str(part).replace('~', '~0').replace('/', '~1')
+    return f"/{escape(section)}/{escape(key)}"
+
+def update_config_params(changes):
+    """Отправляет изменения {(section, key): value} одним запросом, который API применяет атомарно.
+
+    Возвращает (ok, errors, batched): errors — список сообщений об ошибках, batched — отправлено
+    ли одним пакетом (тогда при ошибке ничего не применено). Если API не поддерживает
+    пакетный PATCH, параметры отправляются по одному через update_config_param().
+    """
+    global batch_patch_supported
+    if batch_patch_supported is None:
+        batch_patch_supported = probe_json_patch("/config")
+    if batch_patch_supported is not False:
+        operations = [
+            {"op": "replace", "path": _json_pointer(section, key), "value": value}
+            for (section, key), value in changes.items()
+        ]
+        try:
+            response = api.patch("/config", json=operations,
+                                 headers={"Content-Type": "application/json-patch+json"})
+        except Exception as e:
+            return False, [f"Ошибка подключения к API: {str(e)}"], True
+        if response.status_code == 200:
+            batch_patch_supported = True
+            invalidate_config()
+            return True, [], True
+        if batch_patch_supported or response.status_code not in JSON_PATCH_UNSUPPORTED_STATUSES:
+            # API отклонил пакет целиком — на устройстве ничего не изменилось
+            return False, [f"Ошибка API: {response.status_code} - {response.text}"], True
+        print(f"[API] Batch PATCH not supported ({response.status_code}), falling back to per-field PATCH")
+        batch_patch_supported = False
+
+    errors = []
+    for (section, key), value in changes.items():
+        ok, msg = update_config_param(section, key, value)
+        if not ok:
+            errors.append(f"{section}.{key}: {msg}")
+    return not errors, errors, False
+
+# Конфиг рокчипа по URL: повторная проверка — условный GET, при неизменном конфиге 304 без тела
+device_configs = {}
+
+# Запись одной секции: PATCH /config/{section} с JSON Patch относительно секции и If-Match
+# (см. README_API.md). Поддержка проверяется так же, как у пакетного PATCH (probe_json_patch):
+# None — еще не проверена, True/False — результат проверки
+section_patch_supported = None
+
+def config_section_ops(old, new, path=""):
+    """Операции JSON Patch, превращающие old в new: только добавление и замена изменившихся полей"""
+    ops = []
+    for key, value in new.items():
+        pointer = f"{path}/{str(key).replace('~', '~0').replace('/', '~1')}"
+        if key not in old:
+            ops.append({"op": "add", "path": pointer, "value": value})
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            ops.extend(config_section_ops(old[key], value, pointer))
+        elif value != old[key] or type(value) is not type(old[key]):
+            ops.append({"op": "replace", "path": pointer, "value": value})
+    return ops
+
+def update_config_section(section, old, new, etag=None):
+    """Сохраняет изменения секции old -> new, отправляя только изменившиеся поля.
+
+    etag — версия секции, от которой сделаны изменения: с If-Match сервис отклонит запись (412),
+    если секцию за это время изменили, и чужие правки не затрутся. Без PATCH /config/{section}
+    изменившиеся подсекции отправляются через update_config_params() (без проверки версии).
+    Возвращает (ok, сообщение)
+    """
+    global section_patch_supported
+    ops = config_section_ops(old, new)
+    if not ops:
+        return True, "Нет изменений"
+    if section_patch_supported is None:
+        section_patch_supported = probe_json_patch(f"/config/{section}")
+    if section_patch_supported is not False:
+        headers = {"Content-Type": "application/json-patch+json"}
+        if etag:
+            headers["If-Match"] = etag
+        try:
+            response = api.patch(f"/config/{section}", json=ops, headers=headers)
+        except Exception as e:
+            return False, f"Ошибка подключения к API: {str(e)}"
+        if response.status_code == 200:
+            section_patch_supported = True
+            invalidate_config()
+            return True, f"Изменено полей: {len(ops)}"
+        if response.status_code == 412:
+            invalidate_config()
+            return False, f"Секцию {section} уже изменили на устройстве — обновите значения из API и повторите"
+        if section_patch_supported or response.status_code not in JSON_PATCH_UNSUPPORTED_STATUSES:
+            # Правка отклонена, а не эндпоинт не поддерживается: без If-Match ее не пересылаем
+            return False, f"Ошибка API: {response.status_code} - {response.text}"
+        print(f"[API] Section PATCH not supported ({response.status_code}), falling back to PATCH /config")
+        section_patch_supported = False
+    changes = {(section, key): value for key, value in new.items() if key not in old or old[key] != value}
+    ok, errors, _ = update_config_params(changes)
+    return ok, (f"Изменено полей: {len(ops)}" if ok else errors[0])
+
 def send_config_to_rockchip():
+    """Отправляет локальный config.yaml на рокчип через API (раньше — sshpass + scp).
+
+    Конфиг уходит, только если на устройстве он отличается; после записи конфиг читается
+    обратно и сверяется. Сравниваются только ключи из config.yaml, числа — с допуском:
+    сервис может дополнить конфиг значениями по умолчанию или вернуть 1 как 1.0.
+    """
     # Загружаем параметры Rockchip из API
     config = load_config_from_api()
     rockchip = config.get('rockchip', {})
     ip = rockchip.get('ip')
-    user = rockchip.get('user')
-    password = rockchip.get('password')
-    remote_path = rockchip.get('config_path')
-    if not all([ip, user, password, remote_path]):
-        return False, 'Не все параметры Rockchip заданы в конфиге'
-    # Используем sshpass для передачи пароля (sshpass должен быть установлен)
-    local_path = CONFIG_PATH
-    scp_cmd = [
-        'sshpass', '-p', password,
-        'scp', '-o', 'StrictHostKeyChecking=no', local_path, f'{user}@{ip}:{remote_path}'
-    ]
+    if not ip:
+        return False, 'Не задан IP Rockchip в конфиге'
+    url = f"http://{ip}:{int(rockchip.get('api_port', 8000))}/config"
     try:
-        result = subprocess.run(scp_cmd, check=True, capture_output=True, text=True)
-        return True, 'Конфиг отправлен на Rockchip!'
-    except subprocess.CalledProcessError as e:
-        return False, f'Ошибка отправки конфига: {e.stderr}'
-
-def send_config_via_api():
-    """Отправляет конфиг на рокчип через API вместо SCP"""
+        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+            local_config = yaml.safe_load(f) or {}
+    except Exception as e:
+        return False, f'Ошибка чтения {CONFIG_PATH}: {e}'
+    digest = config_digest(local_config)
+    # Основное устройство уже кэшируется в config_cache — второй кэш того же URL не нужен
+    device = config_cache if url == API_BASE_URL + "/config" else device_configs.get(url)
+    if device is None:
+        device = device_configs[url] = CachedResource(api, url)
     try:
-        # Получаем конфиг через API
-        config = load_config_from_api()
-        
-        # Получаем параметры API из конфига
-        rockchip = config.get('rockchip', {})
-        api_host = rockchip.get('ip', '192.168.0.173')
-        api_port = rockchip.get('api_port', 8000)
-        
-        # Формируем URL API
-        api_url = f"http://{api_host}:{api_port}/config"
-        
-        # Отправляем конфиг через API
-        response = requests.put(api_url, json=config, timeout=10)
-        
-        if response.status_code == 200:
-            return True, f'Конфиг успешно отправлен через API на {api_host}:{api_port}'
-        else:
+        if config_mismatch(local_config, device.get(max_age=0)) is None:
+            return True, f'Конфиг на Rockchip уже актуален (sha256 {digest[:12]})'
+        response = api.put(url, json=local_config)
+        if response.status_code != 200:
             return False, f'Ошибка API: {response.status_code} - {response.text}'
-            
-    except requests.exceptions.ConnectionError:
-        return False, f'Не удалось подключиться к API на {api_host}:{api_port}. Проверьте, запущен ли API сервис.'
-    except requests.exceptions.Timeout:
-        return False, 'Таймаут подключения к API'
+        if device is config_cache:
+            invalidate_config()
+        else:
+            device.invalidate()
+        mismatch = config_mismatch(local_config, device.get(max_age=0))
     except Exception as e:
-        return False, f'Ошибка отправки через API: {str(e)}'
+        return False, f'Ошибка отправки конфига: {e}'
+    if mismatch:
+        return False, f'Конфиг записан, но на устройстве отличается значение {mismatch}'
+    return True, f'Конфиг отправлен на Rockchip (sha256 {digest[:12]})'
+
+# Парк устройств (web_config.yaml, ключ fleet): список {name, host, api_port}
+FLEET_COLUMNS = ["Устройство", "Адрес", "Статус", "мс", "Попыток", "Сообщение"]
+fleet_last_results = []
+
+def _fleet_rows(results):
+    return [
+        [r['name'], r['address'], ("✅ " if r['ok'] else "❌ ") + r['status'], r['latency_ms'], r['attempts'], r['message']]
+        for r in results
+    ]
+
+def save_fleet_inventory(text):
+    """Сохраняет список устройств парка в web_config.yaml"""
+    try:
+        devices = fleet_push.parse_inventory(text)
+    except ValueError as e:
+        return f"❌ Неверный список устройств: {e}"
+    web_config['fleet'] = devices
+    if save_web_config(web_config):
+        return f"✅ Сохранено устройств: {len(devices)}"
+    return "❌ Ошибка сохранения конфигурации"
+
+def push_config_to_fleet(text, only_failed=False):
+    """Отправляет текущий конфиг на все устройства парка параллельно (или только на неудачные)"""
+    global fleet_last_results
+    try:
+        devices = fleet_push.parse_inventory(text)
+    except ValueError as e:
+        return f"❌ Неверный список устройств: {e}", _fleet_rows(fleet_last_results)
+    if only_failed:
+        failed = {(r['name'], r['address']) for r in fleet_last_results if not r['ok']}
+        devices = [d for d in devices if (d['name'], f"{d['host']}:{d['api_port']}") in failed]
+    if not devices:
+        return "✅ Нет устройств для отправки", _fleet_rows(fleet_last_results)
+    # Рассылается актуальный конфиг основного устройства; собственные поля каждого устройства
+    # (адрес, камера, получатель тревог) остаются его собственными
+    config = load_config_from_api(max_age=0)
+    if not config:
+        return "❌ Не удалось загрузить текущий конфиг из API", _fleet_rows(fleet_last_results)
+    started = time.perf_counter()
+    fields = fleet_push.parse_fields(web_config.get('fleet_device_fields') or []) or fleet_push.DEVICE_FIELDS
+    # По умолчанию все устройства сразу (но не больше fleet_push.MAX_WORKERS); пулов соединений —
+    # на каждое устройство и основной API, чтобы они не вытесняли друг друга
+    workers = web_config.get('fleet_workers')
+    api.ensure_hosts(len(devices) + 1)
+    results = fleet_push.push_config(api, devices, config, workers=int(workers) if workers else None,
+                                     fields=fields)
+    elapsed = time.perf_counter() - started
+    print(f"[FLEET] Pushed config to {len(results)} device(s) in {elapsed:.2f}s")
+    if only_failed:
+        # Повтор обновляет только строки повторенных устройств
+        updated = {(r['name'], r['address']): r for r in results}
+        results = [updated.get((r['name'], r['address']), r) for r in fleet_last_results]
+    fleet_last_results = results
+    return fleet_push.summarize(results, elapsed), _fleet_rows(results)
+
+def write_config_changes(changes):
+    """Запись правок полей из config_writer; без связи с API правки ставятся в outbox.
+
+    offline_mode в web_config.yaml: "queue" (по умолчанию) — копить офлайн-правки,
+    "readonly" — отклонять их.
+    """
+    # Пока очередь не разобрана, новые правки встают за ней, иначе они обогнали бы старые
+    if config_outbox.has_pending() and api.online:
+        replay_config_outbox()
+    if not config_outbox.has_pending() and not api_offline():
+        ok, errors, batched = update_config_params(changes)
+        if ok or api.online is not False:
+            return ok, errors, batched
+    if web_config.get('offline_mode', 'queue') == 'readonly':
+        return False, ["Нет связи с API, режим только чтения: изменения не сохранены"], True
+    config_outbox.put(changes, config_snapshot.config)
+    print(f"[OFFLINE] Queued {len(changes)} change(s), outbox size {len(config_outbox)}")
+    return None, [], True
+
+# Очередь разбирается одним потоком за раз: фоновым или по кнопке
+outbox_lock = threading.Lock()
+
+def replay_config_outbox(force=False):
+    """Отправляет офлайн-правки и возвращает текст для статуса.
 
-def update_config_param_text(section, key, value):
-    """Обертка: возвращает человекочитаемую строку вместо (ok, msg)"""
-    ok, msg = update_config_param(section, key, value)
-    return (msg if ok else f"❌ {msg}")
+    Правка отправляется, если поле на устройстве все еще равно base (значению, от которого она
+    сделана); если поле уже равно новому значению — правка просто снимается с очереди.
+    Правка без base (сделана без снимка конфига) отправляется как есть — побеждает последняя.
+    Иначе это конфликт: поле изменили на устройстве или другие операторы, и без force
+    правка остается в очереди до решения пользователя.
+    """
+    with outbox_lock:
+        entries = config_outbox.entries()
+        if not entries:
+            return ""
+        live = load_config_from_api(max_age=0, probe=True)
+        if not live:
+            return f"📥 В очереди правок: {len(entries)} — нет связи с API"
+        send, done, conflicts = {}, [], {}
+        for entry in entries:
+            field = (entry['section'], entry['key'])
+            section_config = live.get(entry['section'])
+            current = section_config.get(entry['key']) if isinstance(section_config, dict) else None
+            if current == entry['value']:
+                done.append(field)
+            elif 'base' not in entry:
+                print(f"[OFFLINE] {entry['section']}.{entry['key']}: queued without a snapshot, overwriting device value {current!r}")
+                send[field] = entry['value']
+            elif current == entry['base'] or force:
+                send[field] = entry['value']
+            else:
+                conflicts[field] = current
+        if send:
+            ok, errors, _ = update_config_params(send)
+            if not ok:
+                return f"❌ Очередь не отправлена: {errors[0]}"
+            done.extend(send)
+        # Поле, которое поставили в очередь заново, пока шла отправка, остается в очереди
+        replayed = {(entry['section'], entry['key']): entry for entry in entries}
+        config_outbox.remove(done, expected=replayed)
+        config_outbox.mark_conflicts(conflicts, expected=replayed)
+    print(f"[OFFLINE] Replayed outbox: {len(send)} sent, {len(done) - len(send)} already applied, {len(conflicts)} conflict(s)")
+    message = f"✅ Из очереди отправлено правок: {len(send)}"
+    if conflicts:
+        message += f"; ⚠️ конфликтов: {len(conflicts)} — на устройстве эти поля изменились, см. очередь офлайн-правок"
+    return message
+
+def apply_outbox(config):
+    """Конфиг с примененными правками из очереди — так его видит пользователь, пока API недоступен"""
+    for entry in config_outbox.entries():
+        section_config = config.setdefault(entry['section'], {})
+        if isinstance(section_config, dict):
+            section_config[entry['key']] = entry['value']
+    return config
+
+def describe_outbox():
+    """Содержимое очереди офлайн-правок для интерфейса"""
+    entries = config_outbox.entries()
+    if not entries:
+        return "Очередь офлайн-правок пуста"
+    lines = [f"**В очереди правок: {len(entries)}**"]
+    for entry in entries:
+        base = f"было {entry['base']}" if 'base' in entry else "без снимка, без проверки конфликта"
+        line = f"- `{entry['section']}.{entry['key']}` = {entry['value']} ({base})"
+        if 'conflict' in entry:
+            line += f" — ⚠️ конфликт: на устройстве сейчас {entry['conflict']}"
+        lines.append(line)
+    return "\n".join(lines)
+
+def start_outbox_replay(interval=15.0):
+    """Фоновый поток: пока в очереди есть правки без конфликтов, пробует отправить их"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            if config_outbox.has_pending():
+                try:
+                    replay_config_outbox()
+                except Exception as e:
+                    print(f"[OFFLINE] Outbox replay failed: {e}")
+    threading.Thread(target=loop, daemon=True).start()
+
+# Правки полей (.input) не уходят на каждый символ: последнее значение каждого поля
+# отправляется, когда поле не меняли config_write_delay секунд (одним пакетным PATCH)
+config_writer = ConfigWriteBehind(
+    write_config_changes,
+    delay=float(web_config.get('config_write_delay', 0.8)),
+    max_delay=float(web_config.get('config_write_max_delay', 3.0)),
+)
+
+# Обработчик ввода только кладет значение в буфер и сразу возвращается: результат записи
+# показывает опрос poll_config_writes() по таймеру, который работает, пока есть неотправленные
+# правки этой сессии. Так набор текста в поле не держит рабочие потоки gradio в ожидании.
+# pending — {(section, key): номер последней правки} в gr.State сессии
+def stage_config_param(section, key, value, pending):
+    """Кладет значение в буфер записи: (статус, pending, таймер опроса)"""
+    import gradio as gr
+    pending = dict(pending or {})
+    pending[(section, key)] = config_writer.set(section, key, value)
+    return f"⏳ Ожидает отправки: {section}.{key} = {value}", pending, gr.Timer(active=True)
+
+def poll_config_writes(pending):
+    """Тик таймера: результаты отправленных правок; таймер выключается, когда ждать нечего"""
+    import gradio as gr
+    if not pending:
+        return gr.skip(), {}, gr.Timer(active=False)
+    waiting, messages = {}, []
+    for (section, key), seq in pending.items():
+        result = config_writer.result(section, key, seq)
+        if result is None:
+            waiting[(section, key)] = seq
+        elif result[1] not in messages:
+            messages.append(result[1])
+    if not messages:
+        return gr.skip(), waiting, gr.skip()
+    if waiting:
+        messages.append(f"⏳ Ожидает отправки: {', '.join(f'{section}.{key}' for section, key in waiting)}")
+    return "\n".join(messages), waiting, gr.Timer(active=bool(waiting))
+
+def config_field_writer(section, key, convert=lambda value: value):
+    """Обработчик .input поля section.key; convert приводит значение из UI к типу конфига
+    (ValueError — ошибка ввода, правка не отправляется)"""
+    def write(value, pending):
+        import gradio as gr
+        try:
+            value = convert(value)
+        except ValueError as e:
+            return f"❌ {e}", gr.skip(), gr.skip()
+        return stage_config_param(section, key, value, pending)
+    return write
+
+# Калибровки выполняются по одной: ядро запоминает положение головы в момент команды
+calibrate_lock = threading.Lock()
 
 def call_head_calibrate(direction):
-    """Отправляет команду калибровки; ядро возьмет текущие градусы и сохранит в raw_deg"""
+    """Отправляет команду калибровки; ядро возьмет текущие градусы и сохранит в raw_deg.
+
+    Возвращает (сообщение, raw_deg из ответа или None, если ядро их не вернуло)
+    """
+    if api_offline():
+        return "❌ Нет связи с API — калибровка невозможна", None
     try:
-        response = requests.post(f"{API_BASE_URL}/head_calibrate", json={"direction": direction}, timeout=10)
+        response = api.post("/head_calibrate", json={"direction": direction})
         if response.status_code == 200:
-            return f"✅ Калибровка отправлена: {direction}"
+            # Ядро записало новые raw_deg в конфиг
+            invalidate_config()
+            try:
+                raw_deg = response.json().get('raw_deg')
+            except (ValueError, AttributeError):
+                raw_deg = None
+            return f"✅ Калибровка отправлена: {direction}", raw_deg if isinstance(raw_deg, dict) else None
         else:
-            return f"❌ Ошибка API: {response.status_code} - {response.text}"
+            return f"❌ Ошибка API: {response.status_code} - {response.text}", None
     except Exception as e:
-        return f"❌ Ошибка подключения к API: {str(e)}"
-
-def calibrate_and_refresh(direction):
-    """Вызывает калибровку и возвращает статус и обновленные градусы (left,right,down,up)."""
-    msg = call_head_calibrate(direction)
-    # После калибровки сразу тянем актуальный конфиг, чтобы обновить градусы
-    cfg = load_config_from_api()
-    hp_cfg = cfg.get('head_pose', {}) if isinstance(cfg, dict) else {}
-    raw_deg = hp_cfg.get('raw_deg', {}) if isinstance(hp_cfg, dict) else {}
+        return f"❌ Ошибка подключения к API: {str(e)}", None
+
+def calibrate_head(direction):
+    """Калибровка и новые градусы: из ответа ядра, а если их там нет — из GET /config/head_pose"""
+    with calibrate_lock:
+        msg, raw_deg = call_head_calibrate(direction)
+        if raw_deg is None and msg.startswith("✅"):
+            raw_deg = load_config_section('head_pose', max_age=0).get('raw_deg')
+    return msg, raw_deg if isinstance(raw_deg, dict) else None
+
+def format_raw_deg(raw_deg):
+    """Градусы калибровки (left, right, down, up) для полей интерфейса"""
     def fmt1(v):
         try:
             return f"{float(v):.1f}"
         except Exception:
             return "0.0"
-    left = fmt1(raw_deg.get('left', 0.0))
-    right = fmt1(raw_deg.get('right', 0.0))
-    down = fmt1(raw_deg.get('down', 0.0))
-    up = fmt1(raw_deg.get('up', 0.0))
-    return [msg, left, right, down, up]
+    return [fmt1(raw_deg.get(direction, 0.0)) for direction in ('left', 'right', 'down', 'up')]
+
+def calibration_job(direction):
+    """Обработчик кнопки калибровки: статус сразу, градусы — как только ответит ядро.
+
+    Запрос выполняется в отдельном потоке, event loop Gradio не блокируется.
+    """
+    async def run():
+        import gradio as gr
+        yield [f"⏳ Калибровка: {direction}..."] + [gr.skip()] * 4
+        msg, raw_deg = await asyncio.to_thread(calibrate_head, direction)
+        yield [msg] + (format_raw_deg(raw_deg) if raw_deg is not None else [gr.skip()] * 4)
+    return run
 
 def stream_video(rtsp_url):
+    import cv2
+    import numpy as np
+    from capture_supervisor import CaptureSupervisor
     if not rtsp_url:
         print("RTSP URL is empty. Returning blank image.")
         blank_image = np.zeros((480, 640, 3), dtype=np.uint8)
@@ -196,22 +649,28 @@ def stream_video(rtsp_url):
         while True:
             yield blank_image
             time.sleep(1)
+    # Переподключение с экспоненциальной задержкой; первая повторная попытка — сразу
+    supervisor = CaptureSupervisor(rtsp_url)
     while True:
-        print(f"Connecting to RTSP stream: {rtsp_url}")
-        cap = cv2.VideoCapture(rtsp_url)
+        cap = supervisor.open(rtsp_url)
         if not cap.isOpened():
-            print(f"Error: Could not open stream at {rtsp_url}. Retrying in 5 seconds...")
+            print(f"Error: Could not open stream at {rtsp_url}. Retrying...")
             cap.release()
-            time.sleep(5)
+            supervisor.wait_retry()
             continue
         while True:
             ret, frame = cap.read()
             if not ret:
+                supervisor.frame_failed()
                 print(f"Stream at {rtsp_url} ended. Reconnecting...")
                 break
+            if not supervisor.frame_ok(cap):
+                print(f"Stream at {rtsp_url} stalled. Reconnecting...")
+                break
             yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             time.sleep(1/25)
         cap.release()
+        supervisor.wait_retry()
 
 def get_default_urls(config):
     """Получает URL из конфигурации или возвращает значения по умолчанию"""
@@ -224,23 +683,141 @@ def get_default_urls(config):
     rtsp_annotated_url = system_config.get('rtsp_annotated_url', rtsp_stream_url)
     return rtsp_stream_url, rtsp_annotated_url
 
-def get_raw_udp_text():
-    lines = list(raw_udp_log)
-    if not lines:
-        return "Нет UDP сообщений"
-    return '\n'.join(lines)
+# Окно тревог: таблица с одной страницей тревог. На странице новых тревог браузер подписан
+# на /alarms/stream и вставляет только пришедшие строки; история листается через /alarms
+# (фильтры и курсор страницы), поэтому в браузере никогда нет больше одной страницы.
+# Курсор ленты хранится во вкладке, очистка окна локальная и не влияет на другие вкладки
+ALARM_VIEW_JS = """
+() => {
+    const PAGE_SIZE = %d;
+    let source = null;
+    let filters = {};
+    let rows = [];  // тревоги текущей страницы, новые первыми
+    let nextCursor = null;
+    let pageNo = 0;
+    const tbody = () => document.getElementById('alarm_rows');
+    const info = (text) => { const el = document.getElementById('alarm_page_info'); if (el) el.textContent = text; };
+    const fmtTime = (ts) => new Date(ts * 1000).toLocaleString();
+    const toEpoch = (value) => {
+        value = (value || '').trim();
+        if (!value) return null;
+        const n = Number(value);
+        return Number.isFinite(n) ? n : Date.parse(value) / 1000 || null;
+    };
+    const cells = (a) => [
+        fmtTime(a.ts) + (a.count > 1 && a.last_seen > a.ts ? ' — ' + fmtTime(a.last_seen) : ''),
+        a.type ?? '—',
+        a.confidence == null ? '—' : a.confidence.toFixed(2),
+        a.device ?? '—',
+        a.count > 1 ? '×' + a.count : '',
+    ];
+    const makeRow = (a) => {
+        const tr = document.createElement('tr');
+        tr.title = a.raw;
+        tr.dataset.id = a.id;
+        for (const value of cells(a)) {
+            const td = document.createElement('td');
+            td.textContent = value;
+            tr.appendChild(td);
+        }
+        return tr;
+    };
+    // Повторы склеенного события меняют только счетчик и время его строки, если она на странице
+    const applyUpdates = (events) => {
+        const body = tbody();
+        if (!body) return;
+        for (const a of events) {
+            const index = rows.findIndex((r) => r.id === a.id);
+            if (index < 0) continue;
+            rows[index] = a;
+            const tr = body.querySelector(`tr[data-id="${a.id}"]`);
+            if (tr) cells(a).forEach((value, i) => { tr.children[i].textContent = value; });
+        }
+    };
+    const matches = (a) => (!filters.device || a.device === filters.device)
+        && (!filters.type || a.type === filters.type)
+        && (filters.since == null || a.ts >= filters.since)
+        && (filters.until == null || a.ts < filters.until);
+    const render = () => {
+        const body = tbody();
+        if (body) body.replaceChildren(...rows.map(makeRow));
+    };
+    const prepend = (alarms) => {
+        const known = new Set(rows.map((a) => a.id));
+        // В событии тревоги идут от старых к новым, в таблице — новые сверху
+        const fresh = alarms.filter((a) => !known.has(a.id) && matches(a)).reverse().slice(0, PAGE_SIZE);
+        const body = tbody();
+        if (!fresh.length || !body) return;
+        rows = fresh.concat(rows).slice(0, PAGE_SIZE);
+        const fragment = document.createDocumentFragment();
+        for (const a of fresh) fragment.appendChild(makeRow(a));
+        body.insertBefore(fragment, body.firstChild);
+        while (body.childNodes.length > PAGE_SIZE) body.removeChild(body.lastChild);
+    };
+    const query = (before) => {
+        const params = new URLSearchParams({limit: PAGE_SIZE});
+        for (const [key, value] of Object.entries(filters)) if (value != null && value !== '') params.set(key, value);
+        if (before) params.set('before', before);
+        return fetch('/alarms?' + params).then((r) => r.json());
+    };
+    const disconnect = () => { if (source) { source.close(); source = null; } };
+    const connect = (cursor) => {
+        disconnect();
+        source = new EventSource('/alarms/stream?cursor=' + cursor);
+        source.addEventListener('reset', () => showLive());
+        source.addEventListener('alarms', (e) => prepend(JSON.parse(e.data)));
+        source.addEventListener('updates', (e) => applyUpdates(JSON.parse(e.data)));
+    };
+    const showLive = async () => {
+        disconnect();
+        const page = await query(null);
+        rows = page.items;
+        nextCursor = page.next;
+        pageNo = 0;
+        render();
+        info('Новые тревоги — обновляются автоматически');
+        // head — курсор ленты, с которого придут все тревоги, еще не попавшие в страницу
+        connect(page.head);
+    };
+    const showOlder = async () => {
+        if (!nextCursor) return;
+        disconnect();
+        const page = await query(nextCursor);
+        rows = page.items;
+        nextCursor = page.next;
+        pageNo += 1;
+        render();
+        info(`История, страница ${pageNo + 1}` + (nextCursor ? '' : ' (последняя)'));
+    };
+    window.alarmView = {
+        live: showLive,
+        older: showOlder,
+        filter: (device, type, since, until) => {
+            filters = {device: (device || '').trim(), type: (type || '').trim(), since: toEpoch(since), until: toEpoch(until)};
+            return showLive();
+        },
+        clear: () => { rows = []; render(); },
+    };
+    showLive();
+}
+""" % ALARM_PAGE_SIZE
 
-def check_and_update_alarms():
-    """Проверяет наличие новых тревог и возвращает обновленный текст"""
-    global new_alarm_received
-    if new_alarm_received:
-        new_alarm_received = False  # Сбрасываем флаг
-        return get_raw_udp_text()
-    return gr.update()  # Возвращаем gr.update() если нет изменений
+ALARM_TABLE_HTML = """
+<div id="alarm_page_info" style="margin-bottom: 4px; font-size: 12px; opacity: 0.8;"></div>
+<div style="height: 600px; overflow-y: auto; border: 1px solid #444; border-radius: 8px;">
+  <table style="width: 100%; font-size: 12px; border-collapse: collapse;">
+    <thead><tr><th>Время</th><th>Тип</th><th>Уверенность</th><th>Устройство</th><th>Повторы</th></tr></thead>
+    <tbody id="alarm_rows"></tbody>
+  </table>
+</div>
+"""
 
 def build_interface():
-    # Загружаем конфигурацию через API
-    config = load_config_from_api()
+    import gradio as gr
+    # Интерфейс строится сразу из последнего снимка конфига, не дожидаясь API: живой конфиг
+    # подставляется в поля при открытии страницы. Без снимка (первый запуск) ждем API
+    config = config_snapshot.config
+    config = apply_outbox(config) if config else load_config_from_api()
     
     # Если API недоступен, показываем сообщение об ошибке с формой для изменения адреса
     if not config:
@@ -282,7 +859,8 @@ def build_interface():
                 """Проверяет подключение к API"""
                 try:
                     test_url = f"http://{host}:{port}/config"
-                    response = requests.get(test_url, timeout=5)
+                    # Проверка не повторяется: пользователь хочет видеть ответ сразу
+                    response = api.get(test_url, timeout=(3.0, 5.0), retries=0)
                     if response.status_code == 200:
                         return "✅ Подключение успешно! API доступен."
                     else:
@@ -296,7 +874,7 @@ def build_interface():
             
             def apply_new_api_url(host, port):
                 """Применяет новый адрес API и сохраняет в конфиг"""
-                global API_BASE_URL, web_config
+                global API_BASE_URL, web_config, batch_patch_supported, section_patch_supported, section_get_supported
                 
                 # Обновляем конфигурацию
                 web_config["api_host"] = host
@@ -305,6 +883,12 @@ def build_interface():
                 # Сохраняем в файл
                 if save_web_config(web_config):
                     API_BASE_URL = f"http://{host}:{port}"
+                    api.set_base_url(API_BASE_URL)
+                    config_cache.clear()
+                    section_caches.clear()
+                    batch_patch_supported = None
+                    section_patch_supported = None
+                    section_get_supported = None
                     return f"✅ Новый адрес API сохранен: {API_BASE_URL}. Перезагрузите страницу для применения изменений."
                 else:
                     return "❌ Ошибка сохранения конфигурации"
@@ -365,155 +949,92 @@ def build_interface():
                 )
                 save_local_rtsp_btn = gr.Button("💾 Сохранить локальный RTSP URL", variant="secondary")
                 
-                gr.HTML('<img src="http://localhost:5000/video" style="width:100%; max-width: 800px; border: 2px solid #444; border-radius: 8px; display:block;">')
+                gr.HTML('<img src="http://localhost:5000/video?w=800&q=80" style="width:100%; max-width: 800px; border: 2px solid #444; border-radius: 8px; display:block;">')
             with gr.Column():
-                def update_alarm_box():
-                    return get_raw_udp_text()
-                alarm_box = gr.Textbox(label="RAW UDP тревоги (json)", value=update_alarm_box(), lines=30, interactive=False, elem_id="alarm_box")
-                
-                def clear_alarm_box():
-                    """Очищает окно RAW UDP тревог"""
-                    global raw_udp_log, new_alarm_received
-                    raw_udp_log.clear()
-                    new_alarm_received = False  # Сбрасываем флаг новых тревог
-                    return "Окно очищено"
+                gr.Markdown("**Тревоги** (исходный JSON — во всплывающей подсказке строки)")
+                with gr.Row():
+                    alarm_device = gr.Textbox(label="Устройство", placeholder="cab12")
+                    alarm_type = gr.Textbox(label="Тип", placeholder="closed_eyes")
+                with gr.Row():
+                    alarm_since = gr.Textbox(label="С", placeholder="2025-01-10T20:00")
+                    alarm_until = gr.Textbox(label="По", placeholder="2025-01-11T08:00")
+                # Строки таблицы заполняет ALARM_VIEW_JS из /alarms и /alarms/stream
+                gr.HTML(ALARM_TABLE_HTML)
                 
                 with gr.Row():
+                    filter_alarm_btn = gr.Button("🔍 Применить фильтр", variant="secondary")
+                    older_alarm_btn = gr.Button("⏪ Более старые", variant="secondary")
+                    refresh_alarm_btn = gr.Button("🔄 Новые", variant="secondary")
                     clear_alarm_btn = gr.Button("🗑️ Очистить окно тревог", variant="secondary")
-                    refresh_alarm_btn = gr.Button("🔄 Обновить тревоги", variant="secondary")
         
         # --- Параметры config.yaml ---
         gr.Markdown("## Параметры конфигурации")
+        # Статус отложенной записи полей: "ожидает отправки" → "сохранено" / ошибка
+        write_status = gr.Markdown("")
+        write_pending = gr.State({})
+        write_timer = gr.Timer(0.5, active=False)
         
         # Кнопки обновления и отправки конфигурации
         with gr.Row():
             refresh_config_btn = gr.Button("🔄 Обновить из API", variant="secondary")
             api_send_btn = gr.Button("📤 Отправить через API", variant="secondary")
+            push_yaml_btn = gr.Button("📤 Отправить config.yaml на Rockchip", variant="secondary")
+        
+        with gr.Accordion("🚚 Парк устройств", open=False):
+            fleet_inventory = gr.Textbox(
+                label="Устройства (по строке: имя хост[:порт])",
+                value=fleet_push.format_inventory(web_config.get('fleet')),
+                placeholder="cab12 100.92.90.80:8000",
+                lines=5,
+                interactive=True,
+            )
+            with gr.Row():
+                save_fleet_btn = gr.Button("💾 Сохранить список", variant="secondary")
+                fleet_push_btn = gr.Button("📤 Отправить конфиг на все", variant="primary")
+                fleet_retry_btn = gr.Button("🔁 Повторить для неудачных", variant="secondary")
+            fleet_status = gr.Markdown("")
+            fleet_table = gr.Dataframe(headers=FLEET_COLUMNS, value=[], interactive=False)
+        
+        with gr.Accordion("📥 Очередь офлайн-правок", open=len(config_outbox) > 0):
+            outbox_status = gr.Markdown(describe_outbox())
+            with gr.Row():
+                outbox_replay_btn = gr.Button("🔁 Отправить очередь", variant="secondary")
+                outbox_force_btn = gr.Button("⚠️ Отправить с перезаписью конфликтов", variant="secondary")
+                outbox_clear_btn = gr.Button("🗑️ Очистить очередь", variant="secondary")
         
         # --- Блоки тревог ---
         gr.Markdown("### Настройки тревог")
         
-        # Словарь переводов для тревог
-        VIOLATION_TRANSLATIONS = {
-            'cigarette': 'Курение',
-            'closed_eyes': 'Закрытые глаза',
-            'head_pose': 'Поворот головы',
-            'no_belt': 'Отсутствие ремня',
-            'no_driver': 'Отсутствие водителя',
-            'no_face': 'Отсутствие лица',
-            'phone': 'Использование телефона',
-            'yawn': 'Зевота'
-        }
-        
-        violation_blocks = {}
+        # Поля строятся по схеме config_schema; виджеты доступны по пути поля (section, key)
+        violation_widgets = {}
+        other_types = {k: v for k, v in VIOLATION_TYPES.items() if k != 'head_pose'}
+
+        # Кнопки калибровки head_pose и пороги калибровки в градусах (только для чтения)
+        head_pose_ui = {}
+
+        def head_pose_extra():
+            with gr.Row():
+                head_pose_ui['left'] = gr.Button("Запомнить левое", variant="secondary")
+                head_pose_ui['right'] = gr.Button("Запомнить правое", variant="secondary")
+            with gr.Row():
+                head_pose_ui['up'] = gr.Button("Запомнить верхнее", variant="secondary")
+                head_pose_ui['down'] = gr.Button("Запомнить нижнее", variant="secondary")
+            raw_deg = config.get('head_pose', {}).get('raw_deg', {})
+            head_pose_ui['raw'] = [
+                gr.Textbox(label="Лево (°)", value=str(raw_deg.get('left', 0.0)), interactive=False),
+                gr.Textbox(label="Право (°)", value=str(raw_deg.get('right', 0.0)), interactive=False),
+                gr.Textbox(label="Вниз (°)", value=str(raw_deg.get('down', 0.0)), interactive=False),
+                gr.Textbox(label="Вверх (°)", value=str(raw_deg.get('up', 0.0)), interactive=False),
+            ]
 
         # Размещение: слева сетка из 4 блоков в ряд для всех, кроме head_pose; справа — отдельный блок head_pose
-        other_items = [(k, v) for k, v in VIOLATION_TRANSLATIONS.items() if k != 'head_pose']
         with gr.Row():
-            # Левая колонка с сеткой 4х
             with gr.Column(scale=2):
-                for i in range(0, len(other_items), 4):
-                    with gr.Row():
-                        for j in range(4):
-                            if i + j < len(other_items):
-                                violation_type, label = other_items[i + j]
-                                violation_config = config.get(violation_type, {})
-                                with gr.Column():
-                                    with gr.Group():
-                                        with gr.Row():
-                                            gr.Markdown(f"**{label}**")
-                                            enable_checkbox = gr.Checkbox(
-                                                label="Включить", 
-                                                value=violation_config.get('enable', True),
-                                                interactive=True
-                                            )
-                                        with gr.Column():
-                                            duration_input = gr.Textbox(
-                                                label="Длительность (сек)", 
-                                                value=str(violation_config.get('duration', 5)),
-                                                interactive=True
-                                            )
-                                            threshold_input = gr.Textbox(
-                                                label="Уверенность", 
-                                                value=str(violation_config.get('threshold', 0.5)),
-                                                interactive=True
-                                            )
-                                    violation_blocks[violation_type] = {
-                                        'enable': enable_checkbox,
-                                        'duration': duration_input,
-                                        'threshold': threshold_input
-                                    }
-            # Правая колонка — head_pose
+                build_violation_grid(other_types, config, violation_widgets)
             with gr.Column(scale=1):
-                violation_type = 'head_pose'
-                label = VIOLATION_TRANSLATIONS[violation_type]
-                violation_config = config.get(violation_type, {})
-                with gr.Group():
-                    with gr.Row():
-                        gr.Markdown(f"**{label}**")
-                        enable_checkbox = gr.Checkbox(
-                            label="Включить", 
-                            value=violation_config.get('enable', True),
-                            interactive=True
-                        )
-                    with gr.Column():
-                        duration_input = gr.Textbox(
-                            label="Длительность (сек)", 
-                            value=str(violation_config.get('duration', 5)),
-                            interactive=True
-                        )
-                        head_center_pitch_input = gr.Textbox(
-                            label="Центр по вертикали (0..1)",
-                            value=str(violation_config.get('center_pitch', 0.5)),
-                            interactive=True
-                        )
-                        head_center_yaw_input = gr.Textbox(
-                            label="Центр по горизонтали (0..1)",
-                            value=str(violation_config.get('center_yaw', 0.5)),
-                            interactive=True
-                        )
-                        head_pitch_input = gr.Textbox(
-                            label="Порог по вертикали (0..1)",
-                            value=str(violation_config.get('pitch', 0.2)),
-                            interactive=True
-                        )
-                        head_yaw_input = gr.Textbox(
-                            label="Порог по горизонтали (0..1)",
-                            value=str(violation_config.get('yaw', 0.2)),
-                            interactive=True
-                        )
-                        mask_absence_timeout_input = gr.Textbox(
-                            label="Таймаут отсутствия маски (сек)",
-                            value=str(violation_config.get('mask_absence_timeout', 3.0)),
-                            interactive=True
-                        )
-                        with gr.Row():
-                            left_btn = gr.Button("Запомнить левое", variant="secondary")
-                            right_btn = gr.Button("Запомнить правое", variant="secondary")
-                        with gr.Row():
-                            up_btn = gr.Button("Запомнить верхнее", variant="secondary")
-                            down_btn = gr.Button("Запомнить нижнее", variant="secondary")
-                        # Поля для отображения порогов калибровки в градусах
-                        hp_cfg = config.get('head_pose', {})
-                        raw_deg = hp_cfg.get('raw_deg', {})
-                        raw_left_box = gr.Textbox(label="Лево (°)", value=str(raw_deg.get('left', 0.0)), interactive=False)
-                        raw_right_box = gr.Textbox(label="Право (°)", value=str(raw_deg.get('right', 0.0)), interactive=False)
-                        raw_down_box = gr.Textbox(label="Вниз (°)", value=str(raw_deg.get('down', 0.0)), interactive=False)
-                        raw_up_box = gr.Textbox(label="Вверх (°)", value=str(raw_deg.get('up', 0.0)), interactive=False)
-                violation_blocks[violation_type] = {
-                    'enable': enable_checkbox,
-                    'duration': duration_input,
-                    'threshold': gr.Textbox(visible=False),
-                    'center_pitch': head_center_pitch_input,
-                    'center_yaw': head_center_yaw_input,
-                    'pitch': head_pitch_input,
-                    'yaw': head_yaw_input,
-                    'mask_absence_timeout': mask_absence_timeout_input,
-                    'raw_left': raw_left_box,
-                    'raw_right': raw_right_box,
-                    'raw_down': raw_down_box,
-                    'raw_up': raw_up_box
-                }
+                build_violation_block('head_pose', VIOLATION_TYPES['head_pose'], config, violation_widgets, extra=head_pose_extra)
+        violation_form = violations_form()
+        violation_inputs = violation_form.components(violation_widgets)
         
         # --- Rockchip IP ---
         with gr.Row():
@@ -522,101 +1043,53 @@ def build_interface():
         
         status = gr.Markdown(visible=False)
         
-        # Собираем поля блоков тревог
-        violation_fields = []  # используется для массовой отправки через API (enable, duration, threshold)
-        refresh_fields = []    # используется для обновления из API (включая дополнительные head_pose поля)
-        for violation_type, fields in violation_blocks.items():
-            # Базовые поля для всех нарушений
-            base_components = [fields['enable'], fields['duration'], fields['threshold']]
-            violation_fields.extend(base_components)
-            refresh_fields.extend(base_components)
-            # Дополнительные поля только для head_pose
-            if violation_type == 'head_pose':
-                refresh_fields.extend([
-                    fields.get('center_pitch'),
-                    fields.get('center_yaw'),
-                    fields.get('pitch'),
-                    fields.get('yaw'),
-                    fields.get('mask_absence_timeout')
-                ])
-        
         # --- Обработчики событий ---
         
         def send_all_via_api(rockchip_ip, *violation_values):
             """Отправляет только измененные параметры конфигурации через API"""
             try:
-                # Получаем текущий конфиг из API
-                current_config = load_config_from_api()
+                # Получаем текущий конфиг из API; diff считается от актуального состояния.
+                # Без связи — от снимка с правками из очереди, и изменения встают в очередь
+                current_config = load_config_from_api(max_age=0) or apply_outbox(config_snapshot.config)
                 if not current_config:
                     return "❌ Не удалось загрузить текущий конфиг из API"
                 
-                # Собираем текущие значения из интерфейса
-                current_values = {}
+                # Ошибки ввода — до отправки чего-либо
+                changes, errors = violation_form.diff(current_config, violation_values)
+                if errors:
+                    return "❌ Исправьте значения:\n" + "\n".join(errors)
                 
                 # Обрабатываем IP Rockchip
                 if rockchip_ip and rockchip_ip != current_config.get('rockchip', {}).get('ip', ''):
-                    current_values['rockchip.ip'] = rockchip_ip
-                
-                # Обрабатываем значения нарушений
-                violation_items = list(VIOLATION_TRANSLATIONS.keys())
-                value_index = 0
-                
-                for violation_type in violation_items:
-                    # Получаем значения из интерфейса (3 значения на каждое нарушение: enable, duration, threshold)
-                    enable_val = violation_values[value_index]
-                    duration_val = float(violation_values[value_index + 1]) if violation_values[value_index + 1] else 5.0
-                    threshold_val = float(violation_values[value_index + 2]) if violation_values[value_index + 2] else 0.5
-                    
-                    # Получаем текущие значения из конфига
-                    current_violation = current_config.get(violation_type, {})
-                    current_enable = current_violation.get('enable', True)
-                    current_duration = current_violation.get('duration', 5.0)
-                    current_threshold = current_violation.get('threshold', 0.5)
-                    
-                    # Сравниваем и добавляем измененные значения
-                    if enable_val != current_enable:
-                        current_values[f'{violation_type}.enable'] = enable_val
-                    
-                    if abs(duration_val - current_duration) > 0.001:  # Учитываем погрешность float
-                        current_values[f'{violation_type}.duration'] = duration_val
-                    
-                    if abs(threshold_val - current_threshold) > 0.001:  # Учитываем погрешность float
-                        current_values[f'{violation_type}.threshold'] = threshold_val
-                    
-                    value_index += 3
+                    changes[('rockchip', 'ip')] = rockchip_ip
                 
                 # Если нет изменений
-                if not current_values:
+                if not changes:
                     return "✅ Нет изменений для отправки"
                 
-                # Отправляем только измененные параметры
-                success_count = 0
-                error_count = 0
-                error_messages = []
-                
-                for param_path, value in current_values.items():
-                    section, key = param_path.split('.', 1)
-                    ok, msg = update_config_param(section, key, value)
-                    if ok:
-                        success_count += 1
-                    else:
-                        error_count += 1
-                        error_messages.append(f"{param_path}: {msg}")
+                # Отправляем только измененные параметры, одним пакетом
+                ok, error_messages, batched = write_config_changes(changes)
                 
                 # Формируем итоговое сообщение
-                if error_count == 0:
-                    return f"✅ Успешно отправлено {success_count} измененных параметров"
+                if ok is None:
+                    return f"📥 Нет связи с API, в очереди изменений: {len(changes)}"
+                if ok:
+                    return f"✅ Успешно отправлено {len(changes)} измененных параметров"
+                elif batched:
+                    return f"❌ Изменения не применены: {error_messages[0]}"
                 else:
-                    error_summary = f"❌ Ошибки при отправке {error_count} из {len(current_values)} параметров:\n" + "\n".join(error_messages[:3])  # Показываем только первые 3 ошибки
+                    error_summary = f"❌ Ошибки при отправке {len(error_messages)} из {len(changes)} параметров:\n" + "\n".join(error_messages[:3])  # Показываем только первые 3 ошибки
                     return error_summary
                     
             except Exception as e:
                 return f"❌ Ошибка при отправке: {str(e)}"
         
         def save_rockchip_ip(ip):
-            """Сохраняет IP Rockchip через API"""
-            ok, msg = update_config_param('rockchip', 'ip', ip)
-            return (msg if ok else f"❌ {msg}")
+            """Сохраняет IP Rockchip через API (без связи — в очередь офлайн-правок)"""
+            ok, errors, _ = write_config_changes({('rockchip', 'ip'): ip})
+            if ok is None:
+                return f"📥 Нет связи с API, правка в очереди: rockchip.ip = {ip}"
+            return "Параметр rockchip.ip обновлен" if ok else f"❌ {errors[0]}"
         
         def save_local_rtsp_url(rtsp_url):
             """Сохраняет локальный RTSP URL в конфигурацию веб-приложения"""
@@ -627,31 +1100,21 @@ def build_interface():
             else:
                 return "❌ Ошибка сохранения локального RTSP URL"
         
-        def refresh_config_from_api():
-            """Обновляет конфигурацию из API"""
-            config = load_config_from_api()
+        def refresh_config_from_api(config=None):
+            """Обновляет конфигурацию из API (или из уже загруженного config).
+
+            Без связи с API поля заполняются из снимка с правками из очереди офлайн-правок
+            """
+            message = "✅ Конфигурация обновлена из API"
+            if config is None:
+                config = load_config_from_api(max_age=0)
             if not config:
-                return "❌ Не удалось загрузить конфигурацию из API"
-            
-            # Обновляем блоки тревог в ТОЧНОМ порядке, как сформирован violation_blocks (соответствует refresh_fields)
-            violation_updates = []
-            for violation_type in violation_blocks.keys():
-                violation_config = config.get(violation_type, {})
-                # Базовые поля
-                violation_updates.extend([
-                    violation_config.get('enable', True),
-                    str(violation_config.get('duration', 5)),
-                    str(violation_config.get('threshold', 0.5))
-                ])
-                # Дополнительные поля для head_pose (в порядке, соответствующем refresh_fields)
-                if violation_type == 'head_pose':
-                    violation_updates.extend([
-                        str(violation_config.get('center_pitch', 0.5)),
-                        str(violation_config.get('center_yaw', 0.5)),
-                        str(violation_config.get('pitch', 0.2)),
-                        str(violation_config.get('yaw', 0.2)),
-                        str(violation_config.get('mask_absence_timeout', 3.0))
-                    ])
+                snapshot = config_snapshot.config
+                if not snapshot:
+                    return ["❌ Не удалось загрузить конфигурацию из API"] + [gr.skip()] * len(refresh_outputs)
+                config = apply_outbox(snapshot)
+                message = (f"⚠️ API недоступен — показан сохраненный конфиг (версия {config_snapshot.version}) "
+                           f"с правками из очереди")
             
             # Обновляем IP Rockchip в поле ввода
             rockchip_ip = config.get('rockchip', {}).get('ip', '')
@@ -659,357 +1122,276 @@ def build_interface():
             # Обновляем локальный RTSP URL
             local_rtsp_url_value = web_config.get('rtsp_stream_url', DEFAULT_URL1)
             
-            # Возвращаем данные: статус + значения полей + 4 калибровки в градусах + ip и rtsp
+            # Возвращаем данные: статус + значения полей формы + 4 калибровки в градусах + ip и rtsp
             raw_deg = config.get('head_pose', {}).get('raw_deg', {})
-            def fmt1(v):
-                try:
-                    return f"{float(v):.1f}"
-                except Exception:
-                    return "0.0"
-            raw_left = fmt1(raw_deg.get('left', 0.0))
-            raw_right = fmt1(raw_deg.get('right', 0.0))
-            raw_down = fmt1(raw_deg.get('down', 0.0))
-            raw_up = fmt1(raw_deg.get('up', 0.0))
-            return ["✅ Конфигурация обновлена из API"] + violation_updates + [raw_left, raw_right, raw_down, raw_up, rockchip_ip, local_rtsp_url_value]
+            return ([message] + violation_form.values(config)
+                    + format_raw_deg(raw_deg) + [rockchip_ip, local_rtsp_url_value])
         
         # --- Привязка событий ---
         
-        # Привязываем блоки тревог
-        for violation_type, fields in violation_blocks.items():
-            # Обработчик для чекбокса enable
-            fields['enable'].change(
-                fn=lambda checked, vt=violation_type: update_config_param_text(vt, 'enable', checked),
-                inputs=[fields['enable']],
-                outputs=[status]
-            )
-            
-            # Обработчик для поля длительности
-            fields['duration'].change(
-                fn=lambda value, vt=violation_type: update_config_param_text(vt, 'duration', float(value) if value else 5.0),
-                inputs=[fields['duration']],
-                outputs=[status]
+        # Привязываем поля блоков тревог: каждое пишется через буфер записи, с проверкой по схеме.
+        # Обработчик мгновенный, поэтому без ограничения параллельности; результат — по таймеру
+        for field in violation_form.fields:
+            section, key = field.path
+            violation_widgets[field.path].input(
+                fn=config_field_writer(section, key, field.parse),
+                inputs=[violation_widgets[field.path], write_pending],
+                outputs=[write_status, write_pending, write_timer],
+                trigger_mode="always_last", concurrency_limit=None, show_progress="hidden",
             )
-            
-            # Обработчик для поля уверенности
-            fields['threshold'].change(
-                fn=lambda value, vt=violation_type: update_config_param_text(vt, 'threshold', float(value) if value else 0.5),
-                inputs=[fields['threshold']],
-                outputs=[status]
+        write_timer.tick(poll_config_writes, [write_pending], [write_status, write_pending, write_timer],
+                         show_progress="hidden")
+        
+        # Кнопки калибровки положения головы
+        for direction in ('left', 'right', 'up', 'down'):
+            head_pose_ui[direction].click(
+                fn=calibration_job(direction),
+                outputs=[write_status] + head_pose_ui['raw'],
             )
-
-            # Дополнительные обработчики только для head_pose
-            if violation_type == 'head_pose':
-                if fields.get('center_pitch') is not None:
-                    fields['center_pitch'].change(
-                        fn=lambda value, vt=violation_type: update_config_param_text(vt, 'center_pitch', max(0.0, min(1.0, float(value) if value else 0.5))),
-                        inputs=[fields['center_pitch']],
-                        outputs=[status]
-                    )
-                if fields.get('center_yaw') is not None:
-                    fields['center_yaw'].change(
-                        fn=lambda value, vt=violation_type: update_config_param_text(vt, 'center_yaw', max(0.0, min(1.0, float(value) if value else 0.5))),
-                        inputs=[fields['center_yaw']],
-                        outputs=[status]
-                    )
-                if fields.get('pitch') is not None:
-                    fields['pitch'].change(
-                        fn=lambda value, vt=violation_type: update_config_param_text(vt, 'pitch', max(0.0, min(1.0, float(value) if value else 0.2))),
-                        inputs=[fields['pitch']],
-                        outputs=[status]
-                    )
-                if fields.get('yaw') is not None:
-                    fields['yaw'].change(
-                        fn=lambda value, vt=violation_type: update_config_param_text(vt, 'yaw', max(0.0, min(1.0, float(value) if value else 0.2))),
-                        inputs=[fields['yaw']],
-                        outputs=[status]
-                    )
-                if fields.get('mask_absence_timeout') is not None:
-                    fields['mask_absence_timeout'].change(
-                        fn=lambda value, vt=violation_type: update_config_param_text(vt, 'mask_absence_timeout', max(0.1, float(value) if value else 3.0)),
-                        inputs=[fields['mask_absence_timeout']],
-                        outputs=[status]
-                    )
-                # Кнопки калибровки положения головы
-                try:
-                    left_btn.click(
-                        fn=lambda: calibrate_and_refresh('left'),
-                        outputs=[
-                            status,
-                            violation_blocks['head_pose']['raw_left'],
-                            violation_blocks['head_pose']['raw_right'],
-                            violation_blocks['head_pose']['raw_down'],
-                            violation_blocks['head_pose']['raw_up'],
-                        ],
-                    )
-                    right_btn.click(
-                        fn=lambda: calibrate_and_refresh('right'),
-                        outputs=[
-                            status,
-                            violation_blocks['head_pose']['raw_left'],
-                            violation_blocks['head_pose']['raw_right'],
-                            violation_blocks['head_pose']['raw_down'],
-                            violation_blocks['head_pose']['raw_up'],
-                        ],
-                    )
-                    up_btn.click(
-                        fn=lambda: calibrate_and_refresh('up'),
-                        outputs=[
-                            status,
-                            violation_blocks['head_pose']['raw_left'],
-                            violation_blocks['head_pose']['raw_right'],
-                            violation_blocks['head_pose']['raw_down'],
-                            violation_blocks['head_pose']['raw_up'],
-                        ],
-                    )
-                    down_btn.click(
-                        fn=lambda: calibrate_and_refresh('down'),
-                        outputs=[
-                            status,
-                            violation_blocks['head_pose']['raw_left'],
-                            violation_blocks['head_pose']['raw_right'],
-                            violation_blocks['head_pose']['raw_down'],
-                            violation_blocks['head_pose']['raw_up'],
-                        ],
-                    )
-                except NameError:
-                    pass
         
         # Привязываем кнопки тревог
-        clear_alarm_btn.click(clear_alarm_box, outputs=[alarm_box])
-        refresh_alarm_btn.click(lambda: get_raw_udp_text(), outputs=[alarm_box])
+        filter_alarm_btn.click(
+            None,
+            inputs=[alarm_device, alarm_type, alarm_since, alarm_until],
+            js="(device, type, since, until) => { window.alarmView && window.alarmView.filter(device, type, since, until); }",
+        )
+        older_alarm_btn.click(None, js="() => { window.alarmView && window.alarmView.older(); }")
+        refresh_alarm_btn.click(None, js="() => { window.alarmView && window.alarmView.live(); }")
+        clear_alarm_btn.click(None, js="() => { window.alarmView && window.alarmView.clear(); }")
         
-        api_send_btn.click(send_all_via_api, [rockchip_ip_box] + violation_fields, [status])
+        api_send_btn.click(send_all_via_api, [rockchip_ip_box] + violation_inputs, [status])
+        def push_config_yaml():
+            ok, msg = send_config_to_rockchip()
+            return ("✅ " if ok else "❌ ") + msg
+
+        push_yaml_btn.click(push_config_yaml, None, [write_status])
+        save_fleet_btn.click(save_fleet_inventory, [fleet_inventory], [fleet_status])
+        fleet_push_btn.click(push_config_to_fleet, [fleet_inventory], [fleet_status, fleet_table])
+        fleet_retry_btn.click(lambda text: push_config_to_fleet(text, only_failed=True), [fleet_inventory], [fleet_status, fleet_table])
+        def clear_outbox():
+            config_outbox.clear()
+            return "🗑️ Очередь офлайн-правок очищена", describe_outbox()
+
+        outbox_replay_btn.click(lambda: (replay_config_outbox() or "Очередь пуста", describe_outbox()), None, [write_status, outbox_status])
+        outbox_force_btn.click(lambda: (replay_config_outbox(force=True) or "Очередь пуста", describe_outbox()), None, [write_status, outbox_status])
+        outbox_clear_btn.click(clear_outbox, None, [write_status, outbox_status])
         save_ip_btn.click(lambda ip: save_rockchip_ip(ip), [rockchip_ip_box], [status])
         save_local_rtsp_btn.click(save_local_rtsp_url, [local_rtsp_url], [status])
         
         # --- Настройки усталости ---
         gr.Markdown("### Настройки усталости (fatigue)")
-        with gr.Row():
-            fatigue_enable = gr.Checkbox(label="Включить усталость", value=bool(config.get('fatigue', {}).get('enable', False)), interactive=True)
-            fatigue_window = gr.Textbox(label="Окно, секунд", value=str(config.get('fatigue', {}).get('window_seconds', 60)), interactive=True)
-        with gr.Group():
-            gr.Markdown("#### Композитная логика")
-            with gr.Row():
-                comp_enable = gr.Checkbox(label="Включить композитную сумму", value=bool(config.get('fatigue', {}).get('composite', {}).get('enable', False)), interactive=True)
-                comp_target = gr.Textbox(label="Целевая сумма событий", value=str(config.get('fatigue', {}).get('composite', {}).get('target_sum', 3)), interactive=True)
-        with gr.Group():
-            gr.Markdown("#### Длинные моргания")
-            with gr.Row():
-                lb_enable = gr.Checkbox(label="Включить длинные моргания", value=bool(config.get('fatigue', {}).get('long_blinks', {}).get('enable', False)), interactive=True)
-                lb_ear = gr.Textbox(label="EAR порог (пусто = closed_eyes.threshold)", value=str(config.get('fatigue', {}).get('long_blinks', {}).get('ear_threshold', '')), interactive=True)
-            with gr.Row():
-                lb_min = gr.Textbox(label="Мин. длительность, c", value=str(config.get('fatigue', {}).get('long_blinks', {}).get('min_duration_s', 0.1)), interactive=True)
-                lb_max = gr.Textbox(label="Макс. длительность, c", value=str(config.get('fatigue', {}).get('long_blinks', {}).get('max_duration_s', 0.4)), interactive=True)
-                lb_count = gr.Textbox(label="Мин. число событий", value=str(config.get('fatigue', {}).get('long_blinks', {}).get('min_count', 3)), interactive=True)
-        with gr.Group():
-            gr.Markdown("#### Тренд межморганий")
-            with gr.Row():
-                it_enable = gr.Checkbox(label="Включить тренд межморганий", value=bool(config.get('fatigue', {}).get('interblink_trend', {}).get('enable', False)), interactive=True)
-                it_ear = gr.Textbox(label="EAR порог (пусто = closed_eyes.threshold)", value=str(config.get('fatigue', {}).get('interblink_trend', {}).get('ear_threshold', '')), interactive=True)
-            with gr.Row():
-                it_min_intervals = gr.Textbox(label="Мин. интервалов (>=5)", value=str(config.get('fatigue', {}).get('interblink_trend', {}).get('min_intervals', 5)), interactive=True)
-                it_avg_span = gr.Textbox(label="Окно среднего (штук)", value=str(config.get('fatigue', {}).get('interblink_trend', {}).get('avg_span', 5)), interactive=True)
-                it_decrease_ms = gr.Textbox(label="Падение среднего, мс", value=str(config.get('fatigue', {}).get('interblink_trend', {}).get('decrease_ms', 50)), interactive=True)
-                it_min_trend_events = gr.Textbox(label="Мин. событий тренда", value=str(config.get('fatigue', {}).get('interblink_trend', {}).get('min_trend_events', 3)), interactive=True)
-        with gr.Group():
-            gr.Markdown("#### Зевки")
-            with gr.Row():
-                y_enable = gr.Checkbox(label="Включить зевки", value=bool(config.get('fatigue', {}).get('yawn', {}).get('enable', False)), interactive=True)
-                y_mar = gr.Textbox(label="MAR порог (пусто = yawn.threshold)", value=str(config.get('fatigue', {}).get('yawn', {}).get('mar_threshold', '')), interactive=True)
-            with gr.Row():
-                y_min = gr.Textbox(label="Мин. длительность, c", value=str(config.get('fatigue', {}).get('yawn', {}).get('min_duration_s', 0.4)), interactive=True)
-                y_count = gr.Textbox(label="Мин. число событий", value=str(config.get('fatigue', {}).get('yawn', {}).get('min_count', 2)), interactive=True)
-        with gr.Group():
-            gr.Markdown("#### «Клевки» головой")
-            with gr.Row():
-                hn_enable = gr.Checkbox(label="Включить клевки головой", value=bool(config.get('fatigue', {}).get('head_nod', {}).get('enable', False)), interactive=True)
-                hn_pitch_down = gr.Textbox(label="Порог вниз, °", value=str(config.get('fatigue', {}).get('head_nod', {}).get('pitch_down_delta_deg', 10.0)), interactive=True)
-            with gr.Row():
-                hn_min_down = gr.Textbox(label="Мин. удержание вниз, c", value=str(config.get('fatigue', {}).get('head_nod', {}).get('min_down_duration_s', 0.3)), interactive=True)
-                hn_hyst = gr.Textbox(label="Гистерезис, °", value=str(config.get('fatigue', {}).get('head_nod', {}).get('hysteresis_deg', 3.0)), interactive=True)
-                hn_count = gr.Textbox(label="Мин. число событий", value=str(config.get('fatigue', {}).get('head_nod', {}).get('min_count', 2)), interactive=True)
+        fatigue_widgets = {}
+        build_fatigue_form(config.get('fatigue', {}), fatigue_widgets)
+        fatigue_form = ConfigForm(FATIGUE_FIELDS)
+        fatigue_fields = fatigue_form.components(fatigue_widgets)
 
         with gr.Row():
             fatigue_refresh_btn = gr.Button("🔄 Обновить усталость из API", variant="secondary")
             fatigue_save_btn = gr.Button("💾 Сохранить усталость", variant="primary")
+        # Секция fatigue в том виде, в каком она показана в полях: от нее считаются изменения
+        # при сохранении, и по ней видно, что секцию успели изменить на устройстве
+        fatigue_base = gr.State(config.get('fatigue', {}))
 
-        def fatigue_refresh():
-            cfg = load_config_from_api() or {}
-            f = cfg.get('fatigue', {}) if isinstance(cfg, dict) else {}
-            def _g(path, default):
-                try:
-                    cur = f
-                    for k in path.split('.'):
-                        cur = cur.get(k, {}) if isinstance(cur, dict) else {}
-                    return cur if isinstance(cur, (str, int, float, bool)) else default
-                except Exception:
-                    return default
-            return [
-                bool(f.get('enable', False)),
-                str(f.get('window_seconds', 60)),
-                bool(f.get('composite', {}).get('enable', False)),
-                str(f.get('composite', {}).get('target_sum', 3)),
-                bool(f.get('long_blinks', {}).get('enable', False)),
-                str(f.get('long_blinks', {}).get('ear_threshold', '')),
-                str(f.get('long_blinks', {}).get('min_duration_s', 0.1)),
-                str(f.get('long_blinks', {}).get('max_duration_s', 0.4)),
-                str(f.get('long_blinks', {}).get('min_count', 3)),
-                bool(f.get('interblink_trend', {}).get('enable', False)),
-                str(f.get('interblink_trend', {}).get('ear_threshold', '')),
-                str(f.get('interblink_trend', {}).get('min_intervals', 5)),
-                str(f.get('interblink_trend', {}).get('avg_span', 5)),
-                str(f.get('interblink_trend', {}).get('decrease_ms', 50)),
-                str(f.get('interblink_trend', {}).get('min_trend_events', 3)),
-                bool(f.get('yawn', {}).get('enable', False)),
-                str(f.get('yawn', {}).get('mar_threshold', '')),
-                str(f.get('yawn', {}).get('min_duration_s', 0.4)),
-                str(f.get('yawn', {}).get('min_count', 2)),
-                bool(f.get('head_nod', {}).get('enable', False)),
-                str(f.get('head_nod', {}).get('pitch_down_delta_deg', 10.0)),
-                str(f.get('head_nod', {}).get('min_down_duration_s', 0.3)),
-                str(f.get('head_nod', {}).get('hysteresis_deg', 3.0)),
-                str(f.get('head_nod', {}).get('min_count', 2)),
-            ]
+        def fatigue_refresh(cfg=None):
+            """Значения полей усталости и их база; без cfg читается только секция /config/fatigue"""
+            if cfg is None:
+                f = load_config_section_versioned('fatigue', max_age=0)[0]
+                if f is None:
+                    return [gr.skip()] * (len(fatigue_fields) + 1)
+            else:
+                f = cfg.get('fatigue', {}) if isinstance(cfg, dict) else {}
+            return fatigue_form.values(f) + [f]
+
+        def fatigue_queue(base, vals):
+            """Без связи с API: изменения относительно показанной версии — в очередь офлайн-правок
+            (по подсекциям fatigue, их значения на устройстве проверяются при отправке очереди)"""
+            changes, errors = fatigue_form.diff(base, vals)
+            if errors:
+                return "❌ Исправьте значения:\n" + "\n".join(errors), gr.skip()
+            f = fatigue_form.apply(base, changes)
+            queued = {('fatigue', key): value for key, value in f.items() if base.get(key) != value}
+            if not queued:
+                return "✅ Нет изменений", gr.skip()
+            ok, errors, _ = write_config_changes(queued)
+            if ok is None:
+                return f"📥 Нет связи с API, настройки усталости в очереди: {', '.join(key for _, key in queued)}", f
+            if ok:
+                return "✅ Настройки усталости сохранены", f
+            return f"❌ {errors[0]}", gr.skip()
 
-        def fatigue_save(*vals):
+        def fatigue_save(base, *vals):
             try:
-                cfg = load_config_from_api() or {}
-                f = cfg.get('fatigue', {}) if isinstance(cfg, dict) else {}
-                # распаковка порядка из fatigue_refresh
-                (
-                    v_enable, v_window,
-                    c_enable, c_target,
-                    lb_enable_v, lb_ear_v, lb_min_v, lb_max_v, lb_count_v,
-                    it_enable_v, it_ear_v, it_min_int_v, it_avg_span_v, it_dec_ms_v, it_min_trend_v,
-                    y_enable_v, y_mar_v, y_min_v, y_count_v,
-                    hn_enable_v, hn_pitch_v, hn_min_down_v, hn_hyst_v, hn_count_v
-                ) = vals
-                # базовые
-                f['enable'] = bool(v_enable)
-                f['window_seconds'] = int(float(v_window)) if str(v_window).strip() else 60
-                # composite
-                f.setdefault('composite', {})
-                f['composite']['enable'] = bool(c_enable)
-                f['composite']['target_sum'] = int(float(c_target)) if str(c_target).strip() else 3
-                # long_blinks
-                f.setdefault('long_blinks', {})
-                f['long_blinks']['enable'] = bool(lb_enable_v)
-                f['long_blinks']['ear_threshold'] = None if str(lb_ear_v).strip()=='' else float(lb_ear_v)
-                f['long_blinks']['min_duration_s'] = float(lb_min_v)
-                f['long_blinks']['max_duration_s'] = float(lb_max_v)
-                f['long_blinks']['min_count'] = int(float(lb_count_v))
-                # interblink_trend
-                f.setdefault('interblink_trend', {})
-                f['interblink_trend']['enable'] = bool(it_enable_v)
-                f['interblink_trend']['ear_threshold'] = None if str(it_ear_v).strip()=='' else float(it_ear_v)
-                f['interblink_trend']['min_intervals'] = max(5, int(float(it_min_int_v)))
-                f['interblink_trend']['avg_span'] = int(float(it_avg_span_v))
-                f['interblink_trend']['decrease_ms'] = int(float(it_dec_ms_v))
-                f['interblink_trend']['min_trend_events'] = int(float(it_min_trend_v))
-                # yawn
-                f.setdefault('yawn', {})
-                f['yawn']['enable'] = bool(y_enable_v)
-                f['yawn']['mar_threshold'] = None if str(y_mar_v).strip()=='' else float(y_mar_v)
-                f['yawn']['min_duration_s'] = float(y_min_v)
-                f['yawn']['min_count'] = int(float(y_count_v))
-                # head_nod
-                f.setdefault('head_nod', {})
-                f['head_nod']['enable'] = bool(hn_enable_v)
-                f['head_nod']['pitch_down_delta_deg'] = float(hn_pitch_v)
-                f['head_nod']['min_down_duration_s'] = float(hn_min_down_v)
-                f['head_nod']['hysteresis_deg'] = float(hn_hyst_v)
-                f['head_nod']['min_count'] = int(float(hn_count_v))
-                cfg['fatigue'] = f
-                # полное сохранение через PUT
-                resp = requests.put(f"{API_BASE_URL}/config", json=cfg, timeout=10)
-                if resp.status_code == 200:
-                    return "✅ Настройки усталости сохранены"
-                return f"❌ Ошибка API: {resp.status_code} - {resp.text}"
+                # Сравнение с версией на устройстве (условный GET секции, обычно 304): если ее
+                # изменили после загрузки в поля, сохранение затерло бы чужие правки
+                current, etag = load_config_section_versioned('fatigue', max_age=0)
+                if current is None and api.online is False:
+                    return fatigue_queue(base, vals)
+                if current is None:
+                    return "❌ Не удалось загрузить настройки усталости из API", gr.skip()
+                if current != base:
+                    return "⚠️ Настройки усталости на устройстве изменились — обновите их из API и повторите", gr.skip()
+                changes, errors = fatigue_form.diff(current, vals)
+                if errors:
+                    return "❌ Исправьте значения:\n" + "\n".join(errors), gr.skip()
+                f = fatigue_form.apply(current, changes)
+                # Только изменившиеся поля секции; If-Match защищает от записи поверх чужой версии
+                ok, msg = update_config_section('fatigue', current, f, etag)
+                if ok:
+                    return f"✅ Настройки усталости сохранены: {msg.lower()}", f
+                return f"❌ {msg}", gr.skip()
             except Exception as e:
-                return f"❌ Ошибка сохранения: {str(e)}"
+                return f"❌ Ошибка сохранения: {str(e)}", gr.skip()
 
         fatigue_refresh_btn.click(
             fn=fatigue_refresh,
-            outputs=[
-                fatigue_enable, fatigue_window,
-                comp_enable, comp_target,
-                lb_enable, lb_ear, lb_min, lb_max, lb_count,
-                it_enable, it_ear, it_min_intervals, it_avg_span, it_decrease_ms, it_min_trend_events,
-                y_enable, y_mar, y_min, y_count,
-                hn_enable, hn_pitch_down, hn_min_down, hn_hyst, hn_count,
-            ]
+            outputs=fatigue_fields + [fatigue_base],
         )
 
         fatigue_save_btn.click(
             fn=fatigue_save,
-            inputs=[
-                fatigue_enable, fatigue_window,
-                comp_enable, comp_target,
-                lb_enable, lb_ear, lb_min, lb_max, lb_count,
-                it_enable, it_ear, it_min_intervals, it_avg_span, it_decrease_ms, it_min_trend_events,
-                y_enable, y_mar, y_min, y_count,
-                hn_enable, hn_pitch_down, hn_min_down, hn_hyst, hn_count,
-            ],
-            outputs=[status]
+            inputs=[fatigue_base] + fatigue_fields,
+            outputs=[write_status, fatigue_base]
         )
 
         # Обновляем значения, включая дополнительные head_pose поля, плюс 4 калибровки в градусах
-        refresh_config_btn.click(
-            refresh_config_from_api,
-            None,
-            [
-                status,
-                *refresh_fields,
-                violation_blocks['head_pose']['raw_left'],
-                violation_blocks['head_pose']['raw_right'],
-                violation_blocks['head_pose']['raw_down'],
-                violation_blocks['head_pose']['raw_up'],
-                rockchip_ip_box,
-                local_rtsp_url,
-            ],
-        )
+        refresh_outputs = violation_inputs + head_pose_ui['raw'] + [rockchip_ip_box, local_rtsp_url]
+        refresh_config_btn.click(refresh_config_from_api, None, [write_status] + refresh_outputs)
 
-        # Автообновление окна RAW UDP тревог при получении новых сообщений
-        alarm_timer = gr.Timer(value=1.0)  # Проверяем каждую секунду
-        alarm_timer.tick(
-            fn=check_and_update_alarms,
-            outputs=[alarm_box]
-        )
+        def hydrate_from_api():
+            """При открытии страницы заменяет значения из снимка живым конфигом.
+
+            Конфиг обычно уже в кэше: его загрузка запускается в фоне при старте (prefetch_config).
+            Обработчики полей подписаны на .input, поэтому подстановка значений не отправляет их обратно.
+            """
+            config = load_config_from_api()
+            if not config:
+                message = (f"⚠️ API недоступен — показан сохраненный конфиг (версия {config_snapshot.version}); "
+                           f"правки ставятся в очередь и уйдут при подключении")
+                return [message, describe_outbox()] + [gr.skip()] * (len(refresh_outputs) + len(fatigue_fields) + 1)
+            # Связь есть — сначала отправляем то, что накопилось офлайн
+            replayed = replay_config_outbox()
+            if replayed:
+                config = load_config_from_api() or config
+            values = refresh_config_from_api(config)
+            return [replayed or values[0], describe_outbox()] + values[1:] + fatigue_refresh(config)
+
+        demo.load(hydrate_from_api, None, [write_status, outbox_status] + refresh_outputs + fatigue_fields + [fatigue_base], show_progress="hidden")
+
+        # Окно тревог обновляется push-ом: подписка на /alarms/stream при открытии страницы
+        demo.load(None, js=ALARM_VIEW_JS)
     
     return demo
 
 # --- UDP listener for DSM alarms ---
-def udp_alarm_listener(host="0.0.0.0", port=8008):
-    import socket
-    global new_alarm_received
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+alarm_store = AlarmStore(ALARM_DB_PATH)
+# Повторы одного нарушения устройства в пределах окна склеиваются в одно событие
+alarm_coalescer = AlarmCoalescer(window=float(web_config.get('alarm_coalesce_window', 5.0)))
+
+def on_alarm_batch(records):
+    """Sink приемника: склейка повторов, запись новых событий и рассылка подписчикам"""
+    alarms = alarm_coalescer.add([parse_alarm(r) for r in records])
+    alarm_feed.add(alarm_store.add(alarms))
+
+def on_alarms_changed(events):
+    """Раз в секунду: новые счетчики повторов — в хранилище и открытым вкладкам"""
+    alarm_store.update(events)
+    alarm_feed.update(events)
+
+alarm_ingestor = AlarmIngestor(host="0.0.0.0", port=8008, sinks=[on_alarm_batch])
+
+def collect_alarm_metrics():
+    """Счетчики приема, склейки и записи тревог для /metrics"""
+    ingest = alarm_ingestor.stats()
+    coalesce = alarm_coalescer.stats()
+    store = alarm_store.stats()
+    return [
+        ('alarm_datagrams_received_total', 'counter', 'UDP alarm datagrams read from the socket', [({}, ingest['received'])]),
+        ('alarm_datagrams_parsed_total', 'counter', 'UDP alarm datagrams parsed as JSON', [({}, ingest['parsed'])]),
+        ('alarm_datagrams_malformed_total', 'counter', 'UDP alarm datagrams that were not valid JSON', [({}, ingest['malformed'])]),
+        ('alarm_datagrams_dropped_total', 'counter', 'UDP alarm datagrams dropped because the parse queue was full', [({}, ingest['dropped'])]),
+        ('alarm_ingest_queued_batches', 'gauge', 'Batches waiting to be parsed', [({}, ingest['queued_batches'])]),
+        ('alarm_coalesce_open_events', 'gauge', 'Alarm events still collecting repeats', [({}, coalesce['open'])]),
+        ('alarm_coalesce_opened_total', 'counter', 'Alarm events opened by the coalescer', [({}, coalesce['opened'])]),
+        ('alarm_coalesce_merged_total', 'counter', 'Repeats merged into an open event', [({}, coalesce['merged'])]),
+        ('alarm_coalesce_evicted_total', 'counter', 'Open events closed early because of the open-event limit', [({}, coalesce['evicted'])]),
+        ('alarm_store_written_total', 'counter', 'Alarms written to the store', [({}, store['written'])]),
+        ('alarm_store_dropped_total', 'counter', 'Alarms dropped because the write queue was full or the write failed', [({}, store['dropped'])]),
+        ('alarm_store_write_errors_total', 'counter', 'Failed store write batches', [({}, store['write_errors'])]),
+        ('alarm_store_queued_batches', 'gauge', 'Batches waiting to be written to the store', [({}, store['queued_batches'])]),
+        ('alarm_store_last_flush_seconds', 'gauge', 'Duration of the last store write', [({}, store['last_flush_s'])]),
+    ]
+
+api.metrics.register_collector(collect_alarm_metrics)
+
+# --- Start UDP listener in background threads ---
+def start_udp_listener():
+    # После перезапуска лента продолжается с последних тревог из хранилища
     try:
-        sock.bind((host, port))
-        print(f"[UDP] Listening for DSM alarms on {host}:{port}")
-        while True:
-            try:
-                data, addr = sock.recvfrom(4096)
-                msg = data.decode("utf-8")
-                raw_udp_log.append(msg)
-                new_alarm_received = True  # Устанавливаем флаг при получении новой тревоги
-                print(f"[UDP] RAW from {addr}: {msg}")
-            except Exception as e:
-                print(f"[UDP] Error: {e}")
-                time.sleep(1)
-    except OSError as e:
-        print(f"[UDP] Port {port} already in use, skipping UDP listener: {e}")
+        alarm_feed.add(alarm_store.recent(ALARM_MAX))
     except Exception as e:
-        print(f"[UDP] Error: {e}")
+        print(f"[ALARM_STORE] Failed to load recent alarms: {e}")
+    alarm_store.start()
+    alarm_coalescer.start(on_alarms_changed)
+    alarm_ingestor.start()
 
-# --- Start UDP listener in background thread ---
-def start_udp_listener():
-    t = threading.Thread(target=udp_alarm_listener, daemon=True)
-    t.start()
+def create_app(demo):
+    """FastAPI приложение: SSE лента тревог, страницы истории и Gradio интерфейс в корне"""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import PlainTextResponse, StreamingResponse
+
+    app = FastAPI()
+
+    @app.get("/alarms")
+    def alarms_page(device: str = None, type: str = None, since: str = None, until: str = None,
+                    before: str = None, limit: int = ALARM_PAGE_SIZE):
+        """Страница истории тревог, новые первыми; next — курсор следующей (более старой) страницы"""
+        # Снимаем до запроса: все тревоги, записанные позже, подписчик получит по SSE начиная с head
+        head = alarm_feed.cursor_after(alarm_store.last_written_id)
+        limit = max(1, min(limit, 500))
+        items = alarm_store.query(
+            device or None, type or None, parse_ts(since), parse_ts(until),
+            limit=limit, before=parse_cursor(before),
+        )
+        next_cursor = make_cursor(items[-1]) if len(items) == limit else None
+        return {"items": items, "next": next_cursor, "head": head}
+
+    @app.get("/metrics")
+    def metrics_endpoint():
+        """Задержки, повторы и ошибки вызовов API рокчипа в формате Prometheus"""
+        return PlainTextResponse(api.metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+    @app.get("/alarms/stream")
+    async def alarms_stream(request: Request, cursor: int = 0):
+        # При переподключении EventSource присылает номер последней полученной записи
+        last_event_id = request.headers.get("last-event-id")
+        if last_event_id and last_event_id.isdigit():
+            cursor = int(last_event_id)
+        return StreamingResponse(
+            sse_events(alarm_feed, cursor),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    import gradio as gr
+
+    # Gradio монтируется последним: маршрут "/" перехватывает все остальные пути
+    return gr.mount_gradio_app(app, demo, path="/")
 
 def main():
+    startup_mark("module imports")
+    # Живой конфиг грузится параллельно с импортом gradio и построением интерфейса
+    threading.Thread(target=prefetch_config, daemon=True).start()
+    import gradio
+    import uvicorn
+    startup_mark("import gradio, uvicorn")
     start_udp_listener()
+    start_outbox_replay(float(web_config.get('outbox_retry_interval', 15.0)))
+    startup_mark("alarm listener")
     demo = build_interface()
-    demo.launch(server_name="0.0.0.0", server_port=7860)
+    startup_mark("build interface")
+    app = create_app(demo)
+    startup_mark("mount app")
+    uvicorn.run(app, host="0.0.0.0", port=7860)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
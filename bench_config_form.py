@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Замер формы параметров по схеме config_schema: время построения виджетов и одного обновления
+полей (значения из конфига + JSON для браузера, diff для отправки) в зависимости от числа
+типов тревог. Рост должен быть линейным: время на один тип примерно постоянно.
+
+Пример:
+    python bench_config_form.py --types 8 16 32 64 128 --repeat 200
+"""
+
+import argparse
+import json
+import time
+
+from config_schema import FATIGUE_FIELDS, ConfigForm, violations_form
+
+
+def make_types(count):
+    return {f'violation_{i}': f'Тревога {i}' for i in range(count)}
+
+
+def make_config(types):
+    config = {
+        violation_type: {'enable': i % 2 == 0, 'duration': 5.0 + i, 'threshold': 0.5}
+        for i, violation_type in enumerate(types)
+    }
+    config['fatigue'] = {'enable': True, 'window_seconds': 60, 'long_blinks': {'enable': True, 'min_count': 3}}
+    return config
+
+
+def bench_build(types, config):
+    import gradio as gr
+    from config_schema import build_fatigue_form, build_violation_grid
+    started = time.perf_counter()
+    violation_widgets, fatigue_widgets = {}, {}
+    with gr.Blocks():
+        build_violation_grid(types, config, violation_widgets)
+        build_fatigue_form(config['fatigue'], fatigue_widgets)
+    elapsed = time.perf_counter() - started
+    return elapsed, len(violation_widgets) + len(fatigue_widgets)
+
+
+def bench_refresh(form, fatigue_form, config, repeat):
+    """Одно обновление: значения всех полей и их JSON; затем diff тех же значений с конфигом"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        values = form.values(config) + fatigue_form.values(config['fatigue'])
+        payload = json.dumps(values, ensure_ascii=False)
+    refresh = (time.perf_counter() - started) / repeat
+
+    ui_values = form.values(config)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        changes, errors = form.diff(config, ui_values)
+    diff = (time.perf_counter() - started) / repeat
+    assert not changes and not errors
+    return refresh, diff, len(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Масштабирование формы параметров по числу типов тревог")
+    parser.add_argument('--types', type=int, nargs='+', default=[8, 16, 32, 64, 128], help="числа типов тревог")
+    parser.add_argument('--repeat', type=int, default=200, help="повторов обновления на замер")
+    parser.add_argument('--no-build', action='store_true', help="не замерять построение виджетов (без gradio)")
+    args = parser.parse_args()
+
+    if not args.no_build:
+        # Первый импорт gradio и прогрев — не в счет
+        bench_build(make_types(1), make_config(make_types(1)))
+
+    fatigue_form = ConfigForm(FATIGUE_FIELDS)
+    print(f"{'types':>6} {'fields':>7} {'build ms':>9} {'build us/type':>14} "
+          f"{'refresh us':>11} {'us/type':>8} {'diff us':>8} {'us/type':>8} {'JSON B':>7}")
+    for count in args.types:
+        types = make_types(count)
+        config = make_config(types)
+        form = violations_form(types)
+        build_ms, build_per_type, widgets = float('nan'), float('nan'), len(form) + len(fatigue_form)
+        if not args.no_build:
+            build_s, widgets = bench_build(types, config)
+            build_ms, build_per_type = build_s * 1000, build_s * 1e6 / count
+        refresh, diff, payload = bench_refresh(form, fatigue_form, config, args.repeat)
+        print(f"{count:>6} {widgets:>7} {build_ms:>9.1f} {build_per_type:>14.0f} "
+              f"{refresh * 1e6:>11.1f} {refresh * 1e6 / count:>8.2f} "
+              f"{diff * 1e6:>8.1f} {diff * 1e6 / count:>8.2f} {payload:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест MJPEG сервера: N локальных клиентов /video против синтетического источника
+
+Пример:
+    python bench_mjpeg.py --clients 200 --duration 10 --mode async
+    python bench_mjpeg.py --clients 200 --duration 10 --mode threaded
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+BOUNDARY = b'--frame\r\n'
+
+
+async def mjpeg_client(host, port, path, deadline, result):
+    """Читает поток /video до дедлайна и считает полученные кадры и байты"""
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError as e:
+        result['error'] = str(e)
+        return
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n".encode())
+    await writer.drain()
+    tail = b''
+    first_frame_at = None
+    started = time.monotonic()
+    try:
+        while time.monotonic() < deadline:
+            try:
+                chunk = await asyncio.wait_for(reader.read(65536), timeout=max(0.01, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            result['bytes'] += len(chunk)
+            # Граница может разрезаться между чанками — ищем ее в хвосте предыдущего чанка
+            data = tail + chunk
+            frames = data.count(BOUNDARY)
+            if frames and first_frame_at is None:
+                first_frame_at = time.monotonic()
+            result['frames'] += frames
+            tail = data[-(len(BOUNDARY) - 1):]
+    finally:
+        writer.close()
+    if first_frame_at is not None:
+        result['first_frame_s'] = first_frame_at - started
+
+
+async def run_clients(host, port, path, clients, duration):
+    deadline = time.monotonic() + duration
+    results = [{'frames': 0, 'bytes': 0, 'first_frame_s': None} for _ in range(clients)]
+    await asyncio.gather(*(mjpeg_client(host, port, path, deadline, r) for r in results))
+    return results
+
+
+def wait_for_port(host, port, timeout=20.0):
+    import socket
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест MJPEG сервера")
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--mode', choices=['threaded', 'async'], default='async')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--path', default='/video')
+    parser.add_argument('--external', action='store_true', help="не запускать сервер, подключиться к уже работающему")
+    args = parser.parse_args()
+
+    host = '127.0.0.1'
+    server = None
+    if not args.external:
+        server_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mjpeg_server.py')
+        server = subprocess.Popen(
+            [sys.executable, server_py, '--mode', args.mode, '--synthetic',
+             '--host', host, '--port', str(args.port)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+    try:
+        if not wait_for_port(host, args.port):
+            print("❌ Сервер не поднялся")
+            return
+        print(f"Mode: {args.mode}, clients: {args.clients}, duration: {args.duration}s")
+        results = asyncio.run(run_clients(host, args.port, args.path, args.clients, args.duration))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    ok = [r for r in results if r['frames'] > 0]
+    errors = [r for r in results if 'error' in r]
+    fps = sorted(r['frames'] / args.duration for r in results)
+    total_mb = sum(r['bytes'] for r in results) / 1e6
+    first = sorted(r['first_frame_s'] for r in ok if r['first_frame_s'] is not None)
+    print("=" * 50)
+    print(f"Clients with frames: {len(ok)}/{args.clients}, connect errors: {len(errors)}")
+    if fps:
+        print(f"FPS per client: min {fps[0]:.1f}, median {fps[len(fps) // 2]:.1f}, max {fps[-1]:.1f}")
+    if first:
+        print(f"Time to first frame: median {first[len(first) // 2] * 1000:.0f} ms, max {first[-1] * 1000:.0f} ms")
+    print(f"Served: {total_mb:.1f} MB ({total_mb * 8 / args.duration:.1f} Mbit/s)")
+
+
+if __name__ == "__main__":
+    main()
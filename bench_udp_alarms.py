@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест приема UDP тревог: локальный флуд датаграммами DSM на AlarmIngestor
+
+Пример:
+    python bench_udp_alarms.py --messages 200000 --senders 4
+"""
+
+import argparse
+import json
+import socket
+import threading
+import time
+
+from alarm_ingest import AlarmIngestor
+
+
+def make_payload(device, n, malformed_every):
+    if malformed_every and n % malformed_every == 0:
+        return b'{not json'
+    return json.dumps({
+        "device_id": f"cab{device}",
+        "type": "closed_eyes",
+        "confidence": 0.91,
+        "timestamp": time.time(),
+        "seq": n,
+    }).encode()
+
+
+def sender(port, count, device, malformed_every, rate):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    interval = 1.0 / rate if rate else 0.0
+    next_at = time.perf_counter()
+    for n in range(count):
+        sock.sendto(make_payload(device, n, malformed_every), ("127.0.0.1", port))
+        if interval:
+            next_at += interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Флуд UDP тревогами на локальный приемник")
+    parser.add_argument('--messages', type=int, default=100000, help="всего датаграмм")
+    parser.add_argument('--senders', type=int, default=4, help="число параллельных отправителей (устройств)")
+    parser.add_argument('--rate', type=float, default=0, help="датаграмм в секунду на отправителя (0 — без ограничения)")
+    parser.add_argument('--malformed-every', type=int, default=100, help="каждая N-я датаграмма — битый JSON")
+    parser.add_argument('--sink-delay-ms', type=float, default=0.0, help="искусственная задержка sink на пачку")
+    parser.add_argument('--db', help="писать тревоги в AlarmStore по этому пути и замерить выборку")
+    parser.add_argument('--coalesce-window', type=float, default=0.0,
+                        help="склеивать повторы (device, type) перед записью, окно в секундах")
+    args = parser.parse_args()
+
+    delivered = [0]
+
+    def counting_sink(records):
+        delivered[0] += len(records)
+        if args.sink_delay_ms:
+            time.sleep(args.sink_delay_ms / 1000.0)
+
+    store = None
+    coalescer = None
+    sinks = [counting_sink]
+    if args.db:
+        from alarm_coalesce import AlarmCoalescer
+        from alarm_store import AlarmStore, parse_alarm
+        store = AlarmStore(args.db).start()
+        coalescer = AlarmCoalescer(window=args.coalesce_window)
+        coalescer.start(store.update)
+        sinks.append(lambda records: store.add(coalescer.add([parse_alarm(r) for r in records])))
+
+    ingestor = AlarmIngestor(host="127.0.0.1", port=0, sinks=sinks, log_per_second=0)
+    if not ingestor.start():
+        print("❌ Не удалось запустить приемник")
+        return
+
+    per_sender = args.messages // args.senders
+    total = per_sender * args.senders
+    threads = [
+        threading.Thread(target=sender, args=(ingestor.port, per_sender, i, args.malformed_every, args.rate))
+        for i in range(args.senders)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    send_time = time.perf_counter() - started
+
+    # Ждем, пока приемник дочитает сокет и разберет очередь
+    last = -1
+    while True:
+        time.sleep(0.2)
+        stats = ingestor.stats()
+        if stats['received'] == last and stats['queued_batches'] == 0:
+            break
+        last = stats['received']
+    elapsed = time.perf_counter() - started
+
+    stats = ingestor.stats()
+    print("=" * 50)
+    print(f"Sent:      {total} datagrams in {send_time:.2f}s ({total / send_time:.0f}/s)")
+    print(f"Received:  {stats['received']} ({stats['received'] / elapsed:.0f}/s), batches: {stats['batches']}, "
+          f"avg batch {stats['received'] / max(1, stats['batches']):.1f}")
+    print(f"Parsed:    {stats['parsed']}, malformed: {stats['malformed']}")
+    print(f"Dropped:   {stats['dropped']} in queue, {total - stats['received']} in kernel (socket buffer overflow)")
+    print(f"Delivered: {delivered[0]} to sinks")
+
+    if store is not None:
+        # Последние счетчики повторов уходят в хранилище с тиком склейки
+        time.sleep(1.2)
+        store.flush()
+        print(f"Coalesced: {coalescer.stats()}")
+        print(f"Stored:    {store.stats()}")
+        since = time.time() - 3600
+        started = time.perf_counter()
+        rows = store.query(device="cab1", alarm_type="closed_eyes", since=since, limit=100)
+        total = store.count(device="cab1", alarm_type="closed_eyes", since=since)
+        print(f"Query cab1/closed_eyes last hour: {len(rows)} of {total} rows "
+              f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Общий супервизор RTSP-захвата для mjpeg_server.py и app.py:
+переподключение с экспоненциальной задержкой и учет здоровья соединения
+"""
+
+import random
+import threading
+import time
+
+import cv2
+
+
+def open_capture(url, open_timeout_ms=3000, read_timeout_ms=3000):
+    """Открывает поток через FFmpeg с короткими таймаутами открытия и чтения"""
+    params = []
+    # Параметры таймаутов есть в OpenCV >= 4.5.2; на старых версиях открываем без них
+    if hasattr(cv2, 'CAP_PROP_OPEN_TIMEOUT_MSEC'):
+        params += [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, open_timeout_ms]
+    if hasattr(cv2, 'CAP_PROP_READ_TIMEOUT_MSEC'):
+        params += [cv2.CAP_PROP_READ_TIMEOUT_MSEC, read_timeout_ms]
+    cap = cv2.VideoCapture(url, cv2.CAP_FFMPEG, params) if params else cv2.VideoCapture(url, cv2.CAP_FFMPEG)
+    # Уменьшаем буферизацию, чтобы снизить задержку
+    try:
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    except Exception:
+        pass
+    return cap
+
+
+class Backoff:
+    """Экспоненциальная задержка с джиттером; первая повторная попытка — сразу"""
+
+    def __init__(self, base=0.25, factor=2.0, max_delay=10.0, jitter=0.5):
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.attempt = 0
+
+    def next_delay(self):
+        attempt = self.attempt
+        self.attempt += 1
+        if attempt == 0:
+            return 0.0
+        delay = min(self.max_delay, self.base * self.factor ** (attempt - 1))
+        # Джиттер разводит во времени переподключения нескольких камер за одним VPN
+        return delay * random.uniform(1.0 - self.jitter, 1.0)
+
+    def reset(self):
+        self.attempt = 0
+
+
+class CaptureSupervisor:
+    """Учет здоровья одного RTSP-соединения и политика переподключения.
+
+    Вызывающий код сам читает кадры и сообщает супервизору о результате:
+    frame_ok() на каждый кадр, frame_failed() на ошибку чтения.
+    """
+
+    def __init__(self, name, stall_timeout=5.0, backoff=None):
+        self.name = name
+        self.stall_timeout = stall_timeout
+        self.backoff = backoff or Backoff()
+        self._lock = threading.Lock()
+        self.state = 'idle'  # idle | connecting | streaming | down
+        self.connect_attempts = 0
+        self.connects = 0
+        self.failed_opens = 0
+        self.decode_errors = 0
+        self.stalls = 0
+        self.frames = 0
+        self.fps = 0.0
+        self.last_time_to_first_frame_s = None
+        self.last_outage_s = None
+        self._connect_started = None
+        self._outage_started = None
+        self._last_frame_at = None
+        self._last_pos = None
+        self._last_pos_change_at = None
+        self._stall_reported = False
+
+    def open(self, url):
+        """Открывает capture; isOpened() проверяет вызывающий код"""
+        with self._lock:
+            self.connect_attempts += 1
+            self._connect_started = time.monotonic()
+            self.state = 'connecting'
+        print(f"[RTSP] [{self.name}] Opening stream via FFmpeg: {url}")
+        cap = open_capture(url)
+        if not cap.isOpened():
+            with self._lock:
+                self.failed_opens += 1
+                self._mark_down()
+        return cap
+
+    def wait_retry(self, stop=None):
+        """Пауза перед следующей попыткой; возвращает длительность паузы"""
+        delay = self.backoff.next_delay()
+        if delay > 0:
+            if stop is not None:
+                stop.wait(delay)
+            else:
+                time.sleep(delay)
+        return delay
+
+    def frame_ok(self, cap=None):
+        """Отмечает успешно прочитанный кадр.
+
+        Возвращает False, если метка времени кадра не меняется дольше stall_timeout
+        (картинка "замерзла", хотя чтение проходит) — соединение стоит переоткрыть.
+        """
+        now = time.monotonic()
+        pos = None
+        if cap is not None:
+            try:
+                pos = cap.get(cv2.CAP_PROP_POS_MSEC)
+            except Exception:
+                pos = None
+        with self._lock:
+            if self.state != 'streaming':
+                if self._connect_started is not None:
+                    self.last_time_to_first_frame_s = now - self._connect_started
+                if self._outage_started is not None:
+                    self.last_outage_s = now - self._outage_started
+                    print(f"[RTSP] [{self.name}] Video restored after {self.last_outage_s:.2f}s outage")
+                    self._outage_started = None
+                self.connects += 1
+                self.state = 'streaming'
+                self.backoff.reset()
+                self._last_pos, self._last_pos_change_at = None, now
+            elif self._last_frame_at is not None:
+                interval = now - self._last_frame_at
+                if interval > self.stall_timeout:
+                    # Кадр пришел, но после долгой паузы; сторож мог это уже учесть
+                    if not self._stall_reported:
+                        self.stalls += 1
+                elif interval > 0:
+                    # Скользящее среднее частоты декодирования
+                    self.fps += 0.1 * (1.0 / interval - self.fps)
+            self._stall_reported = False
+            self._last_frame_at = now
+            self.frames += 1
+            # Некоторые live-потоки не отдают метку времени (0) — их не проверяем
+            if pos:
+                if pos != self._last_pos:
+                    self._last_pos, self._last_pos_change_at = pos, now
+                elif now - self._last_pos_change_at > self.stall_timeout:
+                    self.stalls += 1
+                    self._mark_down()
+                    return False
+            return True
+
+    def frame_failed(self):
+        """Отмечает ошибку чтения/декодирования кадра"""
+        with self._lock:
+            self.decode_errors += 1
+            self._mark_down()
+
+    def check_stall(self):
+        """Сторож: True, если поток только что перестал присылать кадры дольше stall_timeout"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state != 'streaming' or self._stall_reported or self._last_frame_at is None:
+                return False
+            if now - self._last_frame_at <= self.stall_timeout:
+                return False
+            self.stalls += 1
+            self._stall_reported = True
+        print(f"[RTSP] [{self.name}] No frames for {self.stall_timeout:.0f}s, stream stalled")
+        return True
+
+    def _mark_down(self):
+        self.state = 'down'
+        if self._outage_started is None:
+            self._outage_started = time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'state': self.state,
+                'connect_attempts': self.connect_attempts,
+                'connects': self.connects,
+                'failed_opens': self.failed_opens,
+                'decode_errors': self.decode_errors,
+                'stalls': self.stalls,
+                'frames': self.frames,
+                'fps': self.fps if self.state == 'streaming' and not self._stall_reported else 0.0,
+                'last_time_to_first_frame_s': self.last_time_to_first_frame_s,
+                'last_outage_s': self.last_outage_s,
+                'current_outage_s': now - self._outage_started if self._outage_started is not None else None,
+                'seconds_since_last_frame': now - self._last_frame_at if self._last_frame_at is not None else None,
+            }
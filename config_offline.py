@@ -0,0 +1,211 @@
+"""
+Работа без связи с API рокчипа: версионированный снимок последнего загруженного конфига
+и очередь (outbox) правок, сделанных офлайн, — оба в JSON файлах рядом с web_config.yaml
+"""
+
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+
+def config_digest(config):
+    """SHA-256 канонического JSON конфига: одинаков для YAML файла и ответа API с тем же содержимым"""
+    canonical = json.dumps(config, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def config_mismatch(expected, actual, path=''):
+    """Первое расхождение expected с actual ("cigarette.threshold") или None.
+
+    Сравниваются только ключи expected: сервис может дополнить конфиг значениями по умолчанию.
+    Числа сравниваются с допуском — 1 и 1.0 после JSON равны.
+    """
+    if isinstance(expected, dict):
+        if not isinstance(actual, dict):
+            return path or '.'
+        for key, value in expected.items():
+            key_path = f"{path}.{key}" if path else str(key)
+            if key not in actual:
+                return key_path
+            mismatch = config_mismatch(value, actual[key], key_path)
+            if mismatch:
+                return mismatch
+        return None
+    if isinstance(expected, list):
+        if not isinstance(actual, list) or len(actual) != len(expected):
+            return path or '.'
+        for i, (a, b) in enumerate(zip(expected, actual)):
+            mismatch = config_mismatch(a, b, f"{path}[{i}]")
+            if mismatch:
+                return mismatch
+        return None
+    numbers = (int, float)
+    if (isinstance(expected, numbers) and isinstance(actual, numbers)
+            and not isinstance(expected, bool) and not isinstance(actual, bool)):
+        return None if abs(expected - actual) <= 1e-9 * max(1.0, abs(expected)) else path
+    if isinstance(expected, bool) != isinstance(actual, bool):
+        return path or '.'
+    return None if expected == actual else (path or '.')
+
+
+def _write_json(path, data):
+    """Атомарная запись: файл либо старый, либо новый целиком"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"[OFFLINE] Failed to read {path}: {e}")
+        return None
+
+
+class ConfigSnapshot:
+    """Последний успешно загруженный конфиг: {version, digest, saved_at, config}.
+
+    Версия растет только при изменении содержимого, поэтому частые загрузки одного и того же
+    конфига файл не переписывают.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = None
+
+    def _load_locked(self):
+        if self._data is None:
+            data = _read_json(self.path) or {}
+            if not {'version', 'digest', 'config'} <= data.keys():
+                # Снимок старого формата — просто конфиг
+                data = {'version': 0, 'digest': config_digest(data), 'saved_at': None, 'config': data}
+            self._data = data
+        return self._data
+
+    @property
+    def config(self):
+        """Копия конфига из снимка; {} если снимка нет"""
+        with self._lock:
+            return copy.deepcopy(self._load_locked()['config'])
+
+    @property
+    def version(self):
+        with self._lock:
+            return self._load_locked()['version']
+
+    def save(self, config):
+        """Сохраняет конфиг, если он отличается от снимка; возвращает версию снимка"""
+        if not config:
+            return self.version
+        digest = config_digest(config)
+        with self._lock:
+            data = self._load_locked()
+            if digest == data['digest']:
+                return data['version']
+            new_data = {
+                'version': data['version'] + 1,
+                'digest': digest,
+                'saved_at': datetime.now().isoformat(),
+                'config': copy.deepcopy(config),
+            }
+            try:
+                _write_json(self.path, new_data)
+            except Exception as e:
+                print(f"[OFFLINE] Failed to save config snapshot: {e}")
+                return data['version']
+            self._data = new_data
+            return new_data['version']
+
+
+class ConfigOutbox:
+    """Очередь правок {(section, key): value}, не отправленных из-за отсутствия связи с API.
+
+    Для каждого поля хранится base — значение на устройстве, от которого сделана правка
+    (из снимка). При отправке поле, изменившееся на устройстве с тех пор, считается конфликтом.
+    Без снимка (base_config пуст) base неизвестно и в записи отсутствует: такая правка
+    отправляется без проверки конфликта.
+    Очередь пишется на диск при каждом изменении и переживает перезапуск.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        for entry in _read_json(path) or []:
+            self._entries[(entry['section'], entry['key'])] = entry
+
+    def _save_locked(self):
+        try:
+            _write_json(self.path, list(self._entries.values()))
+        except Exception as e:
+            print(f"[OFFLINE] Failed to save outbox: {e}")
+
+    def put(self, changes, base_config):
+        """Ставит правки в очередь; base берется из base_config для новых и конфликтных полей"""
+        with self._lock:
+            for (section, key), value in changes.items():
+                entry = self._entries.get((section, key))
+                if entry is None or 'conflict' in entry:
+                    entry = {'section': section, 'key': key}
+                    if base_config:
+                        section_config = base_config.get(section)
+                        entry['base'] = section_config.get(key) if isinstance(section_config, dict) else None
+                    self._entries[(section, key)] = entry
+                entry['value'] = value
+                entry['queued_at'] = time.time()
+            self._save_locked()
+
+    def entries(self):
+        with self._lock:
+            return copy.deepcopy(list(self._entries.values()))
+
+    def has_pending(self):
+        """Есть ли правки, которые можно отправить без вмешательства пользователя"""
+        with self._lock:
+            return any('conflict' not in entry for entry in self._entries.values())
+
+    def _matches_locked(self, field, expected):
+        """Поле все еще в том виде, в каком его взяли из entries() (не переписано новой правкой)"""
+        entry = self._entries.get(field)
+        if entry is None:
+            return False
+        if expected is None or field not in expected:
+            return True
+        return entry['queued_at'] == expected[field]['queued_at'] and entry['value'] == expected[field]['value']
+
+    def remove(self, fields, expected=None):
+        """Убирает поля из очереди. expected — {(section, key): запись из entries()}: поле, которое
+        за это время снова поставили в очередь, не убирается, чтобы новая правка не потерялась
+        """
+        with self._lock:
+            for field in fields:
+                if self._matches_locked(field, expected):
+                    del self._entries[field]
+            self._save_locked()
+
+    def mark_conflicts(self, conflicts, expected=None):
+        """conflicts: {(section, key): текущее значение на устройстве}; expected — как в remove()"""
+        with self._lock:
+            for field, current in conflicts.items():
+                if self._matches_locked(field, expected):
+                    self._entries[field]['conflict'] = current
+            self._save_locked()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._save_locked()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
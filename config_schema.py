@@ -0,0 +1,274 @@
+"""
+Схема параметров config.yaml, которые редактируются в интерфейсе: тип, диапазон, значение
+по умолчанию и подпись каждого поля. По одной схеме строятся виджеты, значения для обновления
+полей из конфига, проверка введенных значений и список изменений для отправки.
+
+Новый тип тревоги добавляется одной строкой в VIOLATION_TYPES.
+"""
+
+import copy
+
+# Порядок определяет порядок блоков в интерфейсе
+VIOLATION_TYPES = {
+    'cigarette': 'Курение',
+    'closed_eyes': 'Закрытые глаза',
+    'head_pose': 'Поворот головы',
+    'no_belt': 'Отсутствие ремня',
+    'no_driver': 'Отсутствие водителя',
+    'no_face': 'Отсутствие лица',
+    'phone': 'Использование телефона',
+    'yawn': 'Зевота',
+}
+
+# Погрешность сравнения float: значения из текстовых полей и из YAML не совпадают побитово
+FLOAT_TOLERANCE = 0.001
+
+
+class Field:
+    """Один параметр: путь в конфиге, тип ('bool', 'int', 'float'), диапазон и подпись.
+
+    optional — пустое поле означает None (ключ "не задан"), иначе пустое поле — default.
+    clamp — значение вне [min, max] прижимается к границе, иначе это ошибка ввода.
+    """
+
+    def __init__(self, path, kind, label, default, min=None, max=None, optional=False, clamp=False):
+        self.path = tuple(path)
+        self.kind = kind
+        self.label = label
+        self.default = default
+        self.min = min
+        self.max = max
+        self.optional = optional
+        self.clamp = clamp
+
+    @property
+    def name(self):
+        return '.'.join(self.path)
+
+    def get(self, config):
+        """Значение из конфига; default, если ключа нет или там не скаляр"""
+        value = config
+        for key in self.path:
+            if not isinstance(value, dict) or key not in value:
+                return self.default
+            value = value[key]
+        if value is None and self.optional:
+            return None
+        return value if isinstance(value, (bool, int, float, str)) else self.default
+
+    def to_ui(self, value):
+        """Значение для виджета: bool для чекбокса, строка для текстового поля"""
+        if self.kind == 'bool':
+            return bool(value)
+        return '' if value is None else str(value)
+
+    def parse(self, ui_value):
+        """Значение из виджета в тип конфига; ValueError с понятным сообщением при ошибке ввода"""
+        if self.kind == 'bool':
+            return bool(ui_value)
+        text = '' if ui_value is None else str(ui_value).strip().replace(',', '.')
+        if not text:
+            return None if self.optional else self.default
+        try:
+            value = float(text)
+        except ValueError:
+            raise ValueError(f"{self.label}: ожидается число, введено «{ui_value}»") from None
+        if self.kind == 'int':
+            value = int(value)
+        if self.min is not None and value < self.min:
+            if not self.clamp:
+                raise ValueError(f"{self.label}: значение {value} меньше {self.min}")
+            value = type(value)(self.min)
+        if self.max is not None and value > self.max:
+            if not self.clamp:
+                raise ValueError(f"{self.label}: значение {value} больше {self.max}")
+            value = type(value)(self.max)
+        return value
+
+    def same(self, a, b):
+        if self.kind == 'float' and isinstance(a, (int, float)) and isinstance(b, (int, float)):
+            return abs(a - b) <= FLOAT_TOLERANCE
+        return a == b
+
+
+def violation_fields(violation_type):
+    """Поля блока тревоги; у head_pose вместо уверенности — центр и пороги поворота"""
+    fields = [
+        Field((violation_type, 'enable'), 'bool', "Включить", True),
+        Field((violation_type, 'duration'), 'float', "Длительность (сек)", 5.0, min=0),
+    ]
+    if violation_type != 'head_pose':
+        fields.append(Field((violation_type, 'threshold'), 'float', "Уверенность", 0.5, min=0, max=1))
+        return fields
+    return fields + [
+        Field(('head_pose', 'center_pitch'), 'float', "Центр по вертикали (0..1)", 0.5, min=0.0, max=1.0, clamp=True),
+        Field(('head_pose', 'center_yaw'), 'float', "Центр по горизонтали (0..1)", 0.5, min=0.0, max=1.0, clamp=True),
+        Field(('head_pose', 'pitch'), 'float', "Порог по вертикали (0..1)", 0.2, min=0.0, max=1.0, clamp=True),
+        Field(('head_pose', 'yaw'), 'float', "Порог по горизонтали (0..1)", 0.2, min=0.0, max=1.0, clamp=True),
+        Field(('head_pose', 'mask_absence_timeout'), 'float', "Таймаут отсутствия маски (сек)", 3.0, min=0.1, clamp=True),
+    ]
+
+
+# Секция fatigue (пути относительно нее): группы полей по строкам, как они показаны в интерфейсе
+FATIGUE_LAYOUT = [
+    (None, [[
+        Field(('enable',), 'bool', "Включить усталость", False),
+        Field(('window_seconds',), 'int', "Окно, секунд", 60, min=1),
+    ]]),
+    ("Композитная логика", [[
+        Field(('composite', 'enable'), 'bool', "Включить композитную сумму", False),
+        Field(('composite', 'target_sum'), 'int', "Целевая сумма событий", 3, min=1),
+    ]]),
+    ("Длинные моргания", [[
+        Field(('long_blinks', 'enable'), 'bool', "Включить длинные моргания", False),
+        Field(('long_blinks', 'ear_threshold'), 'float', "EAR порог (пусто = closed_eyes.threshold)", None, min=0, optional=True),
+    ], [
+        Field(('long_blinks', 'min_duration_s'), 'float', "Мин. длительность, c", 0.1, min=0),
+        Field(('long_blinks', 'max_duration_s'), 'float', "Макс. длительность, c", 0.4, min=0),
+        Field(('long_blinks', 'min_count'), 'int', "Мин. число событий", 3, min=1),
+    ]]),
+    ("Тренд межморганий", [[
+        Field(('interblink_trend', 'enable'), 'bool', "Включить тренд межморганий", False),
+        Field(('interblink_trend', 'ear_threshold'), 'float', "EAR порог (пусто = closed_eyes.threshold)", None, min=0, optional=True),
+    ], [
+        Field(('interblink_trend', 'min_intervals'), 'int', "Мин. интервалов (>=5)", 5, min=5, clamp=True),
+        Field(('interblink_trend', 'avg_span'), 'int', "Окно среднего (штук)", 5, min=1),
+        Field(('interblink_trend', 'decrease_ms'), 'int', "Падение среднего, мс", 50, min=0),
+        Field(('interblink_trend', 'min_trend_events'), 'int', "Мин. событий тренда", 3, min=1),
+    ]]),
+    ("Зевки", [[
+        Field(('yawn', 'enable'), 'bool', "Включить зевки", False),
+        Field(('yawn', 'mar_threshold'), 'float', "MAR порог (пусто = yawn.threshold)", None, min=0, optional=True),
+    ], [
+        Field(('yawn', 'min_duration_s'), 'float', "Мин. длительность, c", 0.4, min=0),
+        Field(('yawn', 'min_count'), 'int', "Мин. число событий", 2, min=1),
+    ]]),
+    ("«Клевки» головой", [[
+        Field(('head_nod', 'enable'), 'bool', "Включить клевки головой", False),
+        Field(('head_nod', 'pitch_down_delta_deg'), 'float', "Порог вниз, °", 10.0, min=0),
+    ], [
+        Field(('head_nod', 'min_down_duration_s'), 'float', "Мин. удержание вниз, c", 0.3, min=0),
+        Field(('head_nod', 'hysteresis_deg'), 'float', "Гистерезис, °", 3.0, min=0),
+        Field(('head_nod', 'min_count'), 'int', "Мин. число событий", 2, min=1),
+    ]]),
+]
+
+FATIGUE_FIELDS = [field for _, rows in FATIGUE_LAYOUT for row in rows for field in row]
+
+
+class ConfigForm:
+    """Упорядоченный набор полей формы.
+
+    Значения виджетов всегда передаются в порядке fields, поэтому списки inputs/outputs
+    обработчиков строятся из form.components(widgets), а не собираются вручную.
+    """
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def components(self, widgets):
+        """Виджеты в порядке полей формы; widgets — {path: компонент}"""
+        return [widgets[field.path] for field in self.fields]
+
+    def values(self, config):
+        """Значения для всех виджетов формы из конфига (обновление полей)"""
+        return [field.to_ui(field.get(config)) for field in self.fields]
+
+    def parse(self, ui_values):
+        """({path: значение}, [ошибки ввода]) по значениям виджетов"""
+        values, errors = {}, []
+        for field, ui_value in zip(self.fields, ui_values):
+            try:
+                values[field.path] = field.parse(ui_value)
+            except ValueError as e:
+                errors.append(str(e))
+        return values, errors
+
+    def diff(self, config, ui_values):
+        """Только поля, значения которых отличаются от config: ({path: значение}, [ошибки ввода])"""
+        values, errors = self.parse(ui_values)
+        by_path = {field.path: field for field in self.fields}
+        changes = {
+            path: value for path, value in values.items()
+            if not by_path[path].same(value, by_path[path].get(config))
+        }
+        return changes, errors
+
+    @staticmethod
+    def apply(config, changes):
+        """Копия config с примененными {path: значение}; недостающие вложенные секции создаются"""
+        result = copy.deepcopy(config) if isinstance(config, dict) else {}
+        for path, value in changes.items():
+            node = result
+            for key in path[:-1]:
+                if not isinstance(node.get(key), dict):
+                    node[key] = {}
+                node = node[key]
+            node[path[-1]] = value
+        return result
+
+
+def violations_form(types=None):
+    """Форма всех блоков тревог в порядке types (по умолчанию VIOLATION_TYPES)"""
+    return ConfigForm(field for violation_type in (types or VIOLATION_TYPES) for field in violation_fields(violation_type))
+
+
+# --- Построение виджетов (gradio импортируется только здесь) ---
+
+def build_widget(field, config):
+    import gradio as gr
+    value = field.to_ui(field.get(config))
+    if field.kind == 'bool':
+        return gr.Checkbox(label=field.label, value=value, interactive=True)
+    return gr.Textbox(label=field.label, value=value, interactive=True)
+
+
+def build_violation_block(violation_type, label, config, widgets, extra=None):
+    """Блок одной тревоги: заголовок и "Включить" в строке, остальные поля столбцом.
+
+    Виджеты складываются в widgets по пути поля; extra() вызывается внутри столбца
+    (кнопки калибровки head_pose).
+    """
+    import gradio as gr
+    fields = violation_fields(violation_type)
+    with gr.Group():
+        with gr.Row():
+            gr.Markdown(f"**{label}**")
+            widgets[fields[0].path] = build_widget(fields[0], config)
+        with gr.Column():
+            for field in fields[1:]:
+                widgets[field.path] = build_widget(field, config)
+            if extra is not None:
+                extra()
+
+
+def build_violation_grid(types, config, widgets, per_row=4):
+    """Блоки тревог сеткой по per_row в ряд; types — {тип: подпись}"""
+    import gradio as gr
+    items = list(types.items())
+    for i in range(0, len(items), per_row):
+        with gr.Row():
+            for violation_type, label in items[i:i + per_row]:
+                with gr.Column():
+                    build_violation_block(violation_type, label, config, widgets)
+
+
+def build_fatigue_form(fatigue_config, widgets):
+    """Поля секции fatigue по FATIGUE_LAYOUT"""
+    import gradio as gr
+    for title, rows in FATIGUE_LAYOUT:
+        if title is None:
+            for row in rows:
+                with gr.Row():
+                    for field in row:
+                        widgets[field.path] = build_widget(field, fatigue_config)
+            continue
+        with gr.Group():
+            gr.Markdown(f"#### {title}")
+            for row in rows:
+                with gr.Row():
+                    for field in row:
+                        widgets[field.path] = build_widget(field, fatigue_config)
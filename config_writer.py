@@ -0,0 +1,132 @@
+"""
+Отложенная запись параметров конфига: правки одного поля (section, key), сделанные подряд,
+склеиваются, и на устройство уходит только последнее значение — одним запросом для всех
+полей, которые успели "успокоиться"
+"""
+
+import threading
+import time
+
+
+class ConfigWriteBehind:
+    """Буфер отложенной записи с debounce по каждому (section, key).
+
+    Поле отправляется, когда его не меняли delay секунд, но не позже max_delay после первой
+    неотправленной правки (иначе при непрерывном вводе запись откладывалась бы бесконечно).
+    Все поля, готовые к отправке одновременно, уходят одним вызовом
+    flush({(section, key): value}) -> (ok, errors, batched); ok=None — правки не отправлены,
+    но приняты в очередь и уйдут позже.
+    """
+
+    def __init__(self, flush, delay=0.8, max_delay=3.0):
+        self._flush = flush
+        self.delay = delay
+        self.max_delay = max_delay
+        self._cond = threading.Condition()
+        # (section, key) -> [value, seq последней правки, время первой правки, время последней]
+        self._pending = {}
+        # (section, key) -> (seq последней отправленной правки, ok, сообщение)
+        self._flushed = {}
+        self._seq = 0
+        self._thread = None
+        self.edits = 0
+        self.merged = 0
+        self.flushes = 0
+
+    def set(self, section, key, value):
+        """Кладет новое значение в буфер; возвращает номер правки для wait()"""
+        field = (section, key)
+        now = time.monotonic()
+        with self._cond:
+            self._seq += 1
+            self.edits += 1
+            entry = self._pending.get(field)
+            if entry is None:
+                self._pending[field] = [value, self._seq, now, now]
+            else:
+                # Промежуточное значение так и не уйдет на устройство
+                entry[0], entry[1], entry[3] = value, self._seq, now
+                self.merged += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+            return self._seq
+
+    def wait(self, section, key, seq, timeout=15.0):
+        """Ждет отправки правки seq (или более новой правки того же поля).
+
+        Возвращает (ok, сообщение) или None по таймауту.
+        """
+        field = (section, key)
+        with self._cond:
+            done = self._cond.wait_for(
+                lambda: self._flushed.get(field, (0,))[0] >= seq, timeout,
+            )
+            if not done:
+                return None
+            _, ok, message = self._flushed[field]
+            return ok, message
+
+    def result(self, section, key, seq):
+        """Как wait(), но без ожидания: (ok, сообщение) или None, если правка еще не отправлена"""
+        with self._cond:
+            flushed = self._flushed.get((section, key))
+            if flushed is None or flushed[0] < seq:
+                return None
+            return flushed[1], flushed[2]
+
+    def pending(self):
+        with self._cond:
+            return [f"{section}.{key}" for section, key in self._pending]
+
+    def _due(self, now):
+        return [
+            field for field, (_, _, first, last) in self._pending.items()
+            if now - last >= self.delay or now - first >= self.max_delay
+        ]
+
+    def _next_deadline(self):
+        return min(
+            min(last + self.delay, first + self.max_delay)
+            for _, _, first, last in self._pending.values()
+        )
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    due = self._due(now)
+                    if due:
+                        break
+                    timeout = self._next_deadline() - now if self._pending else None
+                    self._cond.wait(timeout)
+                batch = {field: self._pending.pop(field) for field in due}
+            changes = {field: entry[0] for field, entry in batch.items()}
+            try:
+                ok, errors, _ = self._flush(changes)
+            except Exception as e:
+                ok, errors = False, [str(e)]
+            names = ", ".join(f"{section}.{key} = {value}" for (section, key), value in changes.items())
+            if ok is None:
+                message = f"📥 Нет связи с API, правка в очереди: {names}"
+            elif ok:
+                message = f"✅ Сохранено: {names}"
+            else:
+                message = f"❌ Не сохранено: {names}\n" + "\n".join(errors[:3])
+                print(f"[CONFIG] Write-behind flush failed: {errors[:3]}")
+            with self._cond:
+                for field, entry in batch.items():
+                    self._flushed[field] = (entry[1], ok, message)
+                self.flushes += 1
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'edits': self.edits,
+                'merged': self.merged,
+                'flushes': self.flushes,
+                'pending': len(self._pending),
+            }
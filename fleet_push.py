@@ -0,0 +1,140 @@
+"""
+Отправка конфига на парк рокчипов: PUT /config на все устройства параллельно через
+ограниченный пул потоков, с задержкой и статусом по каждому устройству
+"""
+
+import copy
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+DEFAULT_API_PORT = 8000
+
+# Больше параллельных запросов не нужно даже большому парку: устройства отвечают независимо
+MAX_WORKERS = 64
+
+# Поля, которые у каждого устройства свои (адрес, камера, куда слать тревоги): при рассылке
+# они берутся из собственного конфига устройства, а не из конфига основного
+DEVICE_FIELDS = (
+    ('rockchip',),
+    ('system', 'rtsp_stream_url'),
+    ('alarm_server_ip',),
+    ('alarm_server_port',),
+)
+
+
+def parse_inventory(text):
+    """Список устройств из текста: по строке на устройство, "имя хост[:порт]" или просто "хост".
+
+    Пустые строки и строки с # пропускаются.
+    """
+    devices = []
+    for line in (text or '').splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = line.split()
+        name, address = (parts[0], parts[1]) if len(parts) > 1 else (parts[0], parts[0])
+        host, _, port = address.partition(':')
+        devices.append({
+            'name': name,
+            'host': host,
+            'api_port': int(port) if port else DEFAULT_API_PORT,
+        })
+    return devices
+
+
+def format_inventory(devices):
+    """Обратное к parse_inventory() — для поля ввода в интерфейсе"""
+    return '\n'.join(
+        f"{d['name']} {d['host']}:{d.get('api_port', DEFAULT_API_PORT)}" for d in devices or []
+    )
+
+
+def parse_fields(paths):
+    """Пути полей из web_config.yaml ("system.rtsp_stream_url") в кортежи"""
+    return tuple(tuple(str(path).split('.')) for path in paths)
+
+
+def merge_device_fields(config, device_config, fields=DEVICE_FIELDS):
+    """Копия config, в которой поля fields взяты из device_config.
+
+    Если у устройства такого поля нет, оно убирается и из копии: значения основного
+    устройства (его IP, его камера) на другое устройство не уходят.
+    """
+    merged = copy.deepcopy(config)
+    for path in fields:
+        source = device_config
+        for key in path:
+            source = source.get(key) if isinstance(source, dict) else None
+            if source is None:
+                break
+        target = merged
+        for key in path[:-1]:
+            if not isinstance(target.get(key), dict):
+                target[key] = {}
+            target = target[key]
+        if source is None:
+            target.pop(path[-1], None)
+        else:
+            target[path[-1]] = copy.deepcopy(source)
+    return merged
+
+
+def _push_one(client, device, config, fields):
+    address = f"{device['host']}:{device.get('api_port', DEFAULT_API_PORT)}"
+    started = time.perf_counter()
+    result = {'name': device['name'], 'address': address, 'ok': False, 'retryable': False}
+    try:
+        # Собственные поля устройства сохраняются: без его конфига отправлять нельзя
+        response = client.get(f"http://{address}/config")
+        if response.status_code == 200:
+            response = client.put(f"http://{address}/config", json=merge_device_fields(config, response.json(), fields))
+        result['status'] = str(response.status_code)
+        result['ok'] = response.status_code == 200
+        result['retryable'] = response.status_code >= 500
+        result['message'] = '' if result['ok'] else f"{response.request.method}: {response.text[:200]}"
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        result['status'] = type(e).__name__
+        result['retryable'] = True
+        result['message'] = str(e)[:200]
+    except Exception as e:
+        result['status'] = 'error'
+        result['message'] = str(e)[:200]
+    result['latency_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+def push_config(client, devices, config, workers=None, rounds=2, fields=DEVICE_FIELDS):
+    """PUT config на все devices; не больше workers запросов одновременно
+    (по умолчанию — все устройства сразу, но не больше MAX_WORKERS).
+
+    Поля fields каждое устройство сохраняет свои (см. merge_device_fields).
+    Устройства, не ответившие из-за сети или ответившие 5xx, повторяются следующим кругом
+    (всего rounds кругов) — это поверх повторов, которые делает сам client.
+    Возвращает результаты в порядке devices: name, address, ok, status, latency_ms, attempts, message.
+    """
+    if workers is None:
+        workers = min(len(devices), MAX_WORKERS)
+    results = [None] * len(devices)
+    pending = list(range(len(devices)))
+    for attempt in range(1, rounds + 1):
+        if not pending:
+            break
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pending)))) as pool:
+            done = list(pool.map(lambda i: _push_one(client, devices[i], config, fields), pending))
+        for i, result in zip(pending, done):
+            result['attempts'] = attempt
+            results[i] = result
+        pending = [i for i in pending if results[i]['retryable']]
+        if pending and attempt < rounds:
+            print(f"[FLEET] Round {attempt}: {len(pending)} device(s) failed, retrying")
+    return results
+
+
+def summarize(results, elapsed):
+    ok = sum(1 for r in results if r['ok'])
+    slowest = max((r['latency_ms'] for r in results), default=0.0)
+    return (f"Отправлено на {ok} из {len(results)} устройств за {elapsed:.1f} с "
+            f"(самое медленное устройство: {slowest / 1000:.1f} с)")
@@ -0,0 +1,54 @@
+"""
+Пробуждение asyncio-подписчиков из обычных потоков: одна future на event loop, а не на
+подписчика, поэтому публикация стоит один call_soon_threadsafe на loop при любом числе клиентов.
+Используется шиной кадров (mjpeg_server.FrameBus) и лентой тревог (alarm_feed.AlarmFeed).
+"""
+
+import asyncio
+
+
+def _resolve_future(fut):
+    if not fut.done():
+        fut.set_result(None)
+
+
+class LoopWaiters:
+    """Futures ожидающих event loop'ов.
+
+    future() и detach() вызываются под блокировкой владельца (той же, под которой проверяется
+    условие ожидания), wake() — уже после ее освобождения.
+    """
+
+    def __init__(self):
+        self._futures = {}
+
+    def future(self, loop):
+        """Общая future этого loop, которая будет разрешена следующей публикацией"""
+        fut = self._futures.get(loop)
+        if fut is None:
+            fut = loop.create_future()
+            self._futures[loop] = fut
+        return fut
+
+    def detach(self):
+        """Забирает всех ожидающих; новые подписчики будут ждать уже следующей публикации"""
+        futures, self._futures = self._futures, {}
+        return futures
+
+    @staticmethod
+    def wake(futures):
+        for loop, fut in futures.items():
+            try:
+                loop.call_soon_threadsafe(_resolve_future, fut)
+            except RuntimeError:
+                pass  # event loop уже закрыт
+
+    @staticmethod
+    async def wait(fut, timeout):
+        """True, если future разрешена до таймаута"""
+        try:
+            # shield: таймаут одного подписчика не должен отменять общую future
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
@@ -0,0 +1,170 @@
+"""
+Минимальные метрики в текстовом формате Prometheus (без внешних зависимостей)
+"""
+
+import threading
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        escaped = str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        parts.append(f'{key}="{escaped}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class _Family:
+    """Семейство метрик с одинаковым именем и набором меток"""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, '')) for name in self.label_names)
+
+    def remove(self, **labels):
+        """Удаляет серию с этими метками (например, когда ее источник остановлен)"""
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+
+class Counter(_Family):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Gauge(_Family):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram(_Family):
+    type = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += 1
+            state[2] += value
+
+    def samples(self):
+        result = []
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        for key, counts, count, total in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                result.append((self.name + '_bucket', key + (('le', repr(float(bound))),), cumulative))
+            result.append((self.name + '_bucket', key + (('le', '+Inf'),), count))
+            result.append((self.name + '_count', key, count))
+            result.append((self.name + '_sum', key, total))
+        return result
+
+
+class MetricsRegistry:
+    """Набор метрик процесса; collectors добавляют значения, вычисляемые в момент запроса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = []
+        self._collectors = []
+
+    def _add(self, family):
+        with self._lock:
+            self._families.append(family)
+        return family
+
+    def counter(self, name, help_text, label_names=()):
+        return self._add(Counter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=()):
+        return self._add(Gauge(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, label_names, buckets))
+
+    def register_collector(self, collector):
+        """collector() возвращает [(name, type, help, [(labels_dict, value), ...]), ...]"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        """Текст для /metrics в формате Prometheus exposition 0.0.4"""
+        lines = []
+        with self._lock:
+            families = list(self._families)
+            collectors = list(self._collectors)
+        for family in families:
+            lines.append(f'# HELP {family.name} {family.help}')
+            lines.append(f'# TYPE {family.name} {family.type}')
+            for name, key, value in family.samples():
+                lines.append(f'{name}{_format_labels(key)} {_format_value(value)}')
+        for collector in collectors:
+            try:
+                collected = collector()
+            except Exception as e:
+                print(f"[METRICS] Collector failed: {e}")
+                continue
+            for name, metric_type, help_text, samples in collected:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
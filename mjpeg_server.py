@@ -1,52 +1,217 @@
-from flask import Flask, Response, abort
+from flask import Flask, Response, abort, jsonify, request
 import cv2
+import numpy as np
 import threading
+import asyncio
 import os
+import time
+import itertools
+from collections import namedtuple
+
+from capture_supervisor import CaptureSupervisor, open_capture
+from loop_waiters import LoopWaiters
+import metrics
 
 app = Flask(__name__)
 
-# Загружаем RTSP URL из локальной конфигурации
-def get_rtsp_url():
+DEFAULT_STREAM_ID = 'default'
+DEFAULT_RTSP_URL = "rtsp://192.168.0.172:8554/stream"
+# Сколько секунд reader камеры продолжает работать после ухода последнего зрителя
+DEFAULT_IDLE_TIMEOUT = 30.0
+
+
+# Загружаем потоки из локальной конфигурации
+def load_stream_config():
+    """Читает web_config.yaml: возвращает ({stream_id: rtsp_url}, idle_timeout).
+
+    Поток 'default' берется из rtsp_stream_url и отдается по /video,
+    остальные перечисляются в секции streams и доступны по /video/<stream_id>.
+    """
     import yaml
-    
+
+    web_config = {}
     # Читаем только локальную конфигурацию веб-приложения
     try:
         web_config_path = os.path.join(os.path.dirname(__file__), 'web_config.yaml')
         if os.path.exists(web_config_path):
             with open(web_config_path, 'r', encoding='utf-8') as f:
-                web_config = yaml.safe_load(f)
-                local_rtsp_url = web_config.get('rtsp_stream_url', 'rtsp://192.168.0.172:8554/stream')
-                print(f"[MJPEG] Using local RTSP URL: {local_rtsp_url}")
-                return local_rtsp_url
+                web_config = yaml.safe_load(f) or {}
     except Exception as e:
         print(f"[MJPEG] Failed to load local config: {e}")
-    
-    # Fallback к значению по умолчанию
-    default_url = "rtsp://192.168.0.172:8554/stream"
-    print(f"[MJPEG] Using default RTSP URL: {default_url}")
-    return default_url
 
-RTSP_URL = get_rtsp_url()
+    streams = {DEFAULT_STREAM_ID: web_config.get('rtsp_stream_url', DEFAULT_RTSP_URL)}
+    for stream_id, entry in (web_config.get('streams') or {}).items():
+        # Допускаем как "cab12: rtsp://...", так и "cab12: {url: rtsp://...}"
+        url = entry.get('url') if isinstance(entry, dict) else entry
+        if url:
+            streams[str(stream_id)] = url
+    idle_timeout = float(web_config.get('stream_idle_timeout', DEFAULT_IDLE_TIMEOUT))
+    for stream_id, url in streams.items():
+        print(f"[MJPEG] Stream '{stream_id}': {url}")
+    return streams, idle_timeout
 
-# Глобальные переменные для обмена кадрами между потоками
-latest_frame = None
-frame_lock = threading.Lock()
-stream_alive = threading.Event()
 
+class FrameBus:
+    """Шина кадров: хранит последний элемент с номером и будит ожидающих при публикации.
 
-def _augment_rtsp_url_for_tcp(base_url: str) -> str:
-    sep = '&' if ('?' in base_url) else '?'
-    # stimeout в мкс (5 секунд)
-    return f"{base_url}{sep}rtsp_transport=tcp&stimeout=5000000"
+    Подписчик помнит номер последнего полученного кадра и ждет только более новый,
+    поэтому один и тот же кадр не отдается дважды, а пропуски видны по разнице номеров.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._item = None
+        self._waiters = LoopWaiters()
+
+    def publish(self, item, seq=None):
+        """Публикует элемент; seq позволяет сохранить нумерацию источника"""
+        with self._cond:
+            self._seq = self._seq + 1 if seq is None else max(seq, self._seq + 1)
+            self._item = item
+            self._cond.notify_all()
+            waiters = self._waiters.detach()
+            published = self._seq
+        LoopWaiters.wake(waiters)
+        return published
+
+    def latest(self):
+        with self._cond:
+            return self._seq, self._item
+
+    def wait_next(self, last_seq, timeout=None):
+        """Ждет элемент новее last_seq. Возвращает (seq, item) или None по таймауту"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > last_seq, timeout):
+                return None
+            return self._seq, self._item
+
+    async def wait_next_async(self, last_seq, timeout=None):
+        """Асинхронный вариант wait_next() для asyncio-режима сервера"""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if self._seq > last_seq:
+                return self._seq, self._item
+            fut = self._waiters.future(loop)
+        if not await LoopWaiters.wait(fut, timeout):
+            return None
+        with self._cond:
+            if self._seq > last_seq:
+                return self._seq, self._item
+            return None
+
+
+class FrameRing:
+    """Кольцо буферов декодированных кадров одного потока без копирования.
+
+    Reader декодирует в свободный слот (cap.read(image=...)), публикует его индекс,
+    а энкодеры берут ссылку на последний слот и отпускают ее после кодирования.
+    Слот, который кто-то читает, не перезаписывается, а слот, в который идет запись,
+    помечен счетчиком WRITING и никому больше не выдается; блокировка держится только
+    на время обмена индексами и счетчиками ссылок. Если все слоты заняты, кольцо
+    растет на один буфер — в установившемся режиме новые кадры не выделяются.
+    """
+
+    WRITING = -1
+
+    def __init__(self, size=4):
+        self._cond = threading.Condition()
+        self._buffers = [None] * size
+        # owned: буфер принадлежит кольцу, в него можно декодировать следующий кадр
+        self._owned = [False] * size
+        self._refs = [0] * size
+        self._latest = None
+        self._seq = 0
+
+    def acquire_write(self):
+        """Для reader: (слот, буфер для декодирования или None, если буфера еще нет).
 
+        Слот занят до commit() или abort()
+        """
+        with self._cond:
+            for slot, refs in enumerate(self._refs):
+                if refs == 0 and slot != self._latest:
+                    self._refs[slot] = self.WRITING
+                    return slot, (self._buffers[slot] if self._owned[slot] else None)
+            self._buffers.append(None)
+            self._owned.append(False)
+            self._refs.append(self.WRITING)
+            return len(self._refs) - 1, None
 
-def rtsp_reader():
-    import time
-    import numpy as np
-    import cv2
+    def commit(self, slot, frame, owned=True):
+        """Публикует кадр, записанный в слот. owned=False — чужой массив, декодировать в него нельзя"""
+        with self._cond:
+            self._buffers[slot] = frame
+            self._owned[slot] = owned
+            self._refs[slot] = 0
+            self._latest = slot
+            self._seq += 1
+            self._cond.notify_all()
+
+    def abort(self, slot):
+        """Возвращает слот из acquire_write() без публикации (кадр не декодирован)"""
+        with self._cond:
+            self._refs[slot] = 0
+
+    def publish_external(self, frame):
+        """Публикует готовый массив (заглушка, первый кадр нового источника) без копирования"""
+        slot, _ = self.acquire_write()
+        self.commit(slot, frame, owned=False)
+
+    def reset(self):
+        """Отпускает буферы простаивающего потока; ожидающие получат кадр None"""
+        with self._cond:
+            for slot, refs in enumerate(self._refs):
+                if refs == 0:
+                    self._buffers[slot] = None
+                    self._owned[slot] = False
+            self._latest = None
+            self._seq += 1
+            self._cond.notify_all()
+
+    def latest_seq(self):
+        with self._cond:
+            return self._seq
+
+    def wait_next(self, last_seq, timeout=None):
+        """Ждет кадр новее last_seq: (seq, слот, кадр) или None по таймауту.
+
+        Слот удерживается до release(slot); для кадра None отпускать нечего.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > last_seq, timeout):
+                return None
+            slot = self._latest
+            if slot is None:
+                return self._seq, None, None
+            self._refs[slot] += 1
+            return self._seq, slot, self._buffers[slot]
+
+    def release(self, slot):
+        if slot is None:
+            return
+        with self._cond:
+            self._refs[slot] -= 1
+
+
+# Статистика клиентов /video: id -> {'sent': ..., 'skipped': ..., 'bytes': ...}
+client_stats = {}
+client_stats_lock = threading.Lock()
+# Итоги по уже отключившимся клиентам: stream_id -> {'sent', 'skipped', 'bytes', 'clients'}
+finished_client_totals = {}
+_client_ids = itertools.count(1)
+
+METRICS = metrics.MetricsRegistry()
+ENCODE_SECONDS = METRICS.histogram(
+    'mjpeg_encode_seconds', 'Time to resize and JPEG-encode one frame', ['stream', 'profile'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.02, 0.04, 0.08, 0.16, 0.32),
+)
+
+
+def _make_blank_frame():
+    """Заглушка "No signal" 640x480"""
     from cv2 import FONT_HERSHEY_SIMPLEX
 
-    # Заглушка
     blank = np.zeros((480, 640, 3), dtype=np.uint8)
     text = "No signal"
     font = FONT_HERSHEY_SIMPLEX
@@ -57,91 +222,728 @@ def rtsp_reader():
     text_x = (blank.shape[1] - text_size[0]) // 2
     text_y = (blank.shape[0] + text_size[1]) // 2
     cv2.putText(blank, text, (text_x, text_y), font, font_scale, color, thickness, cv2.LINE_AA)
-    global latest_frame
-    global stream_alive
-
-    tcp_url = _augment_rtsp_url_for_tcp(RTSP_URL)
-
-    while True:
-        # Пытаемся открыть через FFmpeg бэкенд и TCP транспорт
-        print(f"[RTSP] Opening stream via FFmpeg (TCP): {tcp_url}")
-        cap = cv2.VideoCapture(tcp_url, cv2.CAP_FFMPEG)
-        # Уменьшаем буферизацию, чтобы снизить задержку
-        try:
-            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-        except Exception:
-            pass
-        if not cap.isOpened():
-            print(f"[ERROR] Could not open RTSP stream: {tcp_url}")
-            with frame_lock:
-                latest_frame = blank.copy()
-            stream_alive.clear()
-            time.sleep(2)
-            continue
-        stream_alive.set()
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                print(f"[ERROR] Failed to read frame from RTSP, switching to 'No signal'...")
-                with frame_lock:
-                    latest_frame = blank.copy()
-                stream_alive.clear()
-                cap.release()
-                time.sleep(2)
-                break
-            with frame_lock:
-                latest_frame = frame.copy()
-            stream_alive.set()
-            time.sleep(0.01)  # ~100 FPS max, чтобы не грузить CPU
-        cap.release()
+    return blank
 
-# Запускаем поток RTSP reader
-threading.Thread(target=rtsp_reader, daemon=True).start()
 
-def generate():
-    import time
-    import numpy as np
-    import cv2
-    from cv2 import FONT_HERSHEY_SIMPLEX
+def _mjpeg_part(jpeg_bytes: bytes, seq: int) -> bytes:
+    """Собирает одну часть multipart-потока с номером кадра в заголовке"""
+    return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n'
+            b'X-Frame-Seq: ' + str(seq).encode() + b'\r\n\r\n' + jpeg_bytes + b'\r\n')
+
+
+# Заглушка кодируется один раз на весь процесс
+BLANK_PART = _mjpeg_part(cv2.imencode('.jpg', _make_blank_frame())[1].tobytes(), 0)
 
+
+def _augment_rtsp_url_for_tcp(base_url: str) -> str:
+    sep = '&' if ('?' in base_url) else '?'
+    # stimeout в мкс (5 секунд)
+    return f"{base_url}{sep}rtsp_transport=tcp&stimeout=5000000"
+
+
+def rtsp_reader(stream, stop):
+    """Читает RTSP поток stream.url в кольцо stream.frames, пока не выставлен stop"""
     # Заглушка
-    blank = np.zeros((480, 640, 3), dtype=np.uint8)
-    text = "No signal"
-    font = FONT_HERSHEY_SIMPLEX
-    font_scale = 2
-    color = (255, 255, 255)
-    thickness = 3
-    text_size = cv2.getTextSize(text, font, font_scale, thickness)[0]
-    text_x = (blank.shape[1] - text_size[0]) // 2
-    text_y = (blank.shape[0] + text_size[1]) // 2
-    cv2.putText(blank, text, (text_x, text_y), font, font_scale, color, thickness, cv2.LINE_AA)
-    _, jpeg_blank = cv2.imencode('.jpg', blank)
-    frame_bytes_blank = jpeg_blank.tobytes()
-
-    while True:
-        with frame_lock:
-            frame = latest_frame.copy() if latest_frame is not None else None
-        if frame is not None and stream_alive.is_set():
-            _, jpeg = cv2.imencode('.jpg', frame)
-            frame_bytes = jpeg.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+    blank = _make_blank_frame()
+    frames = stream.frames
+    capture = stream.capture
+
+    while not stop.is_set():
+        # Если в фоне уже подготовлен новый источник — сразу переключаемся на него
+        pending = stream.take_pending_source()
+        if pending is not None:
+            cap, frame = pending
+            frames.publish_external(frame)
+            capture.frame_ok(cap)
         else:
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes_blank + b'\r\n')
-        time.sleep(1/25)  # 25 FPS отдачи
+            cap = capture.open(_augment_rtsp_url_for_tcp(stream.url))
+            if not cap.isOpened():
+                print(f"[ERROR] [{stream.stream_id}] Could not open RTSP stream: {stream.url}")
+                stream.alive.clear()
+                frames.publish_external(blank)
+                cap.release()
+                capture.wait_retry(stop)
+                continue
+        stream.alive.set()
+        while not stop.is_set():
+            pending = stream.take_pending_source()
+            if pending is not None:
+                # Горячая замена: клиенты остаются подключенными, меняется только capture
+                cap.release()
+                cap, frame = pending
+                frames.publish_external(frame)
+                capture.frame_ok(cap)
+            else:
+                # Декодируем прямо в свободный буфер кольца; при смене разрешения
+                # OpenCV сам выделит новый массив, и он станет буфером слота
+                slot, buf = frames.acquire_write()
+                ret, frame = cap.read(buf) if buf is not None else cap.read()
+                if not ret:
+                    frames.abort(slot)
+                    print(f"[ERROR] [{stream.stream_id}] Failed to read frame from RTSP, switching to 'No signal'...")
+                    capture.frame_failed()
+                    stream.alive.clear()
+                    frames.publish_external(blank)
+                    break
+                if not capture.frame_ok(cap):
+                    frames.abort(slot)
+                    print(f"[ERROR] [{stream.stream_id}] Frame timestamps stopped advancing, reconnecting...")
+                    stream.alive.clear()
+                    break
+                frames.commit(slot, frame)
+            stream.alive.set()
+        cap.release()
+        # Первая повторная попытка — сразу, дальше с экспоненциальной задержкой
+        capture.wait_retry(stop)
+
+
+def synthetic_reader(stream, stop, fps=25, width=1280, height=720):
+    """Синтетический источник кадров для нагрузочного теста (без камеры)"""
+
+    base = np.zeros((height, width, 3), dtype=np.uint8)
+    base[:, :, 0] = np.linspace(0, 255, width, dtype=np.uint8)
+    base[:, :, 1] = np.linspace(0, 255, height, dtype=np.uint8)[:, None]
+    interval = 1.0 / fps
+    next_at = time.monotonic()
+    n = 0
+    stream.alive.set()
+    while not stop.is_set():
+        slot, frame = stream.frames.acquire_write()
+        if frame is None or frame.shape != base.shape:
+            frame = np.empty_like(base)
+        np.copyto(frame, base)
+        cv2.putText(frame, f"{stream.stream_id} {n}", (40, 80), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3, cv2.LINE_AA)
+        stream.frames.commit(slot, frame)
+        stream.capture.frame_ok()
+        n += 1
+        next_at += interval
+        stop.wait(max(0.0, next_at - time.monotonic()))
+
+
+# Профиль выдачи: ширина кадра, качество JPEG и частота кадров (None — как у источника)
+Profile = namedtuple('Profile', ['width', 'quality', 'fps'])
+
+FULL_PROFILE = Profile(None, None, None)
+
+# Допустимые значения параметров профиля: запрос округляется до ближайшего, чтобы число
+# профилей (энкодеров и серий метрик) не зависело от того, что клиенты пишут в URL
+PROFILE_STEPS = {
+    'w': (160, 320, 480, 640, 800, 1280, 1920),
+    'q': (50, 70, 80, 90),
+    'fps': (1, 5, 10, 15, 25),
+}
+
+# Сверх этого числа энкодеров на поток новый профиль обслуживается ближайшим из запущенных
+MAX_PROFILES_PER_STREAM = 8
+
+
+def profile_label(profile):
+    """Метка профиля для метрик: 'full' или 'w=640,q=70,fps=10'"""
+    parts = [f"{name}={value:g}" for name, value in zip(('w', 'q', 'fps'), profile) if value is not None]
+    return ','.join(parts) or 'full'
+
+
+def parse_profile(args):
+    """Разбирает ?w=640&q=70&fps=10. Без параметров — FULL_PROFILE (исходный поток)"""
+    values = {}
+    for name, steps in PROFILE_STEPS.items():
+        raw = args.get(name)
+        if raw in (None, ''):
+            values[name] = None
+            continue
+        value = float(raw)  # ValueError -> 400
+        values[name] = min(steps, key=lambda step: abs(step - value))
+    return Profile(values['w'], values['q'], values['fps'])
+
+
+def _profile_distance(a, b):
+    """Насколько профиль b далек от запрошенного a (None — как у источника)"""
+    return sum(
+        0 if x == y else 10 ** 6 if x is None or y is None else abs(x - y) / x
+        for x, y in zip(a, b)
+    )
+
+
+class ProfileEncoder:
+    """Общий resize+encode пайплайн одного профиля для всех его подписчиков"""
+
+    def __init__(self, profile, frames, stream_id=DEFAULT_STREAM_ID):
+        self.profile = profile
+        self.frames = frames
+        self.stream_id = stream_id
+        self.bus = FrameBus()
+        self.subscribers = 0
+        # Кадры источника, которые энкодер не успел взять (не считая прореживания по fps)
+        self.skipped = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        # Вызывается из потока энкодера после последнего кадра
+        self.on_exit = None
+
+    def start(self):
+        self._thread.start()
 
-@app.route('/video')
-def video_feed():
-    return Response(generate(),
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        width, quality, fps = self.profile
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality] if quality else []
+        interval = 1.0 / fps if fps else 0.0
+        next_due = 0.0
+        last_seq = 0
+        resized = None  # буфер уменьшенного кадра, переиспользуется между кадрами
+        while not self._stop.is_set():
+            # Просыпаемся ровно тогда, когда reader опубликовал новый кадр
+            nxt = self.frames.wait_next(last_seq, timeout=1.0)
+            if nxt is None:
+                continue
+            seq, slot, frame = nxt
+            if last_seq:
+                self.skipped += seq - last_seq - 1
+            last_seq = seq
+            if frame is None:
+                continue
+            labels = {'stream': self.stream_id, 'profile': profile_label(self.profile)}
+            started = time.perf_counter()
+            try:
+                if interval:
+                    # Прореживаем кадры источника до нужной частоты, не накапливая отставание
+                    now = time.monotonic()
+                    if now < next_due:
+                        continue
+                    next_due = max(next_due + interval, now)
+                if width and frame.shape[1] > width:
+                    height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+                    if resized is None or resized.shape[:2] != (height, width):
+                        resized = np.empty((height, width) + frame.shape[2:], dtype=frame.dtype)
+                    cv2.resize(frame, (width, height), dst=resized, interpolation=cv2.INTER_AREA)
+                    # Уменьшенная копия готова — слот кольца больше не нужен
+                    self.frames.release(slot)
+                    slot, frame = None, resized
+                ok, jpeg = cv2.imencode('.jpg', frame, params)
+            finally:
+                self.frames.release(slot)
+            ENCODE_SECONDS.observe(time.perf_counter() - started, **labels)
+            if ok:
+                # В заголовке — номер кадра источника. Без прореживания шина сохраняет его,
+                # чтобы клиенты видели пропуски; с прореживанием нумерация своя, без дыр
+                self.bus.publish(_mjpeg_part(jpeg.tobytes(), seq), seq=None if interval else seq)
+        if self.on_exit is not None:
+            self.on_exit(self)
+
+
+class TranscodeCache:
+    """Кэш пайплайнов по профилю; пайплайн удаляется, когда уходит последний подписчик"""
+
+    def __init__(self, frames, stream_id=DEFAULT_STREAM_ID):
+        self._frames = frames
+        self._stream_id = stream_id
+        self._lock = threading.Lock()
+        self._encoders = {}
+
+    def acquire(self, profile):
+        with self._lock:
+            encoder = self._encoders.get(profile)
+            if encoder is None and len(self._encoders) >= MAX_PROFILES_PER_STREAM:
+                encoder = min(self._encoders.values(), key=lambda e: _profile_distance(profile, e.profile))
+                print(f"[MJPEG] Profile limit reached, serving {profile} with {encoder.profile}")
+            if encoder is None:
+                encoder = ProfileEncoder(profile, self._frames, self._stream_id)
+                encoder.on_exit = self._encoder_exited
+                self._encoders[profile] = encoder
+                encoder.start()
+                print(f"[MJPEG] Started encoder for {profile}")
+            encoder.subscribers += 1
+            return encoder
+
+    def release(self, encoder):
+        with self._lock:
+            encoder.subscribers -= 1
+            if encoder.subscribers <= 0 and self._encoders.get(encoder.profile) is encoder:
+                del self._encoders[encoder.profile]
+                encoder.stop()
+                print(f"[MJPEG] Stopped encoder for {encoder.profile}")
+
+    def _encoder_exited(self, encoder):
+        # Профиль больше не обслуживается — его серия не должна оставаться в /metrics.
+        # Если за это время профиль запросили снова, серия принадлежит новому энкодеру
+        with self._lock:
+            if encoder.profile not in self._encoders:
+                ENCODE_SECONDS.remove(stream=self._stream_id, profile=profile_label(encoder.profile))
+
+    def snapshot(self):
+        with self._lock:
+            return [dict(e.profile._asdict(), subscribers=e.subscribers, skipped=e.skipped)
+                    for e in self._encoders.values()]
+
+
+class VideoStream:
+    """Одна камера: reader, шина декодированных кадров и кэш энкодеров по профилям.
+
+    Reader запускается с первым зрителем и останавливается реестром после
+    idle_timeout без зрителей.
+    """
+
+    def __init__(self, stream_id, url, synthetic=False):
+        self.stream_id = stream_id
+        self.url = url
+        self.synthetic = synthetic
+        self.frames = FrameRing()
+        self.capture = CaptureSupervisor(stream_id)
+        self.alive = threading.Event()
+        self.encoders = TranscodeCache(self.frames, stream_id)
+        self.subscribers = 0
+        self.idle_since = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = None
+        # Поток reader'а: после остановки он может еще висеть в cap.read()
+        self._reader = None
+        # Горячая замена источника: (capture, первый кадр, url, время запроса)
+        self._pending_source = None
+        self._swap_generation = 0
+        self.switchovers = 0
+        self.switchover_failures = 0
+        self.last_switchover_s = None
+
+    @property
+    def running(self):
+        return self._stop is not None
+
+    def subscribe(self, profile):
+        """Подписывает клиента; возвращает (шина multipart-частей, функция отписки)"""
+        with self._lock:
+            self.subscribers += 1
+            if self._stop is None:
+                self._start()
+        encoder = self.encoders.acquire(profile)
+
+        def unsubscribe():
+            self.encoders.release(encoder)
+            with self._lock:
+                self.subscribers -= 1
+                if self.subscribers == 0:
+                    self.idle_since = time.monotonic()
+
+        return encoder.bus, unsubscribe
+
+    def swap_source(self, url):
+        """Меняет RTSP URL без отключения зрителей.
+
+        Новый capture открывается в фоне; reader переключается на него
+        только после того, как с нового источника декодирован первый кадр.
+        """
+        with self._lock:
+            self._swap_generation += 1  # отменяет незавершенную подготовку прежнего URL
+            generation = self._swap_generation
+            if url == self.url:
+                stale, self._pending_source = self._pending_source, None
+                if stale is not None:
+                    stale[0].release()
+                return
+            if self._stop is None or self.synthetic:
+                # Reader не запущен — новый URL просто будет использован при старте
+                self.url = url
+                return
+            stop = self._stop
+        print(f"[MJPEG] Stream '{self.stream_id}': preparing new source {url}")
+        threading.Thread(target=self._prepare_source, args=(url, generation, stop, time.monotonic()),
+                         daemon=True).start()
+
+    def _prepare_source(self, url, generation, stop, requested_at):
+        while not stop.is_set() and generation == self._swap_generation:
+            cap = open_capture(_augment_rtsp_url_for_tcp(url))
+            ok, frame = cap.read() if cap.isOpened() else (False, None)
+            if ok:
+                with self._lock:
+                    if generation == self._swap_generation and not stop.is_set():
+                        stale, self._pending_source = self._pending_source, (cap, frame, url, requested_at)
+                        cap = stale[0] if stale else None
+                if cap is not None:
+                    cap.release()
+                return
+            cap.release()
+            with self._lock:
+                self.switchover_failures += 1
+            print(f"[ERROR] [{self.stream_id}] New source {url} is not ready yet, keeping the current one")
+            stop.wait(2)
+
+    def take_pending_source(self):
+        """Для reader: забирает подготовленный источник (capture, первый кадр) или None"""
+        with self._lock:
+            pending, self._pending_source = self._pending_source, None
+            if pending is None:
+                return None
+            cap, frame, url, requested_at = pending
+            self.url = url
+            self.switchovers += 1
+            self.last_switchover_s = time.monotonic() - requested_at
+        print(f"[MJPEG] Stream '{self.stream_id}' switched to {url} in {self.last_switchover_s:.2f}s")
+        return cap, frame
+
+    def stop_if_idle(self, idle_timeout):
+        with self._lock:
+            if self._stop is None or self.subscribers > 0:
+                return
+            if time.monotonic() - self.idle_since < idle_timeout:
+                return
+            self._stop.set()
+            self._stop = None
+            pending, self._pending_source = self._pending_source, None
+        if pending is not None:
+            self.url = pending[2]
+            pending[0].release()
+        self.alive.clear()
+        print(f"[MJPEG] Stream '{self.stream_id}' stopped after {idle_timeout:.0f}s without viewers")
+
+    def _start(self):
+        previous = self._reader
+        self._stop = threading.Event()
+        reader = synthetic_reader if self.synthetic else rtsp_reader
+        self._reader = threading.Thread(target=self._run_reader, args=(reader, self._stop, previous), daemon=True)
+        self._reader.start()
+        print(f"[MJPEG] Stream '{self.stream_id}' started")
+
+    def _run_reader(self, reader, stop, previous):
+        # Остановленный reader мог еще не выйти из cap.read(): два писателя в одном кольце
+        # недопустимы, поэтому новый начинает только после его выхода
+        if previous is not None:
+            previous.join()
+        reader(self, stop)
+        with self._lock:
+            idle = self._stop is None
+        if idle:
+            # Отпускаем буферы кадров, чтобы простаивающая камера не держала память.
+            # Новый reader, если уже запущен, ждет выхода этого — сброс с ним не пересекается
+            self.frames.reset()
+
+    def snapshot(self):
+        return {
+            'url': self.url,
+            'running': self.running,
+            'alive': self.alive.is_set(),
+            'subscribers': self.subscribers,
+            'frame_seq': self.frames.latest_seq(),
+            'profiles': self.encoders.snapshot(),
+            'capture': self.capture.snapshot(),
+            'switchovers': self.switchovers,
+            'switchover_failures': self.switchover_failures,
+            'last_switchover_s': self.last_switchover_s,
+        }
+
+
+class StreamRegistry:
+    """Реестр именованных потоков из web_config.yaml"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = {}
+        # Удаленные из конфигурации потоки, которые еще досматривают подключенные клиенты
+        self._retired = []
+        self.idle_timeout = DEFAULT_IDLE_TIMEOUT
+        self.synthetic = False
+
+    def load(self, streams, idle_timeout):
+        """Применяет конфигурацию: добавляет новые потоки, обновляет URL, убирает удаленные"""
+        with self._lock:
+            self.idle_timeout = idle_timeout
+            for stream_id, url in streams.items():
+                stream = self._streams.get(stream_id)
+                if stream is None:
+                    self._streams[stream_id] = VideoStream(stream_id, url, synthetic=self.synthetic)
+                else:
+                    stream.swap_source(url)
+            removed = [sid for sid in self._streams if sid not in streams]
+            for stream_id in removed:
+                self._retired.append(self._streams.pop(stream_id))
+
+    def get(self, stream_id):
+        with self._lock:
+            return self._streams.get(stream_id)
+
+    def streams(self):
+        with self._lock:
+            return list(self._streams.values())
+
+    def reap_idle(self):
+        """Фоновый цикл: останавливает readers потоков без зрителей"""
+        while True:
+            time.sleep(1.0)
+            for stream in self.streams():
+                # Сторож: поток без кадров дольше stall_timeout помечается как "нет сигнала"
+                if stream.running and stream.capture.check_stall():
+                    stream.alive.clear()
+                stream.stop_if_idle(self.idle_timeout)
+            with self._lock:
+                retired = list(self._retired)
+            for stream in retired:
+                stream.stop_if_idle(0)
+                if not stream.running:
+                    with self._lock:
+                        self._retired.remove(stream)
+
+
+registry = StreamRegistry()
+registry.load(*load_stream_config())
+
+
+def start_pipeline(synthetic=False):
+    """Настраивает реестр потоков; readers стартуют лениво при первом зрителе"""
+    if synthetic:
+        registry.synthetic = True
+        for stream in registry.streams():
+            stream.synthetic = True
+    threading.Thread(target=registry.reap_idle, daemon=True).start()
+
+
+def _register_client(stream, profile):
+    stats = {'id': next(_client_ids), 'stream': stream.stream_id, 'profile': profile._asdict(),
+             'sent': 0, 'skipped': 0, 'bytes': 0}
+    with client_stats_lock:
+        client_stats[id(stats)] = stats
+    return stats
+
+
+def _unregister_client(stats):
+    with client_stats_lock:
+        client_stats.pop(id(stats), None)
+        totals = finished_client_totals.setdefault(stats['stream'], {'sent': 0, 'skipped': 0, 'bytes': 0, 'clients': 0})
+        totals['sent'] += stats['sent']
+        totals['skipped'] += stats['skipped']
+        totals['bytes'] += stats['bytes']
+        totals['clients'] += 1
+    print(f"[MJPEG] Client of '{stats['stream']}' disconnected: sent {stats['sent']} frames, skipped {stats['skipped']}")
+
+
+def generate(stream, profile):
+    bus, unsubscribe = stream.subscribe(profile)
+    stats = _register_client(stream, profile)
+    try:
+        last_seq, current = bus.latest()
+        # Новому клиенту сразу отдаем последний кадр (или заглушку), дальше ждем новые
+        first = current if current is not None and stream.alive.is_set() else BLANK_PART
+        yield first
+        stats['sent'] += 1
+        stats['bytes'] += len(first)
+        while True:
+            nxt = bus.wait_next(last_seq, timeout=1.0)
+            if nxt is None:
+                continue
+            seq, part = nxt
+            # Номера идут подряд; разрыв означает, что клиент не успел за источником.
+            # Пока кадров не было (last_seq == 0), шина может начать с номера кадра источника
+            if last_seq:
+                stats['skipped'] += seq - last_seq - 1
+            last_seq = seq
+            yield part
+            stats['sent'] += 1
+            stats['bytes'] += len(part)
+    finally:
+        _unregister_client(stats)
+        unsubscribe()
+
+@app.route('/video', defaults={'stream_id': DEFAULT_STREAM_ID})
+@app.route('/video/<stream_id>')
+def video_feed(stream_id):
+    """MJPEG поток; ?w=&q=&fps= выбирают ширину, качество JPEG и частоту кадров"""
+    stream = registry.get(stream_id)
+    if stream is None:
+        abort(404)
+    try:
+        profile = parse_profile(request.args)
+    except ValueError:
+        abort(400)
+    return Response(generate(stream, profile),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/reload_config')
 def reload_config():
-    """Перезагружает RTSP URL из конфигурации"""
-    global RTSP_URL
-    RTSP_URL = get_rtsp_url()
-    return f"RTSP URL updated to: {RTSP_URL}"
+    """Перезагружает список потоков и их RTSP URL из конфигурации"""
+    registry.load(*load_stream_config())
+    return "Streams updated: " + ", ".join(f"{s.stream_id}={s.url}" for s in registry.streams())
+
+def _collect_stats():
+    with client_stats_lock:
+        clients = [dict(s) for s in client_stats.values()]
+    streams = {s.stream_id: s.snapshot() for s in registry.streams()}
+    return {'streams': streams, 'clients': clients}
+
+@app.route('/stats')
+def stats():
+    """Статистика потоков и клиентов /video: отправлено и пропущено кадров"""
+    return jsonify(_collect_stats())
+
+def _collect_metrics():
+    """Метрики потоков и клиентов, вычисляемые в момент запроса /metrics"""
+    with client_stats_lock:
+        clients = [dict(s) for s in client_stats.values()]
+        finished = {sid: dict(t) for sid, t in finished_client_totals.items()}
+    streams = registry.streams()
+
+    def per_stream(fn):
+        return [({'stream': st.stream_id}, fn(st)) for st in streams]
+
+    def client_total(stream_id, key):
+        live = sum(c[key] for c in clients if c['stream'] == stream_id)
+        return live + finished.get(stream_id, {}).get(key, 0)
+
+    snapshots = {st.stream_id: st.snapshot() for st in streams}
+    capture = {sid: snap['capture'] for sid, snap in snapshots.items()}
+    return [
+        ('mjpeg_stream_running', 'gauge', 'Whether the stream reader is running',
+         per_stream(lambda st: st.running)),
+        ('mjpeg_stream_up', 'gauge', 'Whether the stream currently delivers frames',
+         per_stream(lambda st: st.alive.is_set())),
+        ('mjpeg_decode_fps', 'gauge', 'Decoded frames per second (moving average)',
+         per_stream(lambda st: capture[st.stream_id]['fps'])),
+        ('mjpeg_decoded_frames_total', 'counter', 'Frames decoded from the source',
+         per_stream(lambda st: capture[st.stream_id]['frames'])),
+        ('mjpeg_capture_connect_attempts_total', 'counter', 'Capture open attempts (reconnects included)',
+         per_stream(lambda st: capture[st.stream_id]['connect_attempts'])),
+        ('mjpeg_capture_reconnects_total', 'counter', 'Successful reconnects after the first connect',
+         per_stream(lambda st: max(0, capture[st.stream_id]['connects'] - 1))),
+        ('mjpeg_capture_failed_opens_total', 'counter', 'Capture open failures',
+         per_stream(lambda st: capture[st.stream_id]['failed_opens'])),
+        ('mjpeg_capture_decode_errors_total', 'counter', 'Frame read/decode errors',
+         per_stream(lambda st: capture[st.stream_id]['decode_errors'])),
+        ('mjpeg_capture_stalls_total', 'counter', 'Detected stream stalls',
+         per_stream(lambda st: capture[st.stream_id]['stalls'])),
+        ('mjpeg_capture_seconds_since_last_frame', 'gauge', 'Seconds since the last decoded frame',
+         per_stream(lambda st: capture[st.stream_id]['seconds_since_last_frame'])),
+        ('mjpeg_capture_last_outage_seconds', 'gauge', 'Duration of the last outage until video was restored',
+         per_stream(lambda st: capture[st.stream_id]['last_outage_s'])),
+        ('mjpeg_source_switchovers_total', 'counter', 'Hot source switchovers',
+         per_stream(lambda st: st.switchovers)),
+        ('mjpeg_source_switchover_seconds', 'gauge', 'Duration of the last hot source switchover',
+         per_stream(lambda st: st.last_switchover_s)),
+        ('mjpeg_encoder_skipped_frames_total', 'counter', 'Source frames dropped by busy encoders',
+         [({'stream': sid, 'profile': profile_label(Profile(p['width'], p['quality'], p['fps']))}, p['skipped'])
+          for sid, snap in snapshots.items() for p in snap['profiles']]),
+        ('mjpeg_active_clients', 'gauge', 'Connected /video clients',
+         per_stream(lambda st: sum(1 for c in clients if c['stream'] == st.stream_id))),
+        ('mjpeg_clients_total', 'counter', 'Finished /video client sessions',
+         per_stream(lambda st: finished.get(st.stream_id, {}).get('clients', 0))),
+        ('mjpeg_frames_sent_total', 'counter', 'Frames sent to /video clients',
+         per_stream(lambda st: client_total(st.stream_id, 'sent'))),
+        ('mjpeg_frames_dropped_total', 'counter', 'Frames /video clients skipped because they fell behind',
+         per_stream(lambda st: client_total(st.stream_id, 'skipped'))),
+        ('mjpeg_bytes_sent_total', 'counter', 'Bytes sent to /video clients',
+         per_stream(lambda st: client_total(st.stream_id, 'bytes'))),
+        ('mjpeg_client_bytes_sent_total', 'counter', 'Bytes sent to each connected /video client',
+         [({'stream': c['stream'], 'client': c['id']}, c['bytes']) for c in clients]),
+        ('mjpeg_client_frames_dropped_total', 'counter', 'Frames skipped by each connected /video client',
+         [({'stream': c['stream'], 'client': c['id']}, c['skipped']) for c in clients]),
+    ]
+
+
+METRICS.register_collector(_collect_metrics)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики видеоконвейера в формате Prometheus"""
+    return Response(METRICS.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/streams')
+def streams_list():
+    """Список настроенных потоков"""
+    return jsonify({s.stream_id: {'url': s.url, 'running': s.running} for s in registry.streams()})
+
+
+# --- asyncio-режим: все клиенты /video обслуживаются одним event loop ---
+
+MJPEG_CONTENT_TYPE = 'multipart/x-mixed-replace; boundary=frame'
+
+
+async def video_feed_async(request):
+    from aiohttp import web
+
+    stream = registry.get(request.match_info.get('stream_id', DEFAULT_STREAM_ID))
+    if stream is None:
+        raise web.HTTPNotFound()
+    try:
+        profile = parse_profile(request.query)
+    except ValueError:
+        raise web.HTTPBadRequest()
+    resp = web.StreamResponse(headers={'Content-Type': MJPEG_CONTENT_TYPE, 'Cache-Control': 'no-cache'})
+    await resp.prepare(request)
+    bus, unsubscribe = stream.subscribe(profile)
+    stats = _register_client(stream, profile)
+    try:
+        last_seq, current = bus.latest()
+        first = current if current is not None and stream.alive.is_set() else BLANK_PART
+        await resp.write(first)
+        stats['sent'] += 1
+        stats['bytes'] += len(first)
+        while True:
+            nxt = await bus.wait_next_async(last_seq, timeout=1.0)
+            if nxt is None:
+                continue
+            seq, part = nxt
+            if last_seq:
+                stats['skipped'] += seq - last_seq - 1
+            last_seq = seq
+            # Медленный клиент ждет только свой сокет; остальные продолжают получать кадры
+            await resp.write(part)
+            stats['sent'] += 1
+            stats['bytes'] += len(part)
+    except ConnectionResetError:
+        pass
+    finally:
+        _unregister_client(stats)
+        unsubscribe()
+    return resp
+
+
+async def reload_config_async(request):
+    from aiohttp import web
+    return web.Response(text=reload_config())
+
+
+async def stats_async(request):
+    from aiohttp import web
+    return web.json_response(_collect_stats())
+
+
+async def metrics_async(request):
+    from aiohttp import web
+    return web.Response(body=METRICS.render().encode(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+async def streams_list_async(request):
+    from aiohttp import web
+    return web.json_response({s.stream_id: {'url': s.url, 'running': s.running} for s in registry.streams()})
+
+
+def run_async_server(host='0.0.0.0', port=5000):
+    """Запускает asyncio (aiohttp) сервер с теми же URL и форматом потока"""
+    from aiohttp import web
+
+    aio_app = web.Application()
+    aio_app.router.add_get('/video', video_feed_async)
+    aio_app.router.add_get('/video/{stream_id}', video_feed_async)
+    aio_app.router.add_get('/reload_config', reload_config_async)
+    aio_app.router.add_get('/stats', stats_async)
+    aio_app.router.add_get('/streams', streams_list_async)
+    aio_app.router.add_get('/metrics', metrics_async)
+    print(f"[MJPEG] Serving in asyncio mode on {host}:{port}")
+    web.run_app(aio_app, host=host, port=port, print=None)
+
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, threaded=True) 
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="MJPEG сервер для RTSP потока")
+    parser.add_argument('--mode', choices=['threaded', 'async'],
+                        default=os.environ.get('MJPEG_SERVER_MODE', 'threaded'),
+                        help="threaded: Flask, поток на клиента; async: aiohttp, один event loop")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--synthetic', action='store_true', help="синтетический источник вместо RTSP")
+    args = parser.parse_args()
+
+    start_pipeline(synthetic=args.synthetic)
+    if args.mode == 'async':
+        run_async_server(args.host, args.port)
+    else:
+        app.run(host=args.host, port=args.port, threaded=True) 
\ No newline at end of file
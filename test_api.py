@@ -67,6 +67,45 @@ def test_update_full_config():
     except Exception as e:
         print(f"Error: {e}")
 
+def test_batch_patch():
+    """Тестирует пакетное обновление (JSON Patch); старый API ответит 4xx"""
+    try:
+        operations = [
+            {"op": "replace", "path": "/cigarette/enable", "value": True},
+            {"op": "replace", "path": "/cigarette/threshold", "value": 0.8},
+        ]
+        response = requests.patch(
+            f"{API_BASE_URL}/config", json=operations,
+            headers={"Content-Type": "application/json-patch+json"}, timeout=10,
+        )
+        print(f"PATCH /config (batch): {response.status_code}")
+        if response.status_code == 200:
+            print(f"Batch applied: {response.json()}")
+        else:
+            print(f"Batch not applied: {response.text}")
+    except Exception as e:
+        print(f"Error: {e}")
+
+def test_section_patch():
+    """Тестирует обновление секции с проверкой версии (If-Match); старый API ответит 4xx"""
+    try:
+        response = requests.get(f"{API_BASE_URL}/config/fatigue", timeout=10)
+        etag = response.headers.get("ETag")
+        print(f"GET /config/fatigue: {response.status_code}, ETag: {etag}")
+        headers = {"Content-Type": "application/json-patch+json"}
+        if etag:
+            headers["If-Match"] = etag
+        operations = [{"op": "replace", "path": "/enable", "value": False}]
+        response = requests.patch(f"{API_BASE_URL}/config/fatigue", json=operations, headers=headers, timeout=10)
+        print(f"PATCH /config/fatigue: {response.status_code}")
+        if etag:
+            # Заведомо устаревшая версия — сервис должен отклонить запись
+            response = requests.patch(f"{API_BASE_URL}/config/fatigue", json=operations,
+                                      headers={**headers, "If-Match": '"stale"'}, timeout=10)
+            print(f"PATCH /config/fatigue with stale If-Match: {response.status_code} (expected 412)")
+    except Exception as e:
+        print(f"Error: {e}")
+
 if __name__ == "__main__":
     print("Testing API endpoints...")
     print("=" * 50)
@@ -80,4 +119,10 @@ if __name__ == "__main__":
     test_update_full_config()
     print()
     
+    test_batch_patch()
+    print()
+    
+    test_section_patch()
+    print()
+    
     print("Testing completed!")